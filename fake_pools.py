@@ -0,0 +1,170 @@
+from faker import Faker, VERSION as FAKER_VERSION
+
+import logging
+import mmap
+import os
+import random
+import struct
+import threading
+import zlib
+
+from generators import RNG
+
+# The Faker values MovR uses, and how to generate one of each.
+FAKE_FIELDS = {
+    'name': lambda datagen: datagen.name(),
+    'address': lambda datagen: datagen.address(),
+    'credit_card_number': lambda datagen: datagen.credit_card_number(),
+    'paragraph': lambda datagen: datagen.paragraph(),
+    'word': lambda datagen: datagen.word(),
+}
+
+DEFAULT_POOL_SIZE = 10000
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'movr')
+
+# an 8-byte magic and the number of values, so the offsets that follow are 8-byte aligned
+POOL_FILE_MAGIC = b'MOVRPL01'
+POOL_HEADER = struct.Struct('=8sQ')
+POOL_OFFSET = struct.Struct('=Q')
+
+
+class FakePool:
+    """A fixed set of distinct fake values for one field, sampled in O(1).
+
+    Pools are stored as a header, an array of n + 1 offsets and the concatenated UTF-8 values, so a cached pool can be
+    memory-mapped and sampled without reading the whole file."""
+
+    def __init__(self, buffer):
+        magic, self.count = POOL_HEADER.unpack_from(buffer, 0)
+        if magic != POOL_FILE_MAGIC:
+            raise ValueError("Not a MovR fake value pool.")
+        self.buffer = buffer
+        self.offsets = memoryview(buffer)[POOL_HEADER.size:POOL_HEADER.size + (self.count + 1) * POOL_OFFSET.size] \
+            .cast('Q')
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.buffer[self.offsets[index]:self.offsets[index + 1]].decode('utf-8')
+
+    def sample(self, rng=random):
+        return self[rng.randrange(self.count)]
+
+    def sample_many(self, n, rng=None):
+        return [self[index] for index in (rng or RNG).integers(0, self.count, n).tolist()]
+
+    @staticmethod
+    def serialize(values):
+        encoded = [value.encode('utf-8') for value in values]
+        offset = POOL_HEADER.size + (len(encoded) + 1) * POOL_OFFSET.size
+        offsets = [offset]
+        for value in encoded:
+            offset += len(value)
+            offsets.append(offset)
+        return POOL_HEADER.pack(POOL_FILE_MAGIC, len(encoded)) + \
+            b''.join(POOL_OFFSET.pack(offset) for offset in offsets) + b''.join(encoded)
+
+    @staticmethod
+    def generate(field, size, datagen):
+        # Faker is seeded per field, so that a pool holds the same values on every machine with this Faker version.
+        datagen.seed_instance(zlib.crc32(field.encode('utf-8')))
+        # Stop early if the field has fewer distinct values than requested (e.g. words), instead of looping forever.
+        values = {}
+        attempts = 0
+        while len(values) < size and attempts < size * 3:
+            values[FAKE_FIELDS[field](datagen)] = None
+            attempts += 1
+        return list(values)
+
+    @staticmethod
+    def load(field, size, cache_dir, locale=None):
+        """The pool for a field, read from the cache directory if it was generated before, or generated and cached."""
+        path = os.path.join(cache_dir, '{0}-{1}-{2}-faker{3}.pool'.format(field, size, locale or 'default',
+                                                                          FAKER_VERSION))
+        if not os.path.exists(path):
+            logging.info("Generating %d fake values for '%s'...", size, field)
+            data = FakePool.serialize(FakePool.generate(field, size, Faker(locale)))
+            os.makedirs(cache_dir, exist_ok=True)
+            # write to a temporary file first, so other processes never map a partially written pool
+            temporary_path = '{0}.{1}.tmp'.format(path, os.getpid())
+            with open(temporary_path, 'wb') as f:
+                f.write(data)
+            os.replace(temporary_path, path)
+        with open(path, 'rb') as f:
+            return FakePool(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+class FakeData:
+    """Stands in for a Faker instance for the values MovR generates, drawing them from precomputed pools.
+
+    A field with a pool size of 0 is generated by Faker on every call instead."""
+
+    def __init__(self, pool_sizes, cache_dir=DEFAULT_CACHE_DIR, locale=None):
+        self.datagen = Faker(locale)
+        self.pools = {field: FakePool.load(field, size, cache_dir, locale)
+                      for field, size in pool_sizes.items() if size > 0}
+
+    def get(self, field):
+        pool = self.pools.get(field)
+        return pool.sample() if pool else FAKE_FIELDS[field](self.datagen)
+
+    # n values for a field, for loaders that build a column at a time. Only pooled fields are drawn from rng.
+    def sample_many(self, field, n, rng=None):
+        pool = self.pools.get(field)
+        return pool.sample_many(n, rng) if pool else [FAKE_FIELDS[field](self.datagen) for i in range(n)]
+
+    def name(self):
+        return self.get('name')
+
+    def address(self):
+        return self.get('address')
+
+    def credit_card_number(self):
+        return self.get('credit_card_number')
+
+    def paragraph(self):
+        return self.get('paragraph')
+
+    def words(self, nb=3):
+        return [self.get('word') for i in range(nb)]
+
+
+##################
+# SHARED POOLS
+#################
+
+FAKE_DATA = None
+FAKE_DATA_LOCK = threading.Lock()
+FAKE_DATA_SETTINGS = {'pool_sizes': {field: DEFAULT_POOL_SIZE for field in FAKE_FIELDS}, 'cache_dir': DEFAULT_CACHE_DIR}
+
+
+def configure_fake_pools(pool_sizes=None, cache_dir=DEFAULT_CACHE_DIR):
+    # Must be called before the first call to get_fake_data.
+    global FAKE_DATA
+    FAKE_DATA = None
+    FAKE_DATA_SETTINGS.update({'pool_sizes': dict(pool_sizes if pool_sizes is not None
+                                                  else FAKE_DATA_SETTINGS['pool_sizes']),
+                               'cache_dir': cache_dir})
+
+
+def get_fake_data():
+    global FAKE_DATA
+    with FAKE_DATA_LOCK:
+        if FAKE_DATA is None:
+            FAKE_DATA = FakeData(**FAKE_DATA_SETTINGS)
+        return FAKE_DATA
+
+
+# Parses the values of --fake-pool-size: either a size for every field, or <field>=<size> for one field.
+def parse_pool_sizes(values):
+    pool_sizes = {field: DEFAULT_POOL_SIZE for field in FAKE_FIELDS}
+    for value in values or []:
+        field, _, size = value.rpartition('=')
+        if field and field not in FAKE_FIELDS:
+            raise ValueError("Unknown fake value field '{0}'. Use one of {1}.".format(field, list(FAKE_FIELDS)))
+        if not size.isdigit():
+            raise ValueError("Invalid fake value pool size '{0}'.".format(value))
+        for f in ([field] if field else FAKE_FIELDS):
+            pool_sizes[f] = int(size)
+    return pool_sizes
@@ -1,6 +1,18 @@
-import uuid, random
+import uuid, random, os, hashlib
+import numpy
 #@todo: how to do this in the database?
 
+VEHICLE_TYPES = ['skateboard', 'bike', 'scooter']
+VEHICLE_COLORS = ['red', 'yellow', 'blue', 'green', 'black']
+VEHICLE_STATUSES = ['available', 'in_use', 'lost']
+VEHICLE_STATUS_WEIGHTS = [.4, .55, .05]
+BIKE_BRANDS = ['Merida','Fuji'
+    'Cervelo', 'Pinarello',
+    'Santa Cruz', 'Kona', 'Schwinn']
+
+# the numpy random generator the batch generators use unless they are given one
+RNG = numpy.random.default_rng()
+
 
 #@todo: we shouldnt repeat the word generator in the class methods
 class MovRGenerator:
@@ -14,15 +26,15 @@ class MovRGenerator:
 
     @staticmethod
     def generate_random_vehicle():
-        return random.choice(['skateboard', 'bike', 'scooter'])
+        return random.choice(VEHICLE_TYPES)
 
     @staticmethod
     def get_vehicle_availability():
-        return MovRGenerator.weighted_choice([("available", .4), ("in_use", .55), ("lost", .05)])
+        return MovRGenerator.weighted_choice(list(zip(VEHICLE_STATUSES, VEHICLE_STATUS_WEIGHTS)))
 
     @staticmethod
     def generate_random_color():
-        return random.choice(['red', 'yellow', 'blue', 'green', 'black'])
+        return random.choice(VEHICLE_COLORS)
 
     @staticmethod
     def generate_random_latlong():
@@ -31,9 +43,7 @@ class MovRGenerator:
 
     @staticmethod
     def gen_bike_brand():
-        return random.choice(['Merida','Fuji'
-        'Cervelo', 'Pinarello',
-        'Santa Cruz', 'Kona', 'Schwinn'])
+        return random.choice(BIKE_BRANDS)
 
     @staticmethod
     def generate_vehicle_metadata(type):
@@ -52,4 +62,78 @@ class MovRGenerator:
             if n < weight:
                 return item
             n = n - weight
-        return item
\ No newline at end of file
+        return item
+
+    ##################
+    # BATCH GENERATORS
+    #################
+
+    # Vectorized versions of the generators above. Each one returns a whole column of n values at once, drawn from a
+    # numpy Generator (by default a shared one), for loaders that build many rows per chunk.
+
+    @staticmethod
+    def seeded_rng(seed, *key):
+        """An independent numpy Generator for one part of a dataset, identified by a key of strings and ints such as
+        (city, table, chunk). The same seed and key always give the same stream. Returns None, i.e. the shared
+        unseeded generator, if seed is None."""
+        if seed is None:
+            return None
+        # hash strings to stable ints; Python's hash() of a str changes between processes
+        spawn_key = tuple(part if isinstance(part, int) else
+                          int.from_bytes(hashlib.sha256(str(part).encode('utf-8')).digest()[:8], 'little')
+                          for part in key)
+        return numpy.random.default_rng(numpy.random.SeedSequence(seed, spawn_key=spawn_key))
+
+    @staticmethod
+    def generate_uuid_bytes(n, rng=None):
+        """n random (version 4) UUIDs, packed as 16 bytes each into a single bytes object."""
+        block = os.urandom(16 * n) if rng is None else rng.bytes(16 * n)
+        ids = numpy.frombuffer(block, dtype=numpy.uint8).reshape(n, 16).copy()
+        ids[:, 6] = (ids[:, 6] & 0x0f) | 0x40  # version 4
+        ids[:, 8] = (ids[:, 8] & 0x3f) | 0x80  # RFC 4122 variant
+        return ids.tobytes()
+
+    @staticmethod
+    def format_uuids(block):
+        """The string forms of the UUIDs packed in a bytes object."""
+        digits = block.hex()
+        return ["%s-%s-%s-%s-%s" % (digits[i:i + 8], digits[i + 8:i + 12], digits[i + 12:i + 16],
+                                    digits[i + 16:i + 20], digits[i + 20:i + 32])
+                for i in range(0, len(digits), 32)]
+
+    @staticmethod
+    def generate_uuids(n, rng=None):
+        return MovRGenerator.format_uuids(MovRGenerator.generate_uuid_bytes(n, rng))
+
+    @staticmethod
+    def generate_revenues(n, rng=None):
+        return (rng or RNG).uniform(1, 100, n).tolist()
+
+    @staticmethod
+    def generate_random_vehicles(n, rng=None):
+        return (rng or RNG).choice(VEHICLE_TYPES, n).tolist()
+
+    @staticmethod
+    def get_vehicle_availabilities(n, rng=None):
+        return (rng or RNG).choice(VEHICLE_STATUSES, n, p=VEHICLE_STATUS_WEIGHTS).tolist()
+
+    @staticmethod
+    def generate_random_latlongs(n, rng=None):
+        """Two lists of n values: the latitudes and the longitudes."""
+        rng = rng or RNG
+        return rng.uniform(-180, 180, n).tolist(), rng.uniform(-90, 90, n).tolist()
+
+    @staticmethod
+    def generate_vehicle_metadatas(types, rng=None):
+        rng = rng or RNG
+        colors = rng.choice(VEHICLE_COLORS, len(types)).tolist()
+        brands = rng.choice(BIKE_BRANDS, len(types)).tolist()
+        return [{'color': color, 'brand': brand} if type == 'bike' else {'color': color}
+                for type, color, brand in zip(types, colors, brands)]
+
+    @staticmethod
+    def generate_timestamps(n, base_time, low, high, unit='D', rng=None):
+        """n timestamps at a random whole number of `unit`s (a numpy timedelta unit) in [low, high] from base_time.
+        base_time is a datetime, or a list of n datetimes."""
+        offsets = (rng or RNG).integers(low, high + 1, n).astype('timedelta64[%s]' % unit)
+        return (numpy.array(base_time, dtype='datetime64[us]') + offsets).tolist()
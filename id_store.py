@@ -0,0 +1,130 @@
+import numpy
+import random
+import sys
+import threading
+import uuid
+from generators import MovRGenerator, RNG
+
+UUID_SIZE = 16
+
+
+class IdStore:
+    """A compact collection of UUIDs to pick foreign keys from.
+
+    Ids are kept as raw 16-byte values in a single bytearray, instead of as a list of strings or ORM objects."""
+
+    def __init__(self):
+        self.ids = bytearray()
+
+    def __len__(self):
+        return len(self.ids) // UUID_SIZE
+
+    # add one id, given as a string
+    def add(self, id):
+        self.ids += uuid.UUID(str(id)).bytes
+
+    # overwrite the id at a position, given as a string
+    def replace(self, index, id):
+        self.ids[index * UUID_SIZE:(index + 1) * UUID_SIZE] = uuid.UUID(str(id)).bytes
+
+    def extend(self, ids):
+        for id in ids:
+            self.add(id)
+
+    # add ids that are already packed 16 bytes each, e.g. by MovRGenerator.generate_uuid_bytes
+    def extend_bytes(self, block):
+        self.ids += block
+
+    # put the ids in byte order, so that sampling with a seeded generator picks the same ids no matter in which order
+    # they were added
+    def sort(self):
+        self.ids = bytearray(numpy.sort(numpy.frombuffer(self.ids, dtype='S%d' % UUID_SIZE)).tobytes())
+
+    # a uniformly random id, as a string
+    def sample(self, rng=random):
+        if not len(self):
+            raise IndexError("Cannot sample from an empty id store.")
+        offset = rng.randrange(len(self)) * UUID_SIZE
+        return str(uuid.UUID(bytes=bytes(self.ids[offset:offset + UUID_SIZE])))
+
+    # n uniformly random ids (with replacement), as strings
+    def sample_many(self, n, rng=None):
+        if not len(self):
+            raise IndexError("Cannot sample from an empty id store.")
+        return self.get_many((rng or RNG).integers(0, len(self), n).tolist())
+
+    # the ids at the given positions, as strings
+    def get_many(self, indexes):
+        ids = self.ids
+        return MovRGenerator.format_uuids(b''.join(ids[index * UUID_SIZE:(index + 1) * UUID_SIZE]
+                                                   for index in indexes))
+
+    def memory_usage(self):
+        return sys.getsizeof(self.ids)
+
+
+class ValueStore:
+    """A list of strings with the interface of IdStore, for values that aren't UUIDs, such as promo codes."""
+
+    def __init__(self):
+        self.values = []
+        self.value_bytes = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value):
+        self.values.append(value)
+        self.value_bytes += sys.getsizeof(value)
+
+    def replace(self, index, value):
+        self.value_bytes += sys.getsizeof(value) - sys.getsizeof(self.values[index])
+        self.values[index] = value
+
+    def sample(self, rng=random):
+        if not self.values:
+            raise IndexError("Cannot sample from an empty value store.")
+        return self.values[rng.randrange(len(self.values))]
+
+    def memory_usage(self):
+        return sys.getsizeof(self.values) + self.value_bytes
+
+
+class IdPool:
+    """The ids of one kind of entity that the workload picks from while it runs, safe to share between threads.
+
+    A pool holds at most `capacity` ids (None for no limit). Once it is full, the n-th id added replaces a random one
+    with probability capacity / n (reservoir sampling), so the pool stays a uniform sample of every id it was offered
+    while its memory stays fixed."""
+
+    def __init__(self, capacity=None, store=None):
+        self.capacity = capacity
+        self.store = IdStore() if store is None else store
+        self.offered = 0
+        self.mutex = threading.Lock()
+
+    def __len__(self):
+        return len(self.store)
+
+    def add(self, id):
+        with self.mutex:
+            self.offered += 1
+            if self.capacity is None or len(self.store) < self.capacity:
+                self.store.add(id)
+            else:
+                index = random.randrange(self.offered)
+                if index < self.capacity:
+                    self.store.replace(index, id)
+
+    def extend(self, ids):
+        for id in ids:
+            self.add(id)
+
+    def sample(self):
+        with self.mutex:
+            return self.store.sample()
+
+    # the approximate number of bytes the pool's ids take up
+    def memory_usage(self):
+        with self.mutex:
+            return self.store.memory_usage()
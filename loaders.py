@@ -0,0 +1,225 @@
+from sqlalchemy import Column, Integer, MetaData, PrimaryKeyConstraint, String, Table, select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy_cockroachdb import run_transaction
+
+import datetime
+import gzip
+import io
+import json
+import os
+
+LOAD_METHODS = ['orm', 'insert', 'copy']
+FILE_FORMATS = ['csv', 'parquet']
+# the characters that make a CSV field need quotes
+CSV_SPECIAL_CHARACTERS = ',"\r\n'
+
+# The progress journal of the last 'load': one row per committed chunk of a table. It isn't part of the MovR schema,
+# so it has its own metadata and survives the reset of the MovR tables.
+JOURNAL_METADATA = MetaData()
+LOAD_JOURNAL = Table(
+    'movr_load_journal', JOURNAL_METADATA,
+    Column('table_name', String, nullable=False),
+    Column('city', String, nullable=False),
+    Column('chunk_start', Integer, nullable=False),
+    Column('row_count', Integer, nullable=False),
+    PrimaryKeyConstraint('table_name', 'city', 'chunk_start'))
+
+
+# Loaders write one chunk of generated rows per transaction. Rows are plain tuples, in the order of `columns`.
+# If a checkpoint (a row of the load journal) is given, it is inserted in the same transaction as the chunk, so a chunk
+# is journaled if and only if its rows were committed.
+
+
+class ORMLoader:
+    """Builds a model object per row and saves them with the ORM's bulk_save_objects."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.sessionmaker = sessionmaker(bind=engine)
+
+    def write(self, model, columns, rows, checkpoint=None):
+        def write_helper(session):
+            session.bulk_save_objects([model(**dict(zip(columns, row))) for row in rows])
+            record_checkpoint(session, checkpoint)
+
+        run_transaction(self.sessionmaker, write_helper)
+
+
+class InsertLoader:
+    """Writes rows with multi-row INSERT ... VALUES statements, without building model objects."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def write(self, model, columns, rows, checkpoint=None):
+        statement = model.__table__.insert()
+
+        def write_helper(conn):
+            # executemany lets the driver batch the parameters into multi-row VALUES lists
+            conn.execute(statement, [dict(zip(columns, row)) for row in rows])
+            record_checkpoint(conn, checkpoint)
+
+        run_transaction(self.engine, write_helper)
+
+
+class CopyLoader:
+    """Streams rows to COPY ... FROM STDIN in CSV format, without building model objects or statements."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def write(self, model, columns, rows, checkpoint=None):
+        statement = 'COPY {0} ({1}) FROM STDIN WITH CSV'.format(
+            model.__tablename__, ', '.join('"{0}"'.format(column) for column in columns))
+
+        def copy_helper(conn):
+            # build the buffer inside the transaction, so a retried transaction streams it again from the start
+            cursor = conn.connection.cursor()
+            try:
+                cursor.copy_expert(statement, io.StringIO(to_csv(rows)))
+            except conn.dialect.dbapi.Error as e:
+                # copy_expert bypasses SQLAlchemy, so wrap the driver error the way SQLAlchemy would, or
+                # run_transaction won't see a 40001 as retryable
+                raise DBAPIError.instance(statement, None, e, conn.dialect.dbapi.Error, dialect=conn.dialect) from e
+            finally:
+                cursor.close()
+            record_checkpoint(conn, checkpoint)
+
+        run_transaction(self.engine, copy_helper)
+
+
+# File writers stand in for a loader when generating a dataset without a database. Each chunk becomes its own part
+# file, <out_dir>/<table>/<city>-<chunk start>.<extension>, named after the chunk's checkpoint. Parts are written to a
+# temporary file first, so a part that exists is always complete.
+
+
+class FileWriter:
+
+    extension = None
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+
+    def write(self, model, columns, rows, checkpoint=None):
+        directory = os.path.join(self.out_dir, model.__tablename__)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '{0}-{1:012d}.{2}'.format(
+            (checkpoint['city'] or 'global').replace(' ', '_'), checkpoint['chunk_start'], self.extension))
+        temporary_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        self.write_part(temporary_path, columns, rows)
+        os.replace(temporary_path, path)
+
+    def write_part(self, path, columns, rows):
+        raise NotImplementedError
+
+
+class CsvFileWriter(FileWriter):
+    """Writes gzip-compressed CSV parts without a header, in the format COPY and IMPORT INTO read."""
+
+    extension = 'csv.gz'
+
+    def write_part(self, path, columns, rows):
+        with gzip.open(path, 'wt', compresslevel=6, newline='') as f:
+            f.write(to_csv(rows))
+
+
+class ParquetFileWriter(FileWriter):
+    """Writes Parquet parts. Needs pyarrow, which MovR doesn't otherwise depend on."""
+
+    extension = 'parquet'
+
+    def __init__(self, out_dir):
+        super().__init__(out_dir)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError("Writing Parquet files needs pyarrow. Install it with 'pip install pyarrow'.")
+        self.pyarrow = pyarrow
+
+    def write_part(self, path, columns, rows):
+        values = zip(*rows) if rows else [[] for column in columns]
+        table = self.pyarrow.table({column: [json.dumps(value) if isinstance(value, dict) else value
+                                             for value in column_values]
+                                    for column, column_values in zip(columns, values)})
+        self.pyarrow.parquet.write_table(table, path)
+
+
+# conn is a Session or a Connection
+def record_checkpoint(conn, checkpoint):
+    if checkpoint is not None:
+        conn.execute(LOAD_JOURNAL.insert(), checkpoint)
+
+
+class LoadJournal:
+    """The chunks of each table a load has committed, so an interrupted load can continue where it stopped."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.completed = set()
+
+    # start a new journal, forgetting the chunks of any earlier load
+    def reset(self):
+        LOAD_JOURNAL.drop(bind=self.engine, checkfirst=True)
+        LOAD_JOURNAL.create(bind=self.engine)
+
+    # read the chunks committed so far. Returns the number of rows they hold.
+    def read(self):
+        LOAD_JOURNAL.create(bind=self.engine, checkfirst=True)
+        row_count = 0
+        with self.engine.connect() as conn:
+            for table_name, city, chunk_start, count in conn.execute(select(LOAD_JOURNAL)):
+                self.completed.add((table_name, city, chunk_start))
+                row_count += count
+        return row_count
+
+    # promo codes don't belong to a city, and are journaled with an empty one
+    def is_completed(self, model, city, chunk_start):
+        return (model.__tablename__, city or '', chunk_start) in self.completed
+
+    def checkpoint(self, model, city, chunk_start, row_count):
+        return {'table_name': model.__tablename__, 'city': city or '', 'chunk_start': chunk_start,
+                'row_count': row_count}
+
+
+def to_csv(rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(','.join(format_csv_value(value) for value in row))
+        buffer.write('\r\n')
+    return buffer.getvalue()
+
+
+# None is written as an unquoted empty field, which COPY reads as NULL, and an empty string as a quoted one, which it
+# reads as an empty string, like the orm and insert load methods store it. csv.writer writes both as an unquoted field.
+def format_csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, dict):
+        value = json.dumps(value)
+    elif isinstance(value, datetime.datetime):
+        value = value.isoformat(' ')
+    else:
+        value = str(value)
+    if not value or any(c in value for c in CSV_SPECIAL_CHARACTERS):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def get_loader(load_method, engine):
+    if load_method == 'orm':
+        return ORMLoader(engine)
+    elif load_method == 'insert':
+        return InsertLoader(engine)
+    elif load_method == 'copy':
+        return CopyLoader(engine)
+    raise ValueError("Unknown load method '{0}'. Use one of {1}.".format(load_method, LOAD_METHODS))
+
+
+def get_file_writer(file_format, out_dir):
+    if file_format == 'csv':
+        return CsvFileWriter(out_dir)
+    elif file_format == 'parquet':
+        return ParquetFileWriter(out_dir)
+    raise ValueError("Unknown file format '{0}'. Use one of {1}.".format(file_format, FILE_FORMATS))
@@ -1,209 +1,563 @@
 #!/usr/bin/python
 
-from movr import MovR
+from movr import FOLLOWER_READ_MODES, FOLLOWER_READ_SETTINGS, MovR, POOL_SETTINGS, READ_CACHE_SETTINGS, \
+    TRANSACTION_TIMINGS, TXN_STYLES, TransactionTimings, configure_connection_pool, configure_follower_reads, \
+    configure_read_cache, discard_engines, get_error_class, get_read_cache
 from generators import MovRGenerator
 import argparse
+import asyncio
+import collections
 import sys
 import os
 import time
 import datetime
 import random
 import math
+import multiprocessing
+import queue
 import signal
 import threading
 import re
 import logging
-from faker import Faker
-from models import User, Vehicle, Ride, VehicleLocationHistory, PromoCode
+import shlex
+from models import User, Vehicle, Ride, VehicleLocationHistory, PromoCode, UserPromoCode
 from sqlalchemy_cockroachdb import run_transaction
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
 from sqlalchemy.exc import DBAPIError
 from urllib.parse import parse_qs, urlsplit, urlunsplit, urlencode
-from movr_stats import MovRStats
+from movr_stats import MovRStats, print_window_summary
+from movr_metrics import open_metrics_sinks
+from tabulate import tabulate
+from loaders import FILE_FORMATS, LOAD_METHODS, LoadJournal, get_file_writer, get_loader
+from id_store import IdPool, IdStore, ValueStore
+from fake_pools import DEFAULT_CACHE_DIR, DEFAULT_POOL_SIZE, FAKE_DATA_SETTINGS, configure_fake_pools, get_fake_data, \
+    parse_pool_sizes
+from workload import ACTION_ADD_VEHICLE, ACTION_APPLY_CODE, ACTION_END_RIDE, ACTION_GET_VEHICLES, ACTION_NEW_CODE, \
+    ACTION_NEW_USER, ACTION_START_RIDE, DEFAULT_RIDE_DURATION, DEFAULT_RIDE_REPORT_INTERVAL, PROFILES, RideLifecycle, \
+    get_workload_mix
 
 
 RUNNING_THREADS = []
 TERMINATE_GRACEFULLY = False
 DEFAULT_READ_PERCENTAGE = .95
+LOG_FORMAT = '[%(levelname)s] (%(threadName)-10s) %(message)s'
+STATS_WINDOW_SECONDS = 15
+# the most location reports that are due that one tick logs; later ones wait for the next tick
+MAX_LOCATION_REPORTS_PER_TICK = 10
+MAX_RIDE_ENDS_PER_TICK = 10
+DEFAULT_ID_POOL_SIZE = 100000
+# where the parent process publishes every stats window and the summary of the run, besides printing them
+METRICS_SINKS = []
 
 # @todo: add checks for multi-region operations on single region schemas.
 
-ACTION_ADD_VEHICLE = "add vehicle"
-ACTION_GET_VEHICLES = "get vehicles"
+# the actions a tick chooses from are defined with the workload mix; these are the ones every write tick adds
 ACTION_UPDATE_RIDE_LOC = "log ride location"
-ACTION_NEW_CODE = "new promo code"
-ACTION_APPLY_CODE = "apply promo code"
-ACTION_NEW_USER = "new user"
-ACTION_START_RIDE = "start ride"
-ACTION_END_RIDE = "end ride"
+ACTION_UPDATE_RIDE_LOCS = "log ride locations"
+# with '--target-rate': a tick that started late because every worker was busy, recorded with how late it started
+ACTION_MISSED_START = "missed start"
 
+RUN_ACTIONS = [ACTION_ADD_VEHICLE, ACTION_GET_VEHICLES, ACTION_UPDATE_RIDE_LOC, ACTION_UPDATE_RIDE_LOCS,
+               ACTION_NEW_CODE, ACTION_APPLY_CODE, ACTION_NEW_USER, ACTION_START_RIDE, ACTION_END_RIDE,
+               ACTION_MISSED_START]
 
+ARRIVAL_PROCESSES = ['fixed', 'poisson']
+# how late a scheduled tick may start before it counts as missed, so sleep jitter isn't reported
+MISSED_START_TOLERANCE_SECONDS = .005
+# how long a stopped run waits for its threads or processes to finish their operations
+SHUTDOWN_GRACE_PERIOD_SECONDS = 15
+
+
+# ctrl + c only asks the threads, tasks and worker processes to stop after their current operation or chunk, so a
+# stopped load still reports what it didn't finish and a stopped run still reports its summary. A second ctrl + c
+# exits right away.
 def signal_handler(sig, frame):
     global TERMINATE_GRACEFULLY
-    grace_period = 15
-    logging.info(
-        'Waiting at most %d seconds for threads to shutdown...', grace_period)
+    if TERMINATE_GRACEFULLY:
+        logging.info("Killing threads.")
+        os._exit(1)
+    logging.info("Shutting down gracefully. Press ctrl + c again to exit right away.")
     TERMINATE_GRACEFULLY = True
 
-    start = time.time()
-    while threading.active_count() > 1:
-        if (time.time() - start) > grace_period:
-            logging.info("Grace period has passed. Killing threads.")
-            os._exit(1)
-        else:
-            time.sleep(.1)
 
-    logging.info("Shutting down gracefully.")
-    sys.exit(0)
+# Sleep for `seconds`, or until ctrl + c. Returns False once the workload is stopping.
+def sleep_unless_terminated(seconds):
+    end = time.time() + seconds
+    while time.time() < end and not TERMINATE_GRACEFULLY:
+        time.sleep(min(end - time.time(), .1))
+    return not TERMINATE_GRACEFULLY
 
-# Create a connection to the movr database and populate a set of cities with rides, vehicles, and users.
 
+# After ctrl + c, wait at most the grace period for the threads or processes of a run to stop. Returns False if some
+# didn't.
+def wait_for_workers(workers):
+    deadline = time.time() + SHUTDOWN_GRACE_PERIOD_SECONDS
+    for worker in workers:
+        worker.join(max(deadline - time.time(), 0))
+    return not any(worker.is_alive() for worker in workers)
 
-def load_movr_data(conn_string, num_users, num_vehicles, num_rides, num_histories, num_promo_codes_per_thread, cities, echo_sql=False):
-    if num_users <= 0 or num_rides <= 0 or num_vehicles <= 0:
-        raise ValueError("The number of objects to generate must be > 0.")
+# Create a connection to the movr database and populate a set of cities with rides, vehicles, and users.
 
-    start_time = time.time()
+
+def load_movr_data(conn_string, num_users, num_vehicles, num_rides, num_histories, num_promo_codes, cities, num_threads,
+                   echo_sql=False, load_method='orm', skip_reload_tables=False, resume=False, promo_code_offset=0,
+                   seed=None):
     with MovR(conn_string, echo=echo_sql) as movr:
-        engine = create_engine(
-            conn_string, echo=echo_sql)
-        for city in cities:
-            if TERMINATE_GRACEFULLY:
-                logging.debug("Terminating...")
-                break
-
-            logging.info("Generating user data for %s...", city)
-            add_users(engine, num_users, city)
-            logging.info("Generating vehicle data for %s...", city)
-            add_vehicles(engine, num_vehicles, city)
-            logging.info("Generating ride data for %s...", city)
-            add_rides(engine, num_rides, city)
-            logging.info("Generating location history data for %s...", city)
-            add_vehicle_location_histories(engine, num_histories, city)
-            logging.info("Populated %s in %f seconds.",
-                         city, time.time() - start_time)
-
-        logging.info("Generating %s promo codes...",
-                     num_promo_codes_per_thread)
-        add_promo_codes(engine, num_promo_codes_per_thread)
-
-    return
+        loader = get_loader(load_method, movr.engine)
+        journal = LoadJournal(movr.engine)
+        if resume:
+            logging.info("Resuming a load with %d rows already committed.", journal.read())
+
+        # the ids generated for each city, which the rows of the following tables pick their foreign keys from
+        user_ids = {city: IdStore() for city in cities}
+        vehicle_ids = {city: IdStore() for city in cities}
+        ride_ids = {city: IdStore() for city in cities}
+        if skip_reload_tables or resume:
+            # also reference the rows that are already in the existing tables
+            for city in cities:
+                logging.info("Reading existing ids for %s...", city)
+                for model, ids in [(User, user_ids), (Vehicle, vehicle_ids), (Ride, ride_ids)]:
+                    ids[city].extend(get_existing_ids(movr.engine, model, city))
+
+        stopped_stage = run_load_stages(loader, journal, cities, num_users, num_vehicles, num_rides, num_histories,
+                                        num_promo_codes, num_threads, user_ids, vehicle_ids, ride_ids,
+                                        promo_code_offset=promo_code_offset, seed=seed)
+        if stopped_stage:
+            logging.warning("The load stopped while loading %s. To continue from the last committed chunk, run: %s",
+                            stopped_stage, get_resume_command())
+            return False
+        return True
+
+
+# the command line of this load, with '--resume'
+def get_resume_command():
+    argv = [sys.executable] + sys.argv
+    if '--resume' not in argv:
+        argv.append('--resume')
+    return ' '.join(shlex.quote(arg) for arg in argv)
+
+
+# Write a set of cities' rows to part files in out_dir, without a database.
+
+
+def generate_movr_data(out_dir, file_format, num_users, num_vehicles, num_rides, num_histories, num_user_promo_codes,
+                       promo_codes, cities, num_threads, seed=None):
+    writer = get_file_writer(file_format, out_dir)
+    # the promo codes were generated before the cities, so that every city picks from all of them
+    stopped_stage = run_load_stages(writer, LoadJournal(None), cities, num_users, num_vehicles, num_rides,
+                                    num_histories, 0, num_threads,
+                                    {city: IdStore() for city in cities}, {city: IdStore() for city in cities},
+                                    {city: IdStore() for city in cities}, num_user_promo_codes=num_user_promo_codes,
+                                    promo_codes=promo_codes, seed=seed)
+    if stopped_stage:
+        logging.warning("Generating the dataset stopped while writing %s.", stopped_stage)
+        return False
+    return True
+
+
+# Load every table of a set of cities with `loader`, picking foreign keys from (and adding to) the given id stores and
+# list of promo codes. Returns None once every stage has finished, or the stage that was stopped.
+
+
+def run_load_stages(loader, journal, cities, num_users, num_vehicles, num_rides, num_histories, num_promo_codes,
+                    num_threads, user_ids, vehicle_ids, ride_ids, num_user_promo_codes=0, promo_codes=None,
+                    promo_code_offset=0, seed=None):
+    promo_codes = [] if promo_codes is None else promo_codes
+    # Each stage only starts once the previous one has finished, since its rows reference the rows loaded before.
+    # Within a stage, the rows of every city are split into ranges that the threads load at the same time.
+    # Each stage also lists the ids it generates, if any.
+    stages = [
+        ("users", cities, num_users, USER_CHUNK_SIZE, user_ids,
+         lambda city, start, end: add_users(loader, journal, city, start, end, user_ids[city], seed)),
+        ("vehicles", cities, num_vehicles, VEHICLE_CHUNK_SIZE, vehicle_ids,
+         lambda city, start, end: add_vehicles(loader, journal, city, start, end, user_ids[city],
+                                               vehicle_ids[city], seed)),
+        ("rides", cities, num_rides, RIDE_CHUNK_SIZE, ride_ids,
+         lambda city, start, end: add_rides(loader, journal, city, start, end, user_ids[city], vehicle_ids[city],
+                                            ride_ids[city], seed)),
+        ("location histories", cities, num_histories, HISTORY_CHUNK_SIZE, {},
+         lambda city, start, end: add_vehicle_location_histories(loader, journal, city, start, end,
+                                                                 ride_ids[city], seed)),
+    ]
+    if num_promo_codes:
+        # promo codes don't belong to a city. Each worker process loads its own range of them.
+        stages.append(
+            ("promo codes", [None], num_promo_codes, PROMO_CODE_CHUNK_SIZE, {None: promo_codes},
+             lambda city, start, end: add_promo_codes(loader, journal, promo_code_offset + start,
+                                                      promo_code_offset + end, seed, promo_codes)))
+    if num_user_promo_codes:
+        stages.append(
+            ("user promo codes", cities, num_user_promo_codes, USER_PROMO_CODE_CHUNK_SIZE, {},
+             lambda city, start, end: add_user_promo_codes(loader, journal, city, start, end, user_ids[city],
+                                                           promo_codes, seed)))
+
+    for stage, stage_cities, count, chunk_size, stage_ids, load_range in stages:
+        if not run_load_stage(stage, stage_cities, count, chunk_size, num_threads, load_range):
+            return stage
+        if seed is not None:
+            # the threads finish their chunks in any order
+            for ids in stage_ids.values():
+                ids.sort()
+    return None
+
+
+# Load `count` rows per city for one stage, with up to `num_threads` threads. load_range(city, start, end) loads the
+# rows [start, end) of a city. Returns False if the stage didn't finish, because of an error or ctrl + c.
+
+
+def run_load_stage(stage, cities, count, chunk_size, num_threads, load_range):
+    tasks = queue.Queue()
+    for city in cities:
+        for start, end in split_range(count, chunk_size, num_threads):
+            tasks.put((city, start, end))
+    num_workers = min(num_threads, tasks.qsize())
+    busy_times = []
+    end_times = [time.time()]
+    errors = []
+
+    def load_ranges():
+        while not TERMINATE_GRACEFULLY and not errors:
+            try:
+                city, start, end = tasks.get_nowait()
+            except queue.Empty:
+                return
+            range_start_time = time.time()
+            try:
+                load_range(city, start, end)
+            except Exception as e:
+                # any error fails the stage, so later stages never load rows whose parents are missing. The other
+                # threads stop after their current range; the chunks committed so far stay journaled
+                logging.error("Loading %s failed: %s", stage, e, exc_info=not isinstance(e, DBAPIError))
+                errors.append((city, start, end))
+                return
+            end_times.append(time.time())
+            busy_times.append(end_times[-1] - range_start_time)
+
+    logging.info("Loading %d %s with %d threads...", count * len(cities), stage, num_workers)
+    start_time = time.time()
+    threads = [threading.Thread(target=load_ranges) for i in range(num_workers)]
+    for t in threads:
+        t.start()
+
+    while any(t.is_alive() for t in threads):  # keep main thread alive so we can catch ctrl + c
+        time.sleep(0.1)
+
+    # measured up to the end of the last range, rather than when the polling loop above noticed it
+    duration = max(end_times) - start_time
+    # the speed-up is the time the threads spent loading, relative to the time the stage took
+    if errors or TERMINATE_GRACEFULLY:
+        for city, start, end in errors:
+            logging.error("Loading %s failed in rows [%d, %d)%s. Chunks of the range committed before the error are "
+                          "journaled.", stage, start, end, " of " + city if city else "")
+        unstarted = []
+        while not tasks.empty():
+            unstarted.append(tasks.get_nowait())
+        if unstarted:
+            logging.error("Loading %s stopped before starting %s.", stage, ", ".join(
+                "rows [{0}, {1}){2}".format(start, end, " of " + city if city else "")
+                for city, start, end in unstarted))
+        return False
+    logging.info("Loaded %d %s in %f seconds (%.1fx speed-up from %d threads).", count * len(cities), stage,
+                 duration, sum(busy_times) / duration if duration else 1, num_workers)
+    return True
+
+
+# Split [0, count) into at most `parts` contiguous ranges, each starting at a multiple of chunk_size.
+
+
+def split_range(count, chunk_size, parts):
+    num_chunks = int(math.ceil(float(count) / chunk_size))
+    chunks_per_part = max(int(math.ceil(float(num_chunks) / parts)), 1)
+    range_size = chunks_per_part * chunk_size
+    return [(start, min(start + range_size, count)) for start in range(0, count, range_size)]
+
+
+# An operation the workload performs through the MovR API: the stats action it is reported as, the name of the
+# MovR (or AsyncMovR) method to call, the method's arguments, and an optional callback that receives its result.
+Operation = collections.namedtuple('Operation', ['action', 'method', 'kwargs', 'on_result'])
+
+
+class RideLocationBatch:
+    """The ride location samples one worker has taken but not logged yet.
+
+    The samples are logged together with MovR.update_ride_locations once there are `batch_size` of them, or once the
+    oldest has waited `flush_interval` seconds."""
+
+    def __init__(self, batch_size, flush_interval):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.locations = []
+        self.oldest_sample_time = None
+
+    def add(self, city, ride_id, lat, long):
+        if not self.locations:
+            self.oldest_sample_time = time.time()
+        self.locations.append(dict(city=city, ride_id=ride_id, lat=lat, long=long, timestamp=datetime.datetime.now()))
+
+    # the operation that logs the buffered samples, if they are due (or if `force`, as long as there are any)
+    def flush(self, force=False):
+        if not self.locations or not (force or len(self.locations) >= self.batch_size or
+                                      time.time() - self.oldest_sample_time >= self.flush_interval):
+            return []
+        locations, self.locations = self.locations, []
+        return [Operation(ACTION_UPDATE_RIDE_LOCS, 'update_ride_locations', dict(locations=locations), None)]
+
+
+# A worker only batches its location samples when the batch size is more than one sample.
+def make_ride_location_batch(batch_size, flush_interval):
+    return RideLocationBatch(batch_size, flush_interval) if batch_size > 1 else None
+
+
+class ArrivalSchedule:
+    """The timeline of intended start times of an open-loop workload, shared by the workers of a process.
+
+    Ticks arrive `rate` times per second, evenly spaced ('fixed') or with exponentially distributed gaps ('poisson'),
+    no matter how fast the database responds. Each worker claims the next arrival and waits for it, so when every
+    worker is busy, arrivals queue up instead of being silently dropped, and their latencies include the wait."""
+
+    def __init__(self, rate, arrivals='fixed'):
+        if arrivals not in ARRIVAL_PROCESSES:
+            raise ValueError("Unknown arrival process '{0}'. Use one of {1}.".format(arrivals, ARRIVAL_PROCESSES))
+        self.rate = rate
+        self.arrivals = arrivals
+        self.mutex = threading.Lock()
+        self.next_arrival = time.time()
+
+    # the intended start time of the next tick
+    def claim(self):
+        with self.mutex:
+            arrival = self.next_arrival
+            self.next_arrival += random.expovariate(self.rate) if self.arrivals == 'poisson' else 1.0 / self.rate
+            return arrival
+
+
+# Wait for the next arrival of a schedule, and return its intended start time. Without a schedule, the workload is a
+# closed loop: the next tick starts right away, and None is returned.
+def wait_for_arrival(schedule):
+    if schedule is None:
+        return None
+    intended_start = schedule.claim()
+    # sleep in short steps, so a low rate doesn't hold up a graceful shutdown
+    while time.time() < intended_start and not TERMINATE_GRACEFULLY:
+        time.sleep(min(intended_start - time.time(), 1))
+    record_missed_start(intended_start)
+    return intended_start
+
+
+async def wait_for_arrival_async(schedule):
+    if schedule is None:
+        return None
+    intended_start = schedule.claim()
+    while time.time() < intended_start and not TERMINATE_GRACEFULLY:
+        await asyncio.sleep(min(intended_start - time.time(), 1))
+    record_missed_start(intended_start)
+    return intended_start
+
+
+def record_missed_start(intended_start):
+    lag = time.time() - intended_start
+    if lag > MISSED_START_TOLERANCE_SECONDS:
+        stats.add_latency_measurement(ACTION_MISSED_START, lag)
+
+
+# Builds the operations for one tick of the workload. The threaded and asyncio engines both execute these, so they
+# generate the same traffic.
+# The tick's action comes first, so that with an arrival schedule it is the operation timed from the tick's intended
+# start. Rides report their location and end as `rides` schedules them. Location samples are logged one transaction
+# each, or buffered in `location_batch` if the worker batches them.
+def plan_operations(action, active_city, movr_objects, rides, follower_reads, datagen, location_batch=None):
+    operations = []
+
+    if action == ACTION_GET_VEHICLES:
+        # simulate user loading screen
+        operations.append(Operation(ACTION_GET_VEHICLES, 'get_vehicles',
+                                    dict(city=active_city, follower_reads=follower_reads, limit=25), None))
+
+    # do write operations randomly
+    elif action == ACTION_NEW_CODE:
+        # simulate a movr marketer creating a new promo code
+        operations.append(Operation(ACTION_NEW_CODE, 'create_promo_code',
+                                    dict(code="_".join(datagen.words(nb=3)) + "_" + str(time.time()),
+                                         description=datagen.paragraph(),
+                                         expiration_time=datetime.datetime.now() + datetime.timedelta(
+                                             days=random.randint(0, 30)),
+                                         rules={"type": "percent_discount", "value": "10%"}),
+                                    movr_objects["global"]["promo_codes"].add))
+
+    elif action == ACTION_APPLY_CODE:
+        # simulate a user applying a promo code to her account
+        operations.append(Operation(ACTION_APPLY_CODE, 'apply_promo_code',
+                                    dict(user_city=active_city,
+                                         user_id=movr_objects["local"][active_city]["users"].sample(),
+                                         promo_code=movr_objects["global"]["promo_codes"].sample()), None))
+
+    elif action == ACTION_NEW_USER:
+        # simulate new signup
+        operations.append(Operation(ACTION_NEW_USER, 'add_user',
+                                    dict(city=active_city, name=datagen.name(), address=datagen.address(),
+                                         credit_card_number=datagen.credit_card_number()),
+                                    lambda user: movr_objects["local"][active_city]["users"].add(user['id'])))
+
+    elif action == ACTION_ADD_VEHICLE:
+        # simulate a user adding a new vehicle to the population
+        vehicle_type = MovRGenerator.generate_random_vehicle()
+        operations.append(Operation(ACTION_ADD_VEHICLE, 'add_vehicle',
+                                    dict(city=active_city,
+                                         owner_id=movr_objects["local"][active_city]["users"].sample(),
+                                         type=vehicle_type,
+                                         vehicle_metadata=MovRGenerator.generate_vehicle_metadata(vehicle_type),
+                                         status=MovRGenerator.get_vehicle_availability(),
+                                         current_location=datagen.address()),
+                                    lambda vehicle: movr_objects["local"][active_city]["vehicles"].add(vehicle['id'])))
+
+    elif action == ACTION_START_RIDE:
+        # simulate a user starting a ride
+        operations.append(Operation(ACTION_START_RIDE, 'start_ride',
+                                    dict(city=active_city,
+                                         rider_id=movr_objects["local"][active_city]["users"].sample(),
+                                         vehicle_id=movr_objects["local"][active_city]["vehicles"].sample()),
+                                    rides.start))
+
+    elif action == ACTION_END_RIDE:
+        # simulate a user ending their ride early: the ride that is due to end first
+        ride = rides.pop_earliest_end()
+        if ride is not None:
+            operations.append(Operation(ACTION_END_RIDE, 'end_ride', dict(city=ride.city, ride_id=ride.id), None))
+
+    # every tick, simulate the rides that are due to end ending, whatever the mix chose
+    for ride in rides.due_ends(MAX_RIDE_ENDS_PER_TICK):
+        operations.append(Operation(ACTION_END_RIDE, 'end_ride', dict(city=ride.city, ride_id=ride.id), None))
+
+    # every tick, simulate the vehicles of the rides whose location report is due updating their locations
+    for ride in rides.due_reports(MAX_LOCATION_REPORTS_PER_TICK):
+        latlong = MovRGenerator.generate_random_latlong()
+        if location_batch is not None:
+            location_batch.add(ride.city, ride.id, latlong['lat'], latlong['long'])
+        else:
+            operations.append(Operation(ACTION_UPDATE_RIDE_LOC, 'update_ride_location',
+                                        dict(city=ride.city, ride_id=ride.id, lat=latlong['lat'],
+                                             long=latlong['long']), None))
+    # samples that have waited long enough are logged on any tick, so a read-heavy mix doesn't hold them back
+    if location_batch is not None:
+        operations.extend(location_batch.flush())
+
+    return operations
+
+
+# With an intended start time, the latency is measured from it instead of from when the operation actually started, so
+# it includes any time the operation waited for a free worker. The transactions of the operation add the time of each
+# of their phases, and their retries, to the operation's TransactionTimings, which are recorded even if it fails. So
+# does a read that looks up the read cache, and its latency is also recorded as a cache hit or miss.
+
+
+def run_operation(movr, operation, intended_start=None):
+    start = time.time() if intended_start is None else intended_start
+    timings = TransactionTimings()
+    token = TRANSACTION_TIMINGS.set(timings)
+    try:
+        result = getattr(movr, operation.method)(**operation.kwargs)
+    except Exception as e:
+        stats.add_error(operation.action, get_error_class(e))
+        raise
+    finally:
+        TRANSACTION_TIMINGS.reset(token)
+        record_transactions(operation, timings)
+    record_latency(operation, time.time() - start, timings)
+    if operation.on_result:
+        operation.on_result(result)
+
+
+async def run_operation_async(movr, operation, intended_start=None):
+    start = time.time() if intended_start is None else intended_start
+    timings = TransactionTimings()
+    # every task runs in its own copy of the context, so concurrent operations don't share their timings
+    token = TRANSACTION_TIMINGS.set(timings)
+    try:
+        result = await getattr(movr, operation.method)(**operation.kwargs)
+    except Exception as e:
+        stats.add_error(operation.action, get_error_class(e))
+        raise
+    finally:
+        TRANSACTION_TIMINGS.reset(token)
+        record_transactions(operation, timings)
+    record_latency(operation, time.time() - start, timings)
+    if operation.on_result:
+        operation.on_result(result)
+
+
+def record_transactions(operation, timings):
+    if timings.transactions:
+        stats.add_transaction_measurements(operation.action, timings.get_phases(), timings.retries)
+
+
+def record_latency(operation, latency, timings):
+    stats.add_latency_measurement(operation.action, latency)
+    if timings.cache_hit is not None:
+        stats.add_cache_lookup(operation.action, timings.cache_hit, latency, timings.cache_age)
+
 
 # Generates evenly distributed load among the provided cities
 
 
-def simulate_movr_load(conn_string, cities, movr_objects, active_rides, read_percentage, follower_reads, connection_duration_in_seconds, echo_sql=False):
+def simulate_movr_load(conn_string, cities, movr_objects, rides, workload_mix, follower_reads, echo_sql=False,
+                       txn_style='orm', location_batch_size=1, location_flush_interval=1.0, schedule=None):
 
-    datagen = Faker()
+    datagen = get_fake_data()
+    location_batch = make_ride_location_batch(location_batch_size, location_flush_interval)
     while True:
-        logging.debug("Creating a new connection to %s, which will reset in %d seconds.",
-                      conn_string, connection_duration_in_seconds)
         try:
-            with MovR(conn_string, echo=echo_sql) as movr:
-                # refresh connections so load can balance among cluster nodes even if the cluster size changes
-                timeout = time.time() + connection_duration_in_seconds
+            # all threads share one pooled engine, which rotates its connections as they reach their maximum age
+            with MovR(conn_string, echo=echo_sql, txn_style=txn_style) as movr:
                 while True:
+                    intended_start = wait_for_arrival(schedule)
 
                     if TERMINATE_GRACEFULLY:
                         logging.debug("Terminating thread...")
+                        for operation in location_batch.flush(force=True) if location_batch is not None else []:
+                            run_operation(movr, operation)
                         return
 
-                    if time.time() > timeout:
-                        break
-
                     active_city = random.choice(cities)
-
-                    if random.random() < read_percentage:
-                        # simulate user loading screen
-                        start = time.time()
-                        movr.get_vehicles(active_city, follower_reads, 25)
-                        stats.add_latency_measurement(
-                            "get vehicles", time.time() - start)
-
-                    else:
-
-                        # every write tick, simulate the various vehicles updating their locations if they are being used for rides
-                        for ride in active_rides[0:10]:
-
-                            latlong = MovRGenerator.generate_random_latlong()
-                            start = time.time()
-                            movr.update_ride_location(ride['city'], ride_id=ride['id'], lat=latlong['lat'],
-                                                      long=latlong['long'])
-                            stats.add_latency_measurement(
-                                ACTION_UPDATE_RIDE_LOC, time.time() - start)
-
-                        # do write operations randomly
-                        if random.random() < .03:
-                            # simulate a movr marketer creating a new promo code
-                            start = time.time()
-                            promo_code = movr.create_promo_code(
-                                code="_".join(datagen.words(nb=3)) +
-                                "_" + str(time.time()),
-                                description=datagen.paragraph(),
-                                expiration_time=datetime.datetime.now() + datetime.timedelta(
-                                    days=random.randint(0, 30)),
-                                rules={"type": "percent_discount", "value": "10%"})
-                            stats.add_latency_measurement(
-                                ACTION_NEW_CODE, time.time() - start)
-                            movr_objects["global"].get(
-                                "promo_codes", []).append(promo_code)
-
-                        elif random.random() < .1:
-                            # simulate a user applying a promo code to her account
-                            start = time.time()
-                            movr.apply_promo_code(active_city, random.choice(movr_objects["local"][active_city]["users"])['id'],
-                                                  random.choice(movr_objects["global"]["promo_codes"]))
-                            stats.add_latency_measurement(
-                                ACTION_APPLY_CODE, time.time() - start)
-                        elif random.random() < .3:
-                            # simulate new signup
-                            start = time.time()
-                            new_user = movr.add_user(active_city, datagen.name(
-                            ), datagen.address(), datagen.credit_card_number())
-                            stats.add_latency_measurement(
-                                ACTION_NEW_USER, time.time() - start)
-                            movr_objects["local"][active_city]["users"].append(
-                                new_user)
-
-                        elif random.random() < .1:
-                            # simulate a user adding a new vehicle to the population
-                            start = time.time()
-                            new_vehicle = movr.add_vehicle(active_city,
-                                                           owner_id=random.choice(
-                                                               movr_objects["local"][active_city]["users"])['id'],
-                                                           type=MovRGenerator.generate_random_vehicle(),
-                                                           vehicle_metadata=MovRGenerator.generate_vehicle_metadata(
-                                                               type),
-                                                           status=MovRGenerator.get_vehicle_availability(),
-                                                           current_location=datagen.address())
-                            stats.add_latency_measurement(
-                                ACTION_ADD_VEHICLE, time.time() - start)
-                            movr_objects["local"][active_city]["vehicles"].append(
-                                new_vehicle)
-
-                        elif random.random() < .5:
-                            # simulate a user starting a ride
-                            start = time.time()
-                            ride = movr.start_ride(active_city, random.choice(movr_objects["local"][active_city]["users"])['id'],
-                                                   random.choice(movr_objects["local"][active_city]["vehicles"])['id'])
-                            stats.add_latency_measurement(
-                                ACTION_START_RIDE, time.time() - start)
-                            active_rides.append(ride)
-
-                        else:
-                            if len(active_rides):
-                                # simulate a ride ending
-                                ride = active_rides.pop()
-                                start = time.time()
-                                movr.end_ride(ride['city'], ride['id'])
-                                stats.add_latency_measurement(
-                                    ACTION_END_RIDE, time.time() - start)
-        except DBAPIError:
-            logging.error("Lost connection to the database. Sleeping for 10 seconds.")
+                    action = workload_mix.choose_action()
+                    for operation in plan_operations(action, active_city, movr_objects, rides,
+                                                     follower_reads, datagen, location_batch):
+                        # only the tick's first operation, its action, can have waited for its turn
+                        run_operation(movr, operation, intended_start)
+                        intended_start = None
+        except DBAPIError as e:
+            logging.error("Lost connection to the database (%s). Sleeping for 10 seconds.", get_error_class(e))
             time.sleep(10)
 
 
+# Same workload as simulate_movr_load, run as a coroutine. Many of these share one event loop and one bounded pool.
+
+
+async def simulate_movr_load_async(movr, cities, movr_objects, rides, workload_mix, follower_reads,
+                                   location_batch_size=1, location_flush_interval=1.0, schedule=None):
+
+    datagen = get_fake_data()
+    location_batch = make_ride_location_batch(location_batch_size, location_flush_interval)
+    while True:
+        intended_start = await wait_for_arrival_async(schedule)
+
+        if TERMINATE_GRACEFULLY:
+            logging.debug("Terminating task...")
+            for operation in location_batch.flush(force=True) if location_batch is not None else []:
+                await run_operation_async(movr, operation)
+            return
+
+        try:
+            active_city = random.choice(cities)
+            action = workload_mix.choose_action()
+            for operation in plan_operations(action, active_city, movr_objects, rides,
+                                             follower_reads, datagen, location_batch):
+                await run_operation_async(movr, operation, intended_start)
+                intended_start = None
+        except DBAPIError as e:
+            logging.error("Lost connection to the database (%s). Sleeping for 10 seconds.", get_error_class(e))
+            await asyncio.sleep(10)
+
+
 def set_query_parameter(url, param_name, param_value):
     scheme, netloc, path, query_string, fragment = urlsplit(url)
     query_params = parse_qs(query_string)
@@ -221,6 +575,8 @@ def setup_parser():
     ##########
     parser.add_argument('--num-threads', dest='num_threads', type=int, default=5,
                         help='The number threads to use for MovR. (default =5)')
+    parser.add_argument('--num-processes', dest='num_processes', type=int, default=None,
+                        help="The number of worker processes to split the cities across for the 'load', 'generate' and 'run' commands. Each process runs '--num-threads' threads. (default = the number of CPUs for 'generate', 1 otherwise)")
     parser.add_argument('--log-level', dest='log_level', default='info',
                         help='The log level ([debug|info|warning|error]) for MovR messages. (default = info)')
     parser.add_argument('--app-name', dest='app_name', default='movr',
@@ -229,6 +585,18 @@ def setup_parser():
                         help="The connection string to the database. Default is 'postgres://root@localhost:26257/movr?sslmode=disable'")
     parser.add_argument('--echo-sql', dest='echo_sql', action='store_true',
                         help='If set, the application prints all executed SQL statements.')
+    parser.add_argument('--histogram-precision', dest='histogram_precision', type=int, default=2,
+                        help='The number of significant digits kept by the latency histograms (1-5). Higher precision uses more memory per action. (default = 2)')
+    parser.add_argument('--fake-pool-size', dest='fake_pool_sizes', action='append',
+                        help="The number of distinct fake names, addresses, credit card numbers, paragraphs and words to generate once and then sample from, instead of calling Faker for every row. Use <field>=<size> to size one field's pool (fields: name, address, credit_card_number, paragraph, word), and 0 to always call Faker. (default = %d)" % DEFAULT_POOL_SIZE)
+    parser.add_argument('--fake-cache-dir', dest='fake_cache_dir', default=DEFAULT_CACHE_DIR,
+                        help="The directory where generated fake value pools are cached and memory-mapped from on later runs. (default = %s)" % DEFAULT_CACHE_DIR)
+    parser.add_argument('--pool-size', dest='pool_size', type=int, default=None,
+                        help='The number of connections kept open in the shared connection pool. (default = --num-threads)')
+    parser.add_argument('--max-overflow', dest='max_overflow', type=int, default=10,
+                        help='The number of connections the pool may open beyond --pool-size under load. (default = 10)')
+    parser.add_argument('--pool-pre-ping', dest='pool_pre_ping', action='store_true', default=False,
+                        help='Test pooled connections for liveness before using them.')
 
     ###############
     # LOAD COMMANDS
@@ -247,28 +615,103 @@ def setup_parser():
                              help='The number of promo codes to add to the dataset.')
     load_parser.add_argument('--city', dest='city', action='append',
                              help='Load random data for each of the cities specified. Use this flag multiple times to add multiple cities.')
+    load_parser.add_argument('--load-method', dest='load_method', choices=LOAD_METHODS, default='orm',
+                             help="How to write the generated rows: ORM objects saved in bulk ('orm'), multi-row INSERT statements ('insert'), or COPY FROM STDIN ('copy'). (default = orm)")
     load_parser.add_argument('--skip-init', dest='skip_reload_tables', action='store_true',
                              help='Keep the existing tables in the movr database.')
+    load_parser.add_argument('--seed', dest='seed', type=int, default=None,
+                             help="Generate the same dataset on every load with this seed: every chunk of every table is drawn from its own stream derived from the seed, and timestamps are relative to %s instead of the current time. Needs fake value pools for every field (a '--fake-pool-size' above 0)." % SEEDED_LOAD_TIME.date())
+    load_parser.add_argument('--resume', dest='resume', action='store_true',
+                             help='Continue an interrupted load from its last committed chunks, keeping the rows it already loaded. Use the same options as the interrupted load.')
     load_parser.add_argument('--multi-region', dest='multi_region', action='store_true', default=False,
                              help='Load MovR data to a database with a multi-region schema. Useful for showing an app built from day-one for a global deployment. You can convert a single-region MovR to multi-region one using the "configure-multi-region" command.')
     load_parser.add_argument('--region-city-pair', dest='region_city_pair', action='append',
                              help='Pairs in the form <region>:<city_id> that will be used to assign cities to regions. Example: us_west:seattle. Use this flag multiple times to assign multiple cities.\nIf no region pairs are specified, the application will guess.')
 
+    ###################
+    # GENERATE COMMANDS
+    ###################
+    generate_parser = subparsers.add_parser(
+        'generate', help="Write a generated dataset to compressed part files, without connecting to a database. Use the files with IMPORT INTO or COPY.")
+    generate_parser.add_argument('--out-dir', dest='out_dir', required=True,
+                                 help='The directory to write the part files to, in one subdirectory per table.')
+    generate_parser.add_argument('--format', dest='file_format', choices=FILE_FORMATS, default='csv',
+                                 help="The file format: gzip-compressed CSV without a header ('csv'), or Parquet ('parquet', needs pyarrow). (default = csv)")
+    generate_parser.add_argument('--num-users', dest='num_users', type=int, default=50,
+                                 help='The number of random users to add to the dataset.')
+    generate_parser.add_argument('--num-vehicles', dest='num_vehicles', type=int, default=10,
+                                 help='The number of random vehicles to add to the dataset.')
+    generate_parser.add_argument('--num-rides', dest='num_rides', type=int, default=500,
+                                 help='The number of random rides to add to the dataset.')
+    generate_parser.add_argument('--num-histories', dest='num_histories', type=int, default=1000,
+                                 help='The number of ride location histories to add to the dataset.')
+    generate_parser.add_argument('--num-promo-codes', dest='num_promo_codes', type=int, default=1000,
+                                 help='The number of promo codes to add to the dataset.')
+    generate_parser.add_argument('--num-user-promo-codes', dest='num_user_promo_codes', type=int, default=100,
+                                 help='The number of promo codes applied to users to add to the dataset.')
+    generate_parser.add_argument('--city', dest='city', action='append',
+                                 help='Generate random data for each of the cities specified. Use this flag multiple times to add multiple cities.')
+    generate_parser.add_argument('--seed', dest='seed', type=int, default=None,
+                                 help="Generate the same dataset every time with this seed, as with 'load --seed'.")
+
     ###############
     # RUN COMMANDS
     ###############
     run_parser = subparsers.add_parser(
         'run', help="Generate fake traffic to tables in an initialized database.")
     run_parser.add_argument('--connection-duration', dest='connection_duration_in_seconds', type=int,
-                            help='The number of seconds to keep database connections alive before resetting them.',
+                            help='The maximum number of seconds to keep a pooled database connection alive before replacing it. Connections are replaced one at a time, with jitter. Use 0 to never replace connections.',
                             default=30)
     run_parser.add_argument('--follower-reads', dest='follower_reads', action='store_true', default=False,
                             help='Use the closest replica to serve fast, but slightly stale, read requests.')
+    run_parser.add_argument('--follower-read-mode', dest='follower_read_mode', choices=FOLLOWER_READ_MODES,
+                            default='set',
+                            help="How follower reads pick their timestamp: 'set' runs SET TRANSACTION AS OF SYSTEM TIME before every read, 'inline' puts AS OF SYSTEM TIME in the query and runs it as a single-statement implicit transaction, with no extra round trips, and 'session' reads on a separate pool of connections that follower read by default. (default = set)")
+    run_parser.add_argument('--follower-read-staleness', dest='follower_read_staleness', type=float, default=None,
+                            help="Read exactly this many seconds in the past, instead of at follower_read_timestamp(). Only with the 'set' and 'inline' follower read modes.")
+    run_parser.add_argument('--follower-read-max-staleness', dest='follower_read_max_staleness', type=float,
+                            default=None,
+                            help="Use bounded staleness reads, with_max_staleness(), that read the freshest data a nearby replica has, at most this many seconds old. Only with the 'inline' follower read mode. Reads that may touch more than one range fail with bounded staleness.")
+    run_parser.add_argument('--read-cache-ttl', dest='read_cache_ttl', type=float, default=None,
+                            help="Serve 'get vehicles' from an in-process cache, keeping each city's vehicles for this many seconds. Adding a vehicle and starting or ending a ride invalidate the city's entries, but only in the process that made the change. Hits, misses, the latency hits saved and the age of the results they served are printed with the stats. (default = no cache)")
+    run_parser.add_argument('--read-cache-size', dest='read_cache_size', type=int, default=1000,
+                            help="The most reads the read cache keeps per process, evicting the least recently used first. (default = 1000)")
     run_parser.add_argument('--city', dest='city', action='append',
                             help='The names of the cities to use when generating load. Use this flag multiple times to add multiple cities.')
     run_parser.add_argument('--read-only-percentage', dest='read_percentage', type=float,
-                            help='Value between 0-1 indicating how many simulated read-only home screen loads to perform as a percentage of overall activities.',
-                            default=.95)
+                            help="Value between 0-1 indicating how many simulated read-only home screen loads to perform as a percentage of overall activities. (default = the workload profile's, .95 for 'default')",
+                            default=None)
+    run_parser.add_argument('--workload-profile', dest='workload_profile', default='default',
+                            help="The mix of actions to run: one of the built-in profiles {0}, or the path of a JSON or YAML file with a 'read_percentage' and the relative 'write_weights' of the write actions. The configured and observed mix are printed when the run ends. (default = default)".format(list(PROFILES)))
+    run_parser.add_argument('--engine', dest='engine', choices=['threads', 'asyncio'], default='threads',
+                            help="How to run the workload: one OS thread per '--num-threads' ('threads'), or coroutines on one event loop using the asyncpg driver ('asyncio'). (default = threads)")
+    run_parser.add_argument('--concurrency', dest='concurrency', type=int, default=None,
+                            help="The number of concurrent workload tasks to run with '--engine asyncio'. They share a connection pool of '--pool-size' connections. (default = --num-threads)")
+    run_parser.add_argument('--prepared-statements', dest='prepared_statements', action='store_true',
+                            help="Prepare the statements of the hottest API calls on each new connection, and run them with EXECUTE. With '--engine asyncio', the asyncpg driver always prepares statements.")
+    run_parser.add_argument('--txn-style', dest='txn_style', choices=TXN_STYLES, default='orm',
+                            help="How to run the start ride, end ride and apply promo code transactions: with the ORM, one query per object ('orm'), or with a fixed, minimal number of statements that use UPDATE ... RETURNING, joins and ON CONFLICT ('optimized'). (default = orm)")
+    run_parser.add_argument('--target-rate', dest='target_rate', type=float, default=None,
+                            help="Run an open loop that starts this many operations per second in total, whether or not earlier ones have finished, instead of starting each one as soon as a worker is done with the last. Latencies are measured from when each operation should have started, and operations that started late because every worker was busy are reported as 'missed start'.")
+    run_parser.add_argument('--arrivals', dest='arrivals', choices=ARRIVAL_PROCESSES, default='fixed',
+                            help="How the operations of '--target-rate' are spaced: evenly ('fixed'), or as a Poisson process with random gaps ('poisson'). (default = fixed)")
+    run_parser.add_argument('--id-pool-size', dest='id_pool_size', type=int, default=DEFAULT_ID_POOL_SIZE,
+                            help="The most users and vehicles per city, and promo codes overall, that each process keeps to pick from. Once a pool is full, new ids replace random ones so the pool stays a uniform sample. Use 0 for no limit. (default = {0})".format(DEFAULT_ID_POOL_SIZE))
+    run_parser.add_argument('--ride-duration', dest='ride_duration', type=float, default=DEFAULT_RIDE_DURATION,
+                            help="The mean duration of a ride in seconds. Each ride's duration is drawn from an exponential distribution. Rides that are due to end are ended by whichever worker ticks next, at most {0} per tick, and an 'end ride' action ends the ride that is due to end first. (default = {1})".format(MAX_RIDE_ENDS_PER_TICK, DEFAULT_RIDE_DURATION))
+    run_parser.add_argument('--ride-report-interval', dest='ride_report_interval', type=float,
+                            default=DEFAULT_RIDE_REPORT_INTERVAL,
+                            help="How often in seconds every active ride logs its location. Due reports are logged by whichever worker ticks next, at most {0} per tick. (default = {1})".format(MAX_LOCATION_REPORTS_PER_TICK, DEFAULT_RIDE_REPORT_INTERVAL))
+    run_parser.add_argument('--location-batch-size', dest='location_batch_size', type=int, default=1,
+                            help="The number of ride location samples each worker logs per transaction, as multi-row INSERTs reported as 'log ride locations'. With 1, every sample is its own 'log ride location' transaction. (default = 1)")
+    run_parser.add_argument('--location-flush-interval', dest='location_flush_interval', type=float, default=1.0,
+                            help="The longest time in seconds a ride location sample waits for its batch to fill up before it is logged anyway. Only used with '--location-batch-size' above 1. (default = 1.0)")
+    run_parser.add_argument('--metrics-file', dest='metrics_file', default=None,
+                            help="Append every stats window to this file as a line of JSON, with the operations, throughput, latency percentiles, errors by class, transaction retries and the percentiles of each transaction phase of every action, and the summary of the whole run with its cumulative latency histograms when the run ends.")
+    run_parser.add_argument('--prometheus-port', dest='prometheus_port', type=int, default=None,
+                            help="Serve the latency histograms, transaction phase histograms, errors, retries and gauges of the run so far in the Prometheus text format on this port, at /metrics.")
+    run_parser.add_argument('--prometheus-host', dest='prometheus_host', default='127.0.0.1',
+                            help="The address the '--prometheus-port' endpoint listens on. Use 0.0.0.0 to serve it outside the host or container. (default = 127.0.0.1)")
 
     ###################
     # configure_multi_region
@@ -291,119 +734,189 @@ def setup_parser():
 ##############
 
 
-def add_rides(engine, num_rides, city):
-    chunk_size = 800
-    datagen = Faker()
-
-    def add_rides_helper(sess, chunk, n):
-        users = sess.query(User).filter_by(city=city).all()
-        vehicles = sess.query(Vehicle).filter_by(city=city).all()
-
-        rides = []
-        for i in range(chunk, min(chunk + chunk_size, num_rides)):
-            start_time = datetime.datetime.now() - datetime.timedelta(days=random.randint(0, 30))
-            rides.append(Ride(id=MovRGenerator.generate_uuid(),
-                              city=city,
-                              rider_id=random.choice(users).id,
-                              vehicle_id=random.choice(vehicles).id,
-                              start_time=start_time,
-                              start_address=datagen.address(),
-                              end_address=datagen.address(),
-                              revenue=MovRGenerator.generate_revenue(),
-                              end_time=start_time + datetime.timedelta(minutes=random.randint(0, 60))))
-        sess.bulk_save_objects(rides)
-
-    for chunk in range(0, num_rides, chunk_size):
-        run_transaction(sessionmaker(bind=engine),
-                        lambda s: add_rides_helper(s, chunk, min(chunk + chunk_size, num_rides)))
-
-
-def add_promo_codes(engine, num_codes):
-    chunk_size = 800
-    datagen = Faker()
-
-    def add_codes_helper(sess, chunk, n):
-        codes = []
-        for i in range(chunk, min(chunk + chunk_size, num_codes)):
-            code = "_".join(datagen.words(nb=3)) + "_" + str(time.time())
-            codes.append(PromoCode(code=code,
-                                   description=datagen.paragraph(),
-                                   expiration_time=datetime.datetime.now(
-                                   ) + datetime.timedelta(days=random.randint(0, 30)),
-                                   rules={"type": "percent_discount", "value": "10%"}))
-        sess.bulk_save_objects(codes)
-
-    for chunk in range(0, num_codes, chunk_size):
-        run_transaction(sessionmaker(bind=engine),
-                        lambda s: add_codes_helper(s, chunk, min(chunk + chunk_size, num_codes)))
-
-
-def add_vehicle_location_histories(engine, num_histories, city):
-    chunk_size = 5000
-
-    def add_vehicle_location_histories_helper(sess, chunk, n):
-        rides = sess.query(Ride).filter_by(city=city).all()
-
-        histories = []
-        for i in range(chunk, min(chunk + chunk_size, num_histories)):
-            latlong = MovRGenerator.generate_random_latlong()
-            histories.append(VehicleLocationHistory(
-                city=city,
-                ride_id=random.choice(rides).id,
-                lat=latlong["lat"],
-                long=latlong["long"]))
-
-        sess.bulk_save_objects(histories)
-
-    for chunk in range(0, num_histories, chunk_size):
-        run_transaction(sessionmaker(bind=engine),
-                        lambda s: add_vehicle_location_histories_helper(s, chunk, min(chunk + chunk_size, num_histories)))
-
-
-def add_users(engine, num_users, city):
-    chunk_size = 1000
-    datagen = Faker()
-
-    def add_users_helper(sess, chunk, n):
-        users = []
-        for i in range(chunk, n):
-            users.append(User(id=MovRGenerator.generate_uuid(),
-                              city=city,
-                              name=datagen.name(),
-                              address=datagen.address(),
-                              credit_card=datagen.credit_card_number()))
-        sess.bulk_save_objects(users)
-
-    for chunk in range(0, num_users, chunk_size):
-        run_transaction(sessionmaker(bind=engine),
-                        lambda s: add_users_helper(s, chunk, min(chunk + chunk_size, num_users)))
-
-
-def add_vehicles(engine, num_vehicles, city):
-    chunk_size = 1000
-    datagen = Faker()
-
-    def add_vehicles_helper(sess, chunk, n):
-        owners = sess.query(User).filter_by(city=city).all()
-        vehicles = []
-        for i in range(chunk, n):
-            vehicle_type = MovRGenerator.generate_random_vehicle()
-            vehicles.append(Vehicle(id=MovRGenerator.generate_uuid(),
-                                    type=vehicle_type,
-                                    city=city,
-                                    current_location=datagen.address(),
-                                    owner_id=(random.choice(owners)).id,
-                                    status=MovRGenerator.get_vehicle_availability(),
-                                    ext=MovRGenerator.generate_vehicle_metadata(vehicle_type)))
-        sess.bulk_save_objects(vehicles)
-
-    for chunk in range(0, num_vehicles, chunk_size):
-        run_transaction(sessionmaker(bind=engine),
-                        lambda s: add_vehicles_helper(s, chunk, min(chunk + chunk_size, num_vehicles)))
+USER_CHUNK_SIZE = 1000
+VEHICLE_CHUNK_SIZE = 1000
+RIDE_CHUNK_SIZE = 800
+HISTORY_CHUNK_SIZE = 5000
+PROMO_CODE_CHUNK_SIZE = 800
+USER_PROMO_CODE_CHUNK_SIZE = 1000
+
+# the time seeded loads generate their timestamps relative to, instead of the current time
+SEEDED_LOAD_TIME = datetime.datetime(2025, 1, 1)
+
+# Each add_* function loads the rows [start, end) of a table, one transaction per chunk, and skips the chunks the
+# journal has recorded as committed by an earlier, interrupted load. With a seed, every chunk draws its rows from its
+# own stream, so it is generated the same way by whichever thread or process loads it.
+
+
+def pending_chunks(journal, model, city, start, end, chunk_size):
+    for chunk in range(start, end, chunk_size):
+        if TERMINATE_GRACEFULLY:
+            return
+        if not journal.is_completed(model, city, chunk):
+            yield chunk
+
+
+def load_time(seed):
+    return SEEDED_LOAD_TIME if seed is not None else datetime.datetime.now()
+
+
+def add_rides(loader, journal, city, start, end, user_ids, vehicle_ids, ride_ids, seed=None):
+    chunk_size = RIDE_CHUNK_SIZE
+    datagen = get_fake_data()
+    columns = ['id', 'city', 'rider_id', 'vehicle_id', 'start_time', 'start_address', 'end_address', 'revenue',
+               'end_time']
+
+    def add_rides_helper(chunk, n):
+        count = n - chunk
+        rng = MovRGenerator.seeded_rng(seed, city, Ride.__tablename__, chunk)
+        id_bytes = MovRGenerator.generate_uuid_bytes(count, rng)
+        start_times = MovRGenerator.generate_timestamps(count, load_time(seed), -30, 0, rng=rng)
+        rides = list(zip(MovRGenerator.format_uuids(id_bytes),
+                         [city] * count,
+                         user_ids.sample_many(count, rng),
+                         vehicle_ids.sample_many(count, rng),
+                         start_times,
+                         datagen.sample_many('address', count, rng),
+                         datagen.sample_many('address', count, rng),
+                         MovRGenerator.generate_revenues(count, rng),
+                         MovRGenerator.generate_timestamps(count, start_times, 0, 60, unit='m', rng=rng)))
+        loader.write(Ride, columns, rides, journal.checkpoint(Ride, city, chunk, count))
+        ride_ids.extend_bytes(id_bytes)
+
+    for chunk in pending_chunks(journal, Ride, city, start, end, chunk_size):
+        add_rides_helper(chunk, min(chunk + chunk_size, end))
+
+
+def add_promo_codes(loader, journal, start, end, seed=None, promo_codes=None):
+    chunk_size = PROMO_CODE_CHUNK_SIZE
+    datagen = get_fake_data()
+    columns = ['code', 'description', 'creation_time', 'expiration_time', 'rules']
+
+    def add_codes_helper(chunk, n):
+        count = n - chunk
+        rng = MovRGenerator.seeded_rng(seed, PromoCode.__tablename__, chunk)
+        now = load_time(seed)
+        words = datagen.sample_many('word', 3 * count, rng)
+        # seeded codes are made unique by their position in the table, instead of by the time they were generated
+        suffixes = [str(chunk + i) for i in range(count)] if seed is not None else [str(time.time())] * count
+        codes = list(zip(["_".join(words[3 * i:3 * i + 3]) + "_" + suffixes[i] for i in range(count)],
+                         datagen.sample_many('paragraph', count, rng),
+                         [now] * count,
+                         MovRGenerator.generate_timestamps(count, now, 0, 30, rng=rng),
+                         [{"type": "percent_discount", "value": "10%"}] * count))
+        loader.write(PromoCode, columns, codes, journal.checkpoint(PromoCode, None, chunk, count))
+        if promo_codes is not None:
+            promo_codes.extend(code[0] for code in codes)
+
+    for chunk in pending_chunks(journal, PromoCode, None, start, end, chunk_size):
+        add_codes_helper(chunk, min(chunk + chunk_size, end))
+
+
+def add_vehicle_location_histories(loader, journal, city, start, end, ride_ids, seed=None):
+    chunk_size = HISTORY_CHUNK_SIZE
+    columns = ['city', 'ride_id', 'timestamp', 'lat', 'long']
+    # (ride_id, timestamp) is the primary key, and rides are sampled with replacement, so the rows of a range are a
+    # microsecond apart rather than all at the same time
+    range_start_time = load_time(seed)
+
+    def add_vehicle_location_histories_helper(chunk, n):
+        count = n - chunk
+        rng = MovRGenerator.seeded_rng(seed, city, VehicleLocationHistory.__tablename__, chunk)
+        lats, longs = MovRGenerator.generate_random_latlongs(count, rng)
+        timestamps = [range_start_time + datetime.timedelta(microseconds=chunk + i) for i in range(count)]
+        histories = list(zip([city] * count,
+                             ride_ids.sample_many(count, rng),
+                             timestamps,
+                             lats,
+                             longs))
+        loader.write(VehicleLocationHistory, columns, histories,
+                     journal.checkpoint(VehicleLocationHistory, city, chunk, count))
+
+    for chunk in pending_chunks(journal, VehicleLocationHistory, city, start, end, chunk_size):
+        add_vehicle_location_histories_helper(chunk, min(chunk + chunk_size, end))
+
+
+def add_users(loader, journal, city, start, end, user_ids, seed=None):
+    chunk_size = USER_CHUNK_SIZE
+    datagen = get_fake_data()
+    columns = ['id', 'city', 'name', 'address', 'credit_card']
+
+    def add_users_helper(chunk, n):
+        count = n - chunk
+        rng = MovRGenerator.seeded_rng(seed, city, User.__tablename__, chunk)
+        id_bytes = MovRGenerator.generate_uuid_bytes(count, rng)
+        users = list(zip(MovRGenerator.format_uuids(id_bytes),
+                         [city] * count,
+                         datagen.sample_many('name', count, rng),
+                         datagen.sample_many('address', count, rng),
+                         datagen.sample_many('credit_card_number', count, rng)))
+        loader.write(User, columns, users, journal.checkpoint(User, city, chunk, count))
+        user_ids.extend_bytes(id_bytes)
+
+    for chunk in pending_chunks(journal, User, city, start, end, chunk_size):
+        add_users_helper(chunk, min(chunk + chunk_size, end))
+
+
+def add_vehicles(loader, journal, city, start, end, user_ids, vehicle_ids, seed=None):
+    chunk_size = VEHICLE_CHUNK_SIZE
+    datagen = get_fake_data()
+    columns = ['id', 'type', 'city', 'current_location', 'owner_id', 'creation_time', 'status', 'ext']
+
+    def add_vehicles_helper(chunk, n):
+        count = n - chunk
+        rng = MovRGenerator.seeded_rng(seed, city, Vehicle.__tablename__, chunk)
+        id_bytes = MovRGenerator.generate_uuid_bytes(count, rng)
+        vehicle_types = MovRGenerator.generate_random_vehicles(count, rng)
+        vehicles = list(zip(MovRGenerator.format_uuids(id_bytes),
+                            vehicle_types,
+                            [city] * count,
+                            datagen.sample_many('address', count, rng),
+                            user_ids.sample_many(count, rng),
+                            [load_time(seed)] * count,
+                            MovRGenerator.get_vehicle_availabilities(count, rng),
+                            MovRGenerator.generate_vehicle_metadatas(vehicle_types, rng)))
+        loader.write(Vehicle, columns, vehicles, journal.checkpoint(Vehicle, city, chunk, count))
+        vehicle_ids.extend_bytes(id_bytes)
+
+    for chunk in pending_chunks(journal, Vehicle, city, start, end, chunk_size):
+        add_vehicles_helper(chunk, min(chunk + chunk_size, end))
+
+
+def add_user_promo_codes(loader, journal, city, start, end, user_ids, promo_codes, seed=None):
+    chunk_size = USER_PROMO_CODE_CHUNK_SIZE
+    columns = ['city', 'user_id', 'code', 'timestamp', 'usage_count']
+    # (user_id, code) is the primary key. Row i goes to user i % U, and each user gets distinct codes, starting at an
+    # offset of its own, so rows are unique as long as there are no more than U * C of them.
+    num_users, num_codes = len(user_ids), len(promo_codes)
+    end = min(end, num_users * num_codes)
+
+    def add_user_promo_codes_helper(chunk, n):
+        count = n - chunk
+        indexes = range(chunk, n)
+        user_promo_codes = list(zip([city] * count,
+                                    user_ids.get_many([i % num_users for i in indexes]),
+                                    [promo_codes[(i // num_users + (i % num_users) * 7919) % num_codes]
+                                     for i in indexes],
+                                    [load_time(seed)] * count,
+                                    [0] * count))
+        loader.write(UserPromoCode, columns, user_promo_codes, journal.checkpoint(UserPromoCode, city, chunk, count))
+
+    for chunk in pending_chunks(journal, UserPromoCode, city, start, end, chunk_size):
+        add_user_promo_codes_helper(chunk, min(chunk + chunk_size, end))
+
+
+# a single scan of only the ids of a city's rows in an existing table
+
+
+def get_existing_ids(engine, model, city):
+    return run_transaction(sessionmaker(bind=engine),
+                           lambda sess: [row.id for row in sess.query(model.id).filter_by(city=city)])
 
 
 def run_data_loader(conn_string, cities, num_users, num_rides, num_vehicles, num_histories, num_promo_codes, num_threads,
-                    skip_reload_tables, echo_sql):
+                    skip_reload_tables, echo_sql, num_processes=1, load_method='orm', tables_initialized=False,
+                    resume=False, promo_code_offset=0, seed=None):
     if num_users <= 0 or num_rides <= 0 or num_vehicles <= 0:
         raise ValueError("The number of objects to generate must be > 0.")
 
@@ -411,90 +924,422 @@ def run_data_loader(conn_string, cities, num_users, num_rides, num_vehicles, num
 
     logging.info("Loading MovR")
 
-    with MovR(conn_string, reset_tables=(not skip_reload_tables), echo=echo_sql) as movr:
+    # worker processes load into tables that their parent has already reset, and a resumed load keeps them
+    with MovR(conn_string, reset_tables=(not skip_reload_tables and not tables_initialized and not resume),
+              echo=echo_sql) as movr:
+        if not tables_initialized and not resume:
+            LoadJournal(movr.engine).reset()
 
         logging.info("Loading cities %s.", cities)
         logging.info("Loading movr data with ~%d users, ~%d vehicles, ~%d rides, ~%d histories, and ~%d promo codes.",
                      num_users, num_vehicles, num_rides, num_histories, num_promo_codes)
 
-    # don't create more than 1 thread per city
-    usable_threads = min(num_threads, len(cities))
-    if usable_threads < num_threads:
-        logging.info("Only using %d of %d requested threads, since we only create at most one thread per city.",
-                     usable_threads, num_threads)
-
     num_users_per_city = int(math.ceil(float(num_users) / len(cities)))
     num_rides_per_city = int(math.ceil(float(num_rides) / len(cities)))
     num_vehicles_per_city = int(math.ceil(float(num_vehicles) / len(cities)))
     num_histories_per_city = int(math.ceil(float(num_histories) / len(cities)))
 
-    cities_per_thread = int(math.ceil(float(len(cities)) / usable_threads))
-    num_promo_codes_per_thread = int(
-        math.ceil(float(num_promo_codes) / (float(len(cities))/cities_per_thread)))
-
-    RUNNING_THREADS = []
-
-    original_city_count = len(cities)
-    for i in range(usable_threads):
-        if len(cities) > 0:
-            t = threading.Thread(target=load_movr_data, args=(conn_string, num_users_per_city, num_vehicles_per_city,
-                                                              num_rides_per_city, num_histories_per_city, num_promo_codes_per_thread,
-                                                              cities[:cities_per_thread],
-                                                              echo_sql))
-            cities = cities[cities_per_thread:]
-            t.start()
-            RUNNING_THREADS.append(t)
-
-    while threading.active_count() > 1:  # keep main thread alive so we can catch ctrl + c
-        time.sleep(0.1)
+    if num_processes > 1:
+        # each worker process loads its own share of the cities, with its own threads
+        shards = shard_cities(cities, num_processes)
+        num_promo_codes_per_process = int(math.ceil(float(num_promo_codes) / len(shards)))
+        processes = start_worker_processes(run_data_loader, [
+            dict(conn_string=conn_string, cities=shard, num_users=num_users_per_city * len(shard),
+                 num_rides=num_rides_per_city * len(shard), num_vehicles=num_vehicles_per_city * len(shard),
+                 num_histories=num_histories_per_city * len(shard), num_promo_codes=num_promo_codes_per_process,
+                 num_threads=num_threads, skip_reload_tables=skip_reload_tables, echo_sql=echo_sql,
+                 load_method=load_method, tables_initialized=True, resume=resume,
+                 promo_code_offset=i * num_promo_codes_per_process, seed=seed)
+            for i, shard in enumerate(shards)])
+
+        while any(p.is_alive() for p in processes):  # keep main process alive so we can catch ctrl + c
+            time.sleep(0.1)
+        if not check_worker_processes(processes):
+            logging.warning("The load stopped in a worker process. To continue from the last committed chunk, run: %s",
+                            get_resume_command())
+            return False
+
+        logging.info("Populated %s cities in %f seconds.", len(cities), time.time() - start_time)
+        return True
+
+    if not load_movr_data(conn_string, num_users_per_city, num_vehicles_per_city, num_rides_per_city,
+                          num_histories_per_city, num_promo_codes, cities, num_threads, echo_sql, load_method,
+                          skip_reload_tables, resume, promo_code_offset, seed):
+        return False
 
     duration = time.time() - start_time
 
     logging.info("Populated %s cities in %f seconds.",
-                 original_city_count, duration)
+                 len(cities), duration)
+    return True
+
+def run_data_generator(out_dir, file_format, cities, num_users, num_rides, num_vehicles, num_histories, num_promo_codes,
+                       num_user_promo_codes, num_threads, num_processes=1, seed=None):
+    if num_users <= 0 or num_rides <= 0 or num_vehicles <= 0:
+        raise ValueError("The number of objects to generate must be > 0.")
+
+    start_time = time.time()
+    logging.info("Generating cities %s to %s.", cities, out_dir)
+
+    num_users_per_city = int(math.ceil(float(num_users) / len(cities)))
+    num_rides_per_city = int(math.ceil(float(num_rides) / len(cities)))
+    num_vehicles_per_city = int(math.ceil(float(num_vehicles) / len(cities)))
+    num_histories_per_city = int(math.ceil(float(num_histories) / len(cities)))
+    num_user_promo_codes_per_city = int(math.ceil(float(num_user_promo_codes) / len(cities)))
+
+    # Promo codes are generated first, by this process, and every city picks its user promo codes from all of them.
+    # The files are then the same however many processes generate them.
+    writer = get_file_writer(file_format, out_dir)
+    journal = LoadJournal(None)
+    promo_codes = []
+    if not run_load_stage("promo codes", [None], num_promo_codes, PROMO_CODE_CHUNK_SIZE, num_threads,
+                          lambda city, start, end: add_promo_codes(writer, journal, start, end, seed, promo_codes)):
+        return False
+    if seed is not None:
+        promo_codes.sort()
+
+    if num_processes > 1:
+        # each worker process generates its own share of the cities, with its own threads
+        processes = start_worker_processes(generate_movr_data, [
+            dict(out_dir=out_dir, file_format=file_format, num_users=num_users_per_city,
+                 num_vehicles=num_vehicles_per_city, num_rides=num_rides_per_city,
+                 num_histories=num_histories_per_city, num_user_promo_codes=num_user_promo_codes_per_city,
+                 promo_codes=promo_codes, cities=shard, num_threads=num_threads, seed=seed)
+            for shard in shard_cities(cities, num_processes)])
+
+        while any(p.is_alive() for p in processes):  # keep main process alive so we can catch ctrl + c
+            time.sleep(0.1)
+        if not check_worker_processes(processes):
+            return False
+    elif not generate_movr_data(out_dir, file_format, num_users_per_city, num_vehicles_per_city, num_rides_per_city,
+                                num_histories_per_city, num_user_promo_codes_per_city, promo_codes, cities,
+                                num_threads, seed):
+        return False
+
+    logging.info("Generated %s cities in %f seconds.", len(cities), time.time() - start_time)
+    return True
 
 # generate fake load for objects within the provided city list
 
 
-def run_load_generator(conn_string, read_percentage, connection_duration_in_seconds, city_list, follower_reads, echo_sql, num_threads):
-    if read_percentage < 0 or read_percentage > 1:
-        raise ValueError("Read percentage must be between 0 and 1.")
+def run_load_generator(conn_string, read_percentage, city_list, follower_reads, echo_sql, num_threads,
+                       engine="threads", concurrency=None, num_processes=1, stats_queue=None, txn_style='orm',
+                       location_batch_size=1, location_flush_interval=1.0, target_rate=None, arrivals='fixed',
+                       workload_profile='default', id_pool_size=DEFAULT_ID_POOL_SIZE,
+                       ride_duration=DEFAULT_RIDE_DURATION, ride_report_interval=DEFAULT_RIDE_REPORT_INTERVAL):
+    # a read percentage of None keeps the profile's
+    workload_mix = get_workload_mix(workload_profile, read_percentage)
+    rides = RideLifecycle(ride_duration, ride_report_interval)
+    if location_batch_size < 1 or location_flush_interval <= 0:
+        raise ValueError("The location batch size must be at least 1, and the flush interval more than 0 seconds.")
+    if target_rate is not None and target_rate <= 0:
+        raise ValueError("The target rate must be more than 0 operations per second.")
+    if id_pool_size is not None and id_pool_size < 1:
+        raise ValueError("The id pool size must be at least 1.")
+
+    if num_processes > 1:
+        return run_load_generator_processes(conn_string, read_percentage, city_list, follower_reads, echo_sql,
+                                            num_threads, engine, concurrency, num_processes, txn_style,
+                                            location_batch_size, location_flush_interval, target_rate, arrivals,
+                                            workload_profile, workload_mix, id_pool_size, ride_duration,
+                                            ride_report_interval)
 
     logging.info("Simulating movr load for cities %s.", city_list)
 
+    movr_objects, active_rides = warm_up(conn_string, city_list, follower_reads, echo_sql, id_pool_size)
+    # rides that were in progress already get the rest of a ride's time, like new ones
+    rides.extend(active_rides)
+
+    # the schedule starts after warming up, so the first ticks aren't already late
+    schedule = ArrivalSchedule(target_rate, arrivals) if target_rate else None
+    if schedule:
+        logging.info("Targeting %s operations per second with %s arrivals.", round(target_rate, 2), arrivals)
+
+    if engine == "asyncio":
+        try:
+            asyncio.run(run_async_load_generator(conn_string, workload_mix, city_list, follower_reads, echo_sql,
+                                                 concurrency or num_threads, movr_objects, rides, stats_queue,
+                                                 txn_style, location_batch_size, location_flush_interval, schedule))
+        finally:
+            if stats_queue is None:
+                report_run_end(workload_mix)
+        return
+
+    RUNNING_THREADS = []
+    logging.info("Running queries...")
+    for i in range(num_threads):
+        t = threading.Thread(target=simulate_movr_load, args=(conn_string, city_list, movr_objects,
+                                                              rides, workload_mix, follower_reads,
+                                                              echo_sql, txn_style, location_batch_size,
+                                                              location_flush_interval, schedule))
+        t.start()
+        RUNNING_THREADS.append(t)
+
+    try:
+        # keep main thread alive to catch exit signals
+        while sleep_unless_terminated(stats_report_interval(stats_queue)):
+            report_stats_window(stats_queue, movr_objects, rides)
+        stopped = wait_for_workers(RUNNING_THREADS)
+        # the last, partial window, including the location samples the threads flushed on their way out
+        report_stats_window(stats_queue, movr_objects, rides)
+    finally:
+        if stats_queue is None:
+            report_run_end(workload_mix)
+    if not stopped:
+        logging.info("Grace period has passed. Killing threads.")
+        os._exit(1)
+
+
+async def run_async_load_generator(conn_string, workload_mix, city_list, follower_reads, echo_sql, concurrency,
+                                   movr_objects, rides, stats_queue=None, txn_style='orm',
+                                   location_batch_size=1, location_flush_interval=1.0, schedule=None):
+    # imported here so the asyncpg driver is only required for '--engine asyncio'
+    from movr_async import AsyncMovR
+
+    movr = AsyncMovR(conn_string, echo=echo_sql, txn_style=txn_style)
+    # handle ctrl + c on the event loop, so the handler never runs in the middle of it, and the tasks can finish their
+    # operations and flush their location samples
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGINT, signal_handler, signal.SIGINT, None)
+    try:
+        logging.info("Running queries with %d concurrent tasks...", concurrency)
+        tasks = [asyncio.create_task(simulate_movr_load_async(movr, city_list, movr_objects, rides,
+                                                              workload_mix, follower_reads, location_batch_size,
+                                                              location_flush_interval, schedule))
+                 for i in range(concurrency)]
+
+        while not all(task.done() for task in tasks) and \
+                await sleep_unless_terminated_async(stats_report_interval(stats_queue)):
+            report_stats_window(stats_queue, movr_objects, rides)
+        done, pending = await asyncio.wait(tasks, timeout=SHUTDOWN_GRACE_PERIOD_SECONDS)
+        if pending:
+            logging.info("Grace period has passed. Cancelling %d tasks.", len(pending))
+            for task in pending:
+                task.cancel()
+            await asyncio.wait(pending)
+        # the last, partial window, including the location samples the tasks flushed on their way out
+        report_stats_window(stats_queue, movr_objects, rides)
+
+        await movr.engine.dispose()
+    finally:
+        loop.remove_signal_handler(signal.SIGINT)
+        signal.signal(signal.SIGINT, signal_handler)
+
+
+async def sleep_unless_terminated_async(seconds):
+    end = time.time() + seconds
+    while time.time() < end and not TERMINATE_GRACEFULLY:
+        await asyncio.sleep(min(end - time.time(), .1))
+    return not TERMINATE_GRACEFULLY
+
+
+# Print the stats once per window. In a worker process, hand the measurements to the parent process every second
+# instead, so the parent can print the windows of all workers as one table.
+
+
+def stats_report_interval(stats_queue=None):
+    return STATS_WINDOW_SECONDS if stats_queue is None else 1
+
+
+# Print the configured share of each action next to the share the workload performed, when the run ends. They differ
+# when a tick can't perform its action, e.g. an end ride while no rides are active, when operations failed, or when
+# rides that were due to end were ended on top of the ticks' actions.
+
+
+def report_workload_mix(workload_mix):
+    print(tabulate(workload_mix.compare(stats.get_cumulative_counts()),
+                   ["action", "configured(%)", "observed(%)", "observed ops"]), "\n")
+
+
+# When the run ends, report the workload mix and hand the summary of the whole run to the metrics sinks.
+def report_run_end(workload_mix):
+    report_workload_mix(workload_mix)
+    if METRICS_SINKS:
+        summary = stats.get_run_summary(RUN_ACTIONS)
+        while METRICS_SINKS:
+            METRICS_SINKS.pop(0).close(summary)
+
+
+# close the stats window: print it, and publish it to the metrics sinks
+def publish_stats_window():
+    window = stats.close_window(RUN_ACTIONS)
+    print_window_summary(window)
+    for sink in METRICS_SINKS:
+        sink.write_window(window)
+
+
+def report_stats_window(stats_queue=None, movr_objects=None, rides=None):
+    if movr_objects is not None:
+        set_id_pool_gauges(movr_objects)
+    if rides is not None:
+        stats.set_gauge("active rides", len(rides))
+    if stats_queue is None:
+        publish_stats_window()
+    else:
+        # the parent keeps the latest gauges of each worker process apart, and prints their sum
+        window_stats, window_errors, window_retries = stats.drain_window()
+        stats_queue.put((os.getpid(), window_stats, window_errors, window_retries, stats.get_gauges()))
+
+
+def run_load_generator_processes(conn_string, read_percentage, city_list, follower_reads, echo_sql, num_threads,
+                                 engine, concurrency, num_processes, txn_style='orm', location_batch_size=1,
+                                 location_flush_interval=1.0, target_rate=None, arrivals='fixed',
+                                 workload_profile='default', workload_mix=None, id_pool_size=DEFAULT_ID_POOL_SIZE,
+                                 ride_duration=DEFAULT_RIDE_DURATION, ride_report_interval=DEFAULT_RIDE_REPORT_INTERVAL):
+    stats_queue = multiprocessing.Queue()
+    shards = shard_cities(city_list, num_processes)
+    # each worker process schedules its share of the target rate
+    processes = start_worker_processes(run_load_generator, [
+        dict(conn_string=conn_string, read_percentage=read_percentage, city_list=shard,
+             follower_reads=follower_reads, echo_sql=echo_sql, num_threads=num_threads, engine=engine,
+             concurrency=concurrency, stats_queue=stats_queue, txn_style=txn_style,
+             location_batch_size=location_batch_size, location_flush_interval=location_flush_interval,
+             target_rate=target_rate / len(shards) if target_rate else None, arrivals=arrivals,
+             workload_profile=workload_profile, id_pool_size=id_pool_size, ride_duration=ride_duration,
+             ride_report_interval=ride_report_interval)
+        for shard in shards])
+
+    def running():
+        return not TERMINATE_GRACEFULLY and all(p.is_alive() for p in processes)
+
+    try:
+        while running():  # keep main process alive to catch exit signals
+            window_end = time.time() + STATS_WINDOW_SECONDS
+            while time.time() < window_end and running():
+                merge_worker_window(stats_queue, min(max(window_end - time.time(), 0), 1))
+            if running():
+                publish_stats_window()
+
+        # a worker only stops on its own if it failed, e.g. it couldn't warm up or hit an error it doesn't retry
+        worker_stopped = not TERMINATE_GRACEFULLY
+        if worker_stopped:
+            for p in processes:
+                if p.is_alive():
+                    os.kill(p.pid, signal.SIGINT)
+                else:
+                    logging.error("Worker process %s stopped. Stopping the run.", p.name)
+
+        # the workers stop on the same ctrl + c; take in their last windows while they do
+        deadline = time.time() + SHUTDOWN_GRACE_PERIOD_SECONDS
+        while any(p.is_alive() for p in processes) and time.time() < deadline:
+            merge_worker_window(stats_queue, .1)
+        while merge_worker_window(stats_queue, .1):
+            pass
+        publish_stats_window()
+        for p in processes:
+            if p.is_alive():
+                logging.info("Grace period has passed. Killing worker process %s.", p.name)
+                p.terminate()
+    finally:
+        report_run_end(workload_mix or get_workload_mix(workload_profile, read_percentage))
+    return check_worker_processes(processes) and not worker_stopped
+
+
+# Merge a window of stats sent by a worker process, waiting at most `timeout` seconds for one. Returns False if none
+# came.
+def merge_worker_window(stats_queue, timeout):
+    try:
+        source, window_stats, window_errors, window_retries, gauges = stats_queue.get(timeout=timeout)
+    except queue.Empty:
+        return False
+    stats.merge_window(window_stats, window_errors, window_retries)
+    for name, value in gauges.items():
+        stats.set_gauge(name, value, source)
+    return True
+
+
+##############
+# WORKER PROCESSES
+##############
+
+
+def shard_cities(cities, num_processes):
+    # don't create more than 1 process per city
+    usable_processes = min(num_processes, len(cities))
+    if usable_processes < num_processes:
+        logging.info("Only using %d of %d requested processes, since we only create at most one process per city.",
+                     usable_processes, num_processes)
+    return [cities[i::usable_processes] for i in range(usable_processes)]
+
+
+def start_worker_processes(target, kwargs_per_process):
+    processes = []
+    for i, kwargs in enumerate(kwargs_per_process):
+        p = multiprocessing.Process(target=run_worker_process, name="worker-%d" % i,
+                                    args=(dict(POOL_SETTINGS), dict(FAKE_DATA_SETTINGS), dict(FOLLOWER_READ_SETTINGS),
+                                          dict(READ_CACHE_SETTINGS), logging.getLogger().level,
+                                          stats.significant_digits, target, kwargs))
+        p.start()
+        processes.append(p)
+    return processes
+
+
+# Returns True if every worker process exited cleanly, and otherwise logs the ones that didn't.
+def check_worker_processes(processes):
+    for p in processes:
+        p.join()
+    failed = [p for p in processes if p.exitcode != 0]
+    for p in failed:
+        logging.error("Worker process %s exited with code %s.", p.name, p.exitcode)
+    return not failed
+
+
+# A worker process exits with code 1 if its target returns False, i.e. it didn't finish its share of the work.
+def run_worker_process(pool_settings, fake_data_settings, follower_read_settings, read_cache_settings, log_level,
+                       histogram_precision, target, kwargs):
+    global stats
+    stats = MovRStats(significant_digits=histogram_precision)
+    signal.signal(signal.SIGINT, signal_handler)
+    logging.basicConfig(level=log_level, format=LOG_FORMAT)
+    discard_engines()
+    configure_connection_pool(**pool_settings)
+    configure_fake_pools(**fake_data_settings)
+    configure_follower_reads(**follower_read_settings)
+    configure_read_cache(**read_cache_settings)
+    if target(**kwargs) is False:
+        sys.exit(1)
+
+
+# load the ids the workload picks from, and the rides that are still in progress
+
+
+# Users and vehicles are kept in an IdPool per city, and promo codes in one global pool, each of at most id_pool_size
+# entries (None for no limit).
+
+
+def warm_up(conn_string, city_list, follower_reads, echo_sql, id_pool_size=DEFAULT_ID_POOL_SIZE):
     movr_objects = {"local": {}, "global": {}}
 
     logging.info("Warming up....")
     with MovR(conn_string, echo=echo_sql) as movr:
         active_rides = []
         for city in city_list:
-            movr_objects["local"][city] = {"users": movr.get_users(
-                city, follower_reads), "vehicles": movr.get_vehicles(city, follower_reads)}
-            if len(list(movr_objects["local"][city]["vehicles"])) == 0 or len(list(movr_objects["local"][city]["users"])) == 0:
+            users, vehicles = IdPool(id_pool_size), IdPool(id_pool_size)
+            users.extend(user['id'] for user in movr.get_users(city, follower_reads))
+            vehicles.extend(vehicle['id'] for vehicle in movr.get_vehicles(city, follower_reads))
+            movr_objects["local"][city] = {"users": users, "vehicles": vehicles}
+            if len(vehicles) == 0 or len(users) == 0:
                 logging.error(
                     "Must have users and vehicles for city '%s' in the database to generate load. Try running with the 'load' command.", city)
                 sys.exit(1)
 
             active_rides.extend(movr.get_active_rides(city, follower_reads))
-        movr_objects["global"]["promo_codes"] = movr.get_promo_codes()
+        movr_objects["global"]["promo_codes"] = IdPool(id_pool_size, ValueStore())
+        movr_objects["global"]["promo_codes"].extend(movr.get_promo_codes())
+
+    return movr_objects, active_rides
 
-    RUNNING_THREADS = []
-    logging.info("Running queries...")
-    for i in range(num_threads):
-        t = threading.Thread(target=simulate_movr_load, args=(conn_string, city_list, movr_objects,
-                                                              active_rides, read_percentage, follower_reads,
-                                                              connection_duration_in_seconds, echo_sql))
-        t.start()
-        RUNNING_THREADS.append(t)
 
-    while True:  # keep main thread alive to catch exit signals
-        time.sleep(15)
+# report the number of pooled ids and their memory as gauges in the stats output
 
-        stats.print_stats(action_list=[ACTION_ADD_VEHICLE, ACTION_GET_VEHICLES, ACTION_UPDATE_RIDE_LOC,
-                                       ACTION_NEW_CODE, ACTION_APPLY_CODE, ACTION_NEW_USER,
-                                       ACTION_START_RIDE, ACTION_END_RIDE])
 
-        stats.new_window()
+def set_id_pool_gauges(movr_objects):
+    pools = [movr_objects["global"]["promo_codes"]] + \
+        [pool for city_pools in movr_objects["local"].values() for pool in city_pools.values()]
+    stats.set_gauge("id pool entries", sum(len(pool) for pool in pools))
+    stats.set_gauge("id pool memory (MiB)", round(sum(pool.memory_usage() for pool in pools) / 1048576.0, 2))
+    if get_read_cache() is not None:
+        stats.set_gauge("read cache entries", len(get_read_cache()))
 
 def configure_multi_region(conn_string, primary_region, city_list, region_city_pair, echo_sql, preview):
 
@@ -502,7 +1347,7 @@ def configure_multi_region(conn_string, primary_region, city_list, region_city_p
 
     with MovR(conn_string, primary_region=primary_region, multi_region=True, echo=echo_sql) as movr:
         regions = movr.get_regions()
-        cities = movr.get_cities(city_list)
+        cities = movr.get_cities()
         if regions is None:
             logging.error("To configure your database for multi-region features, you must specify cluster regions at startup.")
             sys.exit(1)
@@ -587,8 +1432,6 @@ def assign_regions(cities, regions, primary_region, region_pairs=None):
 
 if __name__ == '__main__':
 
-    global stats
-    stats = MovRStats()
     # support ctrl + c for exiting multithreaded operation
     signal.signal(signal.SIGINT, signal_handler)
 
@@ -603,6 +1446,43 @@ if __name__ == '__main__':
         logging.error("Number of threads must be greater than 0.")
         sys.exit(1)
 
+    if args.num_processes is None:
+        args.num_processes = multiprocessing.cpu_count() if args.subparser_name == 'generate' else 1
+
+    if args.num_processes <= 0:
+        logging.error("Number of processes must be greater than 0.")
+        sys.exit(1)
+
+    if args.histogram_precision < 1 or args.histogram_precision > 5:
+        logging.error("Histogram precision must be between 1 and 5 significant digits.")
+        sys.exit(1)
+
+    try:
+        fake_pool_sizes = parse_pool_sizes(args.fake_pool_sizes)
+    except ValueError as err:
+        logging.error(err)
+        sys.exit(1)
+
+    if args.subparser_name in ('load', 'generate') and args.seed is not None:
+        if args.seed < 0:
+            logging.error("The seed must be a non-negative integer.")
+            sys.exit(1)
+        # values generated by Faker on every call can't be seeded per chunk
+        if not all(fake_pool_sizes.values()):
+            logging.error("A seeded load needs a fake value pool for every field. Don't set '--fake-pool-size' to 0.")
+            sys.exit(1)
+
+    global stats
+    stats = MovRStats(significant_digits=args.histogram_precision)
+
+    if args.subparser_name == 'run' and args.concurrency is not None and args.concurrency <= 0:
+        logging.error("Concurrency must be greater than 0.")
+        sys.exit(1)
+
+    if args.pool_size is not None and args.pool_size <= 0:
+        logging.error("Pool size must be greater than 0.")
+        sys.exit(1)
+
     if args.log_level not in ['debug', 'info', 'warning', 'error']:
         logging.error("Invalid log level: %s", args.log_level)
         sys.exit(1)
@@ -615,9 +1495,10 @@ if __name__ == '__main__':
     }
 
     logging.basicConfig(level=level_map[args.log_level],
-                        format='[%(levelname)s] (%(threadName)-10s) %(message)s', )
+                        format=LOG_FORMAT, )
 
-    logging.info("connected to database @ %s" % args.conn_string)
+    if args.subparser_name != 'generate':
+        logging.info("connected to database @ %s" % args.conn_string)
 
     # format connection string to work with our cockroachdb driver.
     conn_string = args.conn_string.replace("postgres://", "cockroachdb://")
@@ -625,24 +1506,92 @@ if __name__ == '__main__':
     conn_string = set_query_parameter(
         conn_string, "application_name", args.app_name)
 
+    if args.subparser_name == 'run':
+        connection_duration_in_seconds = args.connection_duration_in_seconds
+    elif args.subparser_name is None:
+        connection_duration_in_seconds = 60
+    else:
+        connection_duration_in_seconds = None
+    configure_connection_pool(pool_size=args.pool_size or args.num_threads, max_overflow=args.max_overflow,
+                              pool_pre_ping=args.pool_pre_ping, max_connection_age=connection_duration_in_seconds,
+                              prepared_statements=args.subparser_name == 'run' and args.prepared_statements)
+    configure_fake_pools(pool_sizes=fake_pool_sizes, cache_dir=args.fake_cache_dir)
+
+    if args.subparser_name == 'run':
+        if not args.follower_reads and (args.follower_read_staleness is not None or
+                                        args.follower_read_max_staleness is not None):
+            logging.error("A follower read staleness needs '--follower-reads'.")
+            sys.exit(1)
+        try:
+            configure_follower_reads(mode=args.follower_read_mode, exact_staleness=args.follower_read_staleness,
+                                     max_staleness=args.follower_read_max_staleness)
+        except ValueError as err:
+            logging.error(err)
+            sys.exit(1)
+        if args.read_cache_ttl is not None and args.read_cache_ttl < 0:
+            logging.error("The read cache time to live must not be negative.")
+            sys.exit(1)
+        if args.read_cache_size <= 0:
+            logging.error("The read cache size must be greater than 0.")
+            sys.exit(1)
+        configure_read_cache(ttl=args.read_cache_ttl, max_entries=args.read_cache_size)
+
     if args.subparser_name == 'load':
         city_list = get_city_list(args.city)
-        run_data_loader(conn_string, cities=city_list, 
+        loaded = run_data_loader(conn_string, cities=city_list,
                         num_users=args.num_users, num_rides=args.num_rides, num_vehicles=args.num_vehicles, 
                         num_histories=args.num_histories, num_promo_codes=args.num_promo_codes, num_threads=args.num_threads,
-                        skip_reload_tables=args.skip_reload_tables, echo_sql=args.echo_sql)
-        
+                        skip_reload_tables=args.skip_reload_tables, echo_sql=args.echo_sql, num_processes=args.num_processes,
+                        load_method=args.load_method, resume=args.resume, seed=args.seed)
+        if not loaded:
+            sys.exit(1)
+
         if args.multi_region:
             configure_multi_region(conn_string, primary_region=None, city_list=city_list, region_city_pair=args.region_city_pair, echo_sql=args.echo_sql, preview=False)
 
+    elif args.subparser_name == 'generate':
+        try:
+            # fail before starting any workers if the format's dependencies are missing
+            get_file_writer(args.file_format, args.out_dir)
+        except ValueError as err:
+            logging.error(err)
+            sys.exit(1)
+        if not run_data_generator(args.out_dir, args.file_format, cities=get_city_list(args.city),
+                                  num_users=args.num_users, num_rides=args.num_rides, num_vehicles=args.num_vehicles,
+                                  num_histories=args.num_histories, num_promo_codes=args.num_promo_codes,
+                                  num_user_promo_codes=args.num_user_promo_codes, num_threads=args.num_threads,
+                                  num_processes=args.num_processes, seed=args.seed):
+            sys.exit(1)
+
     elif args.subparser_name == "configure-multi-region":
 
         configure_multi_region(conn_string, primary_region=args.primary_region, city_list=None, region_city_pair=args.region_city_pair, echo_sql=args.echo_sql, preview=args.preview_queries)
 
     elif args.subparser_name == "run":
-        run_load_generator(conn_string, read_percentage=args.read_percentage, connection_duration_in_seconds=args.connection_duration_in_seconds,
-                           city_list=get_city_list(args.city), follower_reads=args.follower_reads, echo_sql=args.echo_sql, num_threads=args.num_threads)
+        try:
+            # fail with a readable message if the profile or read percentage is invalid
+            get_workload_mix(args.workload_profile, args.read_percentage)
+        except ValueError as err:
+            logging.error(err)
+            sys.exit(1)
+        try:
+            METRICS_SINKS.extend(open_metrics_sinks(stats, args.metrics_file, args.prometheus_port,
+                                                    args.prometheus_host, RUN_ACTIONS))
+        except OSError as err:
+            logging.error("Can't publish metrics: %s", err)
+            sys.exit(1)
+        if run_load_generator(conn_string, read_percentage=args.read_percentage,
+                              city_list=get_city_list(args.city), follower_reads=args.follower_reads, echo_sql=args.echo_sql, num_threads=args.num_threads,
+                              engine=args.engine, concurrency=args.concurrency, num_processes=args.num_processes,
+                              txn_style=args.txn_style, location_batch_size=args.location_batch_size,
+                              location_flush_interval=args.location_flush_interval, target_rate=args.target_rate,
+                              arrivals=args.arrivals, workload_profile=args.workload_profile,
+                              id_pool_size=args.id_pool_size or None, ride_duration=args.ride_duration,
+                              ride_report_interval=args.ride_report_interval) is False:
+            sys.exit(1)
     else:
-        run_load_generator(conn_string, read_percentage=DEFAULT_READ_PERCENTAGE,
-                           connection_duration_in_seconds=60, city_list=get_city_list(None),
-                           follower_reads=False, echo_sql=args.echo_sql, num_threads=args.num_threads)
+        if run_load_generator(conn_string, read_percentage=DEFAULT_READ_PERCENTAGE,
+                              city_list=get_city_list(None),
+                              follower_reads=False, echo_sql=args.echo_sql, num_threads=args.num_threads,
+                              num_processes=args.num_processes) is False:
+            sys.exit(1)
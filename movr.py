@@ -1,15 +1,504 @@
-from sqlalchemy import create_engine, inspect, text, Column, String
+from sqlalchemy import bindparam, create_engine, event, insert, inspect, select, text, update, Column, String
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.exc import DBAPIError, DisconnectionError, ProgrammingError
 from sqlalchemy.sql import column
 from sqlalchemy.types import Enum
 from models import Base, User, Vehicle, Ride, VehicleLocationHistory, PromoCode, UserPromoCode
-from sqlalchemy_cockroachdb import run_transaction
 from generators import MovRGenerator
 import sys
 
+import collections
+import contextvars
 import datetime
 import logging
+import random
+import threading
+import time
+
+
+##################
+# SHARED ENGINES
+#################
+
+# Every MovR instance in the process shares one engine (and so one connection pool) per connection string.
+ENGINES = {}
+ENGINES_LOCK = threading.Lock()
+POOL_SETTINGS = {'pool_size': 5, 'max_overflow': 10, 'pool_pre_ping': False, 'max_connection_age': None,
+                 'prepared_statements': False}
+
+
+def configure_connection_pool(pool_size=5, max_overflow=10, pool_pre_ping=False, max_connection_age=None,
+                              prepared_statements=False):
+    # Must be called before the first engine is created; engines that already exist keep their settings.
+    POOL_SETTINGS.update({'pool_size': pool_size, 'max_overflow': max_overflow, 'pool_pre_ping': pool_pre_ping,
+                          'max_connection_age': max_connection_age, 'prepared_statements': prepared_statements})
+
+
+# With follower_read_session, the engine's connections make every transaction a follower read (see
+# add_follower_read_session). They can only read, so they are pooled apart from the connections of the same string.
+def get_engine(conn_string, echo=False, follower_read_session=False):
+    with ENGINES_LOCK:
+        key = (conn_string, echo, 'follower reads') if follower_read_session else (conn_string, echo)
+        if key not in ENGINES:
+            ENGINES[key] = create_pooled_engine(conn_string, echo, **POOL_SETTINGS)
+            if follower_read_session:
+                add_follower_read_session(ENGINES[key])
+        return ENGINES[key]
+
+
+def discard_engines():
+    # Called in a forked worker process: forget the parent's engines without closing their connections,
+    # which still belong to the parent.
+    with ENGINES_LOCK:
+        for engine in ENGINES.values():
+            getattr(engine, 'sync_engine', engine).dispose(close=False)
+        ENGINES.clear()
+
+
+def create_pooled_engine(conn_string, echo, pool_size, max_overflow, pool_pre_ping, max_connection_age,
+                         prepared_statements=False):
+    engine = create_engine(conn_string, echo=echo, pool_size=pool_size, max_overflow=max_overflow,
+                           pool_pre_ping=pool_pre_ping)
+    if max_connection_age:
+        add_connection_rotation(engine, max_connection_age)
+    if prepared_statements:
+        add_prepared_statements(engine)
+    return engine
+
+
+def add_connection_rotation(engine, max_connection_age):
+    # Rotate connections so load can balance among cluster nodes even if the cluster size changes.
+    # Each connection gets its own jittered deadline, so connections are replaced one at a time on checkout
+    # instead of all at once.
+    @event.listens_for(engine, "connect")
+    def set_connection_deadline(dbapi_connection, connection_record):
+        connection_record.info['expires_at'] = time.time() + max_connection_age * random.uniform(.5, 1)
+
+    @event.listens_for(engine, "checkout")
+    def rotate_expired_connection(dbapi_connection, connection_record, connection_proxy):
+        if time.time() > connection_record.info.get('expires_at', float('inf')):
+            logging.debug("Rotating a connection that reached its maximum age.")
+            # the pool invalidates this connection and transparently retries the checkout with a new one
+            raise DisconnectionError()
+
+
+# The statements of the hottest API calls, built once with bind parameters. A call only binds its arguments and finds
+# the compiled statement in the engine's cache, instead of building a query and generating its cache key every time.
+# Reads are keyed by whether they have a LIMIT.
+def select_city_rows_statement(model, limited, active_rides=False):
+    table = model.__table__
+    stmt = select(table.c.city, table.c.id).where(table.c.city == bindparam('city'))
+    if active_rides:
+        stmt = stmt.where(table.c.end_time.is_(None))
+    return stmt.limit(bindparam('limit')) if limited else stmt
+
+
+CACHED_STATEMENTS = {(name, limited): select_city_rows_statement(model, limited, active_rides)
+                     for name, model, active_rides in [('movr_get_users', User, False),
+                                                       ('movr_get_vehicles', Vehicle, False),
+                                                       ('movr_get_active_rides', Ride, True)]
+                     for limited in (False, True)}
+CACHED_STATEMENTS.update({
+    ('movr_get_promo_codes', False): select(PromoCode.__table__.c.code),
+    ('movr_get_promo_codes', True): select(PromoCode.__table__.c.code).limit(bindparam('limit')),
+    'movr_update_ride_location': insert(VehicleLocationHistory.__table__),
+})
+
+
+# The statements of the hottest API calls, prepared on the server once per connection with PREPARE, so that each call
+# only sends an EXECUTE with its arguments. The MovR tables must exist when a connection is opened.
+PREPARED_STATEMENTS = {
+    'movr_get_vehicles': 'PREPARE movr_get_vehicles (STRING, INT) AS '
+                         'SELECT city, id FROM vehicles WHERE city = $1 LIMIT $2',
+    'movr_get_users': 'PREPARE movr_get_users (STRING, INT) AS '
+                      'SELECT city, id FROM users WHERE city = $1 LIMIT $2',
+    'movr_get_active_rides': 'PREPARE movr_get_active_rides (STRING, INT) AS '
+                             'SELECT city, id FROM rides WHERE city = $1 AND end_time IS NULL LIMIT $2',
+    'movr_update_ride_location': 'PREPARE movr_update_ride_location (STRING, UUID, TIMESTAMP, FLOAT, FLOAT) AS '
+                                 'INSERT INTO vehicle_location_histories (city, ride_id, timestamp, lat, long) '
+                                 'VALUES ($1, $2, $3, $4, $5)',
+}
+
+
+def add_prepared_statements(engine):
+    @event.listens_for(engine, "connect")
+    def prepare_statements(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in PREPARED_STATEMENTS.values():
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+        dbapi_connection.commit()
+
+
+# run a statement prepared by add_prepared_statements in the session's transaction
+def execute_prepared(session, name, parameters):
+    return session.connection().exec_driver_sql(
+        'EXECUTE {0} ({1})'.format(name, ', '.join(['%s'] * len(parameters))), tuple(parameters))
+
+
+##################
+# TRANSACTIONS
+#################
+
+# the SQLSTATE of the errors after which CockroachDB expects the client to retry the transaction
+RETRYABLE_SQLSTATE = '40001'
+TRANSACTION_PHASES = ['acquire', 'execute', 'commit']
+
+
+class TransactionTimings:
+    """The time a MovR API call spent in each phase of its transactions (acquiring a pooled connection, executing
+    its statements and committing), summed over every attempt, and how many times the transactions were retried.
+
+    A read that went through the read cache also notes whether the cache had it (`cache_hit`), and if so, how many
+    seconds old the cached result was (`cache_age`)."""
+
+    __slots__ = ['acquire', 'execute', 'commit', 'retries', 'transactions', 'cache_hit', 'cache_age']
+
+    def __init__(self):
+        self.acquire = 0.0
+        self.execute = 0.0
+        self.commit = 0.0
+        self.retries = 0
+        self.transactions = 0
+        self.cache_hit = None
+        self.cache_age = None
+
+    # add one attempt at a transaction, given the times it started and finished each phase it got to. An attempt
+    # that failed ends with the time it failed, which counts towards the phase it failed in.
+    def add_attempt(self, marks):
+        for phase, start, end in zip(TRANSACTION_PHASES, marks, marks[1:]):
+            setattr(self, phase, getattr(self, phase) + end - start)
+
+    def get_phases(self):
+        return {phase: getattr(self, phase) for phase in TRANSACTION_PHASES}
+
+
+# The timings that run_transaction adds to. A caller that wants the timings of an API call sets a TransactionTimings
+# here for the duration of the call; as a context variable, it is separate for every thread and every asyncio task.
+TRANSACTION_TIMINGS = contextvars.ContextVar('movr_transaction_timings', default=None)
+
+
+def is_retryable_error(err):
+    orig = getattr(err, 'orig', None)
+    return RETRYABLE_SQLSTATE in (getattr(orig, 'pgcode', None), getattr(orig, 'sqlstate', None))
+
+
+# the class of the database error behind an exception, e.g. SerializationFailure rather than the DBAPIError that wraps
+# it
+def get_error_class(err):
+    return type(getattr(err, 'orig', None) or err).__name__
+
+
+# Run callback(session) in a transaction, and retry the transaction as long as it fails with a retryable error, like
+# sqlalchemy_cockroachdb's run_transaction. Unlike it, a retry rolls back the whole transaction and starts over instead
+# of rolling back to a savepoint, so the phases of every attempt can be timed and added to TRANSACTION_TIMINGS.
+def run_transaction(sessionmaker, callback, max_retries=None):
+    timings = TRANSACTION_TIMINGS.get() or TransactionTimings()
+    timings.transactions += 1
+    retries = 0
+    with sessionmaker() as session:
+        while True:
+            marks = [time.perf_counter()]
+            try:
+                session.connection()
+                marks.append(time.perf_counter())
+                result = callback(session)
+                # flush ORM changes here rather than in the commit, so their statements count as executing
+                session.flush()
+                marks.append(time.perf_counter())
+                session.commit()
+                marks.append(time.perf_counter())
+            except DBAPIError as err:
+                marks.append(time.perf_counter())
+                session.rollback()
+                timings.add_attempt(marks)
+                if not is_retryable_error(err) or (max_retries is not None and retries >= max_retries):
+                    raise
+                retries += 1
+                timings.retries += 1
+                continue
+            timings.add_attempt(marks)
+            return result
+
+
+# Run callback(connection) outside of an explicit transaction, so that each statement it runs is a transaction of its
+# own, without a BEGIN or COMMIT round trip. CockroachDB retries such a statement itself when it can, so this retries it
+# only as long as it fails with a retryable error anyway. The commit is part of executing the statement.
+def run_implicit_transaction(engine, callback, max_retries=None):
+    timings = TRANSACTION_TIMINGS.get() or TransactionTimings()
+    timings.transactions += 1
+    retries = 0
+    while True:
+        marks = [time.perf_counter()]
+        try:
+            with engine.connect() as conn:
+                conn.execution_options(isolation_level='AUTOCOMMIT')
+                marks.append(time.perf_counter())
+                result = callback(conn)
+                marks.append(time.perf_counter())
+        except DBAPIError as err:
+            marks.append(time.perf_counter())
+            timings.add_attempt(marks)
+            if not is_retryable_error(err) or (max_retries is not None and retries >= max_retries):
+                raise
+            retries += 1
+            timings.retries += 1
+            continue
+        timings.add_attempt(marks)
+        return result
+
+
+##################
+# FOLLOWER READS
+#################
+
+# How reads with follower_reads=True read from the closest replica:
+#   'set'      runs SET TRANSACTION AS OF SYSTEM TIME before its query, which costs a round trip of its own
+#   'inline'   puts AS OF SYSTEM TIME in the query itself, and runs it as an implicit transaction, so the read is a
+#              single round trip with no BEGIN, SET or COMMIT
+#   'session'  reads on connections of their own that have follower reads as their session default, set once when
+#              each connection is opened
+# Reads are as stale as follower_read_timestamp() allows, unless an exact staleness or (for 'inline' only, since
+# bounded staleness needs a single-statement transaction) a maximum staleness in seconds is configured.
+FOLLOWER_READ_MODES = ['set', 'inline', 'session']
+FOLLOWER_READ_SETTINGS = {'mode': 'set', 'exact_staleness': None, 'max_staleness': None}
+
+
+def configure_follower_reads(mode='set', exact_staleness=None, max_staleness=None):
+    if mode not in FOLLOWER_READ_MODES:
+        raise ValueError("Unknown follower read mode '{0}'. Use one of {1}.".format(mode, FOLLOWER_READ_MODES))
+    if exact_staleness is not None and max_staleness is not None:
+        raise ValueError("Set an exact or a maximum follower read staleness, not both.")
+    if any(staleness is not None and staleness <= 0 for staleness in (exact_staleness, max_staleness)):
+        raise ValueError("Follower read staleness must be more than 0 seconds.")
+    if max_staleness is not None and mode != 'inline':
+        raise ValueError("Bounded staleness reads need a single-statement transaction. Use follower read mode "
+                         "'inline'.")
+    if exact_staleness is not None and mode == 'session':
+        raise ValueError("Session defaults can only read at follower_read_timestamp(). Use follower read mode 'set' "
+                         "or 'inline' for an exact staleness.")
+    FOLLOWER_READ_SETTINGS.update({'mode': mode, 'exact_staleness': exact_staleness, 'max_staleness': max_staleness})
+
+
+# the timestamp expression of the AS OF SYSTEM TIME clause of follower reads, as configured
+def get_follower_read_timestamp():
+    if FOLLOWER_READ_SETTINGS['max_staleness'] is not None:
+        return "with_max_staleness('{0}s')".format(FOLLOWER_READ_SETTINGS['max_staleness'])
+    if FOLLOWER_READ_SETTINGS['exact_staleness'] is not None:
+        return "'-{0}s'".format(FOLLOWER_READ_SETTINGS['exact_staleness'])
+    return 'follower_read_timestamp()'
+
+
+def add_follower_read_session(engine):
+    @event.listens_for(engine, "connect")
+    def set_follower_read_default(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute('SET default_transaction_use_follower_reads = on')
+        finally:
+            cursor.close()
+        dbapi_connection.commit()
+
+
+# The reads of the 'inline' follower read mode, by the name of the cached statement they stand in for. The AS OF SYSTEM
+# TIME clause belongs to the FROM clause, where SQLAlchemy has no place for it, so these are written out.
+FOLLOWER_READ_QUERIES = {
+    'movr_get_users': 'SELECT city, id FROM users AS OF SYSTEM TIME {0} WHERE city = :city',
+    'movr_get_vehicles': 'SELECT city, id FROM vehicles AS OF SYSTEM TIME {0} WHERE city = :city',
+    'movr_get_active_rides': 'SELECT city, id FROM rides AS OF SYSTEM TIME {0} WHERE city = :city '
+                             'AND end_time IS NULL',
+    'movr_get_promo_codes': 'SELECT code FROM promo_codes AS OF SYSTEM TIME {0}',
+    'movr_get_cities': 'SELECT DISTINCT city FROM users AS OF SYSTEM TIME {0}',
+}
+FOLLOWER_READ_STATEMENTS = {}
+
+
+# the statement of an 'inline' follower read at the configured staleness, built once per staleness
+def get_follower_read_statement(name, limited):
+    key = (name, limited, get_follower_read_timestamp())
+    statement = FOLLOWER_READ_STATEMENTS.get(key)
+    if statement is None:
+        query = FOLLOWER_READ_QUERIES[name].format(key[2])
+        statement = FOLLOWER_READ_STATEMENTS[key] = text(query + ' LIMIT :limit' if limited else query)
+    return statement
+
+
+##################
+# READ CACHE
+#################
+
+# The app-tier cache in front of city-scoped reads, shared by every MovR instance in the process. It is off unless
+# configure_read_cache sets a time to live.
+READ_CACHE_SETTINGS = {'ttl': None, 'max_entries': 1000}
+READ_CACHE = None
+
+
+class ReadCache:
+    """The results of city-scoped reads, each kept for `ttl` seconds, and at most `max_entries` of them, evicting the
+    least recently used one first. Safe to share between threads.
+
+    Writes invalidate the cached reads of their city, but only writes made in this process: results are as stale as
+    the time to live allows when other processes write. Every city has a generation that its invalidations increase, so
+    a read that started before a write can't cache a result from before the write once the write has invalidated it."""
+
+    def __init__(self, ttl, max_entries=1000):
+        if ttl <= 0 or max_entries <= 0:
+            raise ValueError("The read cache needs a time to live of more than 0 seconds, and room for an entry.")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (expiration time, time cached, city, value), from the least to the most recently used
+        self.entries = collections.OrderedDict()
+        self.keys_by_city = {}
+        self.generations = {}
+        self.mutex = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # the value cached under key and its age in seconds, or None if it isn't cached or has expired
+    def get(self, key):
+        now = time.monotonic()
+        with self.mutex:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                self.remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[3], now - entry[1]
+
+    # the generation to pass to put for a read of the city that starts now
+    def get_generation(self, city):
+        with self.mutex:
+            return self.generations.get(city, 0)
+
+    def put(self, city, key, value, generation):
+        now = time.monotonic()
+        with self.mutex:
+            if self.generations.get(city, 0) != generation:
+                return
+            self.entries[key] = (now + self.ttl, now, city, value)
+            self.entries.move_to_end(key)
+            self.keys_by_city.setdefault(city, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self.remove(next(iter(self.entries)))
+
+    def invalidate(self, city):
+        with self.mutex:
+            self.generations[city] = self.generations.get(city, 0) + 1
+            for key in self.keys_by_city.pop(city, ()):
+                del self.entries[key]
+
+    # Callers must hold the mutex.
+    def remove(self, key):
+        city = self.entries.pop(key)[2]
+        keys = self.keys_by_city[city]
+        keys.discard(key)
+        if not keys:
+            del self.keys_by_city[city]
+
+
+# Turn the read cache on with a time to live in seconds, or off with None. Replaces any cache the process had, so a
+# worker process doesn't keep what it inherited.
+def configure_read_cache(ttl=None, max_entries=1000):
+    global READ_CACHE
+    READ_CACHE = ReadCache(ttl, max_entries) if ttl else None
+    READ_CACHE_SETTINGS.update({'ttl': ttl, 'max_entries': max_entries})
+
+
+# Look up a read in the read cache, and note whether it was cached in TRANSACTION_TIMINGS. Returns the cache, the
+# cached value or None, and the generation to cache a fresh value with.
+def look_up_read(city, key):
+    cache = READ_CACHE
+    if cache is None:
+        return None, None, None
+    generation = cache.get_generation(city)
+    cached = cache.get(key)
+    timings = TRANSACTION_TIMINGS.get()
+    if timings is not None:
+        timings.cache_hit = cached is not None
+        timings.cache_age = cached[1] if cached is not None else None
+    return cache, cached[0] if cached is not None else None, generation
+
+
+# the read cache of the process, or None if it's off
+def get_read_cache():
+    return READ_CACHE
+
+
+def invalidate_reads(city):
+    if READ_CACHE is not None:
+        READ_CACHE.invalidate(city)
+
+
+##################
+# OPTIMIZED TRANSACTIONS
+#################
+
+TXN_STYLES = ['orm', 'optimized']
+
+
+class MovRStatements:
+    """Core statements for the 'optimized' transaction style, shared by MovR and AsyncMovR.
+
+    Each one does in a single round trip what the ORM transactions do with a query per object: updates return the
+    columns they need, and promo codes are validated with a join instead of one query per code. They are built once
+    with bind parameters and kept in CACHED_STATEMENTS, so a transaction only binds its arguments."""
+
+    # mark a vehicle as in use, returning its location. Binds vehicle_id.
+    @staticmethod
+    def claim_vehicle():
+        vehicles = Vehicle.__table__
+        return update(vehicles).where(vehicles.c.id == bindparam('vehicle_id')).values(status='in_use') \
+            .returning(vehicles.c.current_location)
+
+    # add one use to each of the rider's promo codes that hasn't expired. Binds rider_id and now.
+    @staticmethod
+    def use_valid_promo_codes():
+        user_promo_codes, promo_codes = UserPromoCode.__table__, PromoCode.__table__
+        return update(user_promo_codes) \
+            .where(user_promo_codes.c.user_id == bindparam('rider_id'), user_promo_codes.c.code == promo_codes.c.code,
+                   promo_codes.c.expiration_time > bindparam('now')) \
+            .values(usage_count=user_promo_codes.c.usage_count + 1)
+
+    # binds the ride's id, city, rider_id, vehicle_id, start_address and start_time
+    @staticmethod
+    def insert_ride():
+        return insert(Ride.__table__)
+
+    # mark the vehicle of a ride as available, returning its location. Binds ride_id.
+    @staticmethod
+    def release_vehicle():
+        vehicles, rides = Vehicle.__table__, Ride.__table__
+        return update(vehicles).where(vehicles.c.id == rides.c.vehicle_id, rides.c.id == bindparam('ride_id')) \
+            .values(status='available').returning(vehicles.c.current_location)
+
+    # binds ride_id, end_address, revenue and end_time
+    @staticmethod
+    def finish_ride():
+        rides = Ride.__table__
+        return update(rides).where(rides.c.id == bindparam('ride_id')) \
+            .values(end_address=bindparam('end_address'), revenue=bindparam('revenue'), end_time=bindparam('end_time'))
+
+    # apply a code to a user's account if the code exists and hasn't been applied already. Binds user_city, user_id,
+    # code and now. Written as text because SQLAlchemy never caches the compiled form of a PostgreSQL INSERT with
+    # ON CONFLICT, which would compile this statement again on every call.
+    @staticmethod
+    def apply_promo_code():
+        user_promo_codes = UserPromoCode.__table__
+        return text('INSERT INTO user_promo_codes (city, user_id, code, timestamp, usage_count) '
+                    'SELECT CAST(:user_city AS STRING), CAST(:user_id AS UUID), code, CAST(:now AS TIMESTAMP), 0 '
+                    'FROM promo_codes WHERE code = :code ON CONFLICT DO NOTHING') \
+            .bindparams(bindparam('user_id', type_=user_promo_codes.c.user_id.type),
+                        bindparam('now', type_=user_promo_codes.c.timestamp.type))
+
+
+CACHED_STATEMENTS.update({'movr_' + name: getattr(MovRStatements, name)()
+                          for name in ['claim_vehicle', 'use_valid_promo_codes', 'insert_ride', 'release_vehicle',
+                                       'finish_ride', 'apply_promo_code']})
 
 
 class MovR:
@@ -20,11 +509,21 @@ class MovR:
     def __exit__(self, exc_type, exc_value, traceback):
         self.session.close()
 
-    def __init__(self, conn_string, reset_tables=False, multi_region=False, primary_region=None, echo=False):
-
-        self.engine = create_engine(
-            conn_string, echo=echo)
-        self.session = sessionmaker(bind=self.engine)()
+    def __init__(self, conn_string, reset_tables=False, multi_region=False, primary_region=None, echo=False,
+                 txn_style='orm'):
+
+        if txn_style not in TXN_STYLES:
+            raise ValueError("Unknown transaction style '{0}'. Use one of {1}.".format(txn_style, TXN_STYLES))
+        self.txn_style = txn_style
+        self.engine = get_engine(conn_string, echo=echo)
+        self.prepared_statements = POOL_SETTINGS['prepared_statements']
+        self.sessionmaker = sessionmaker(bind=self.engine)
+        self.session = self.sessionmaker()
+        if FOLLOWER_READ_SETTINGS['mode'] == 'session':
+            self.follower_read_sessionmaker = sessionmaker(bind=get_engine(conn_string, echo=echo,
+                                                                           follower_read_session=True))
+        else:
+            self.follower_read_sessionmaker = None
         if multi_region is True and primary_region is None:
             regions = self.get_regions()
             logging.info("Setting the primary region to {0}.".format(regions[0]))
@@ -73,8 +572,23 @@ class MovR:
             session.add(r)
             return {'city': r.city, 'id': r.id}
 
-        return run_transaction(sessionmaker(bind=self.engine),
-                               lambda session: start_ride_helper(session, city, rider_id, vehicle_id))
+        def start_ride_optimized_helper(session, city, rider_id, vehicle_id):
+            now = datetime.datetime.now()
+            connection = session.connection()
+            start_address = connection.execute(CACHED_STATEMENTS['movr_claim_vehicle'],
+                                               {'vehicle_id': vehicle_id}).scalar_one()
+            connection.execute(CACHED_STATEMENTS['movr_use_valid_promo_codes'], {'rider_id': rider_id, 'now': now})
+            ride_id = MovRGenerator.generate_uuid()
+            connection.execute(CACHED_STATEMENTS['movr_insert_ride'],
+                               {'id': ride_id, 'city': city, 'rider_id': rider_id, 'vehicle_id': vehicle_id,
+                                'start_address': start_address, 'start_time': now})
+            return {'city': city, 'id': ride_id}
+
+        helper = start_ride_optimized_helper if self.txn_style == 'optimized' else start_ride_helper
+        ride = run_transaction(self.sessionmaker,
+                               lambda session: helper(session, city, rider_id, vehicle_id))
+        invalidate_reads(city)
+        return ride
 
     def end_ride(self, city, ride_id):
 
@@ -87,19 +601,44 @@ class MovR:
             ride.update({'end_address': v.current_location, 'revenue': MovRGenerator.generate_revenue(),
                          'end_time': datetime.datetime.now()})
 
-        run_transaction(sessionmaker(bind=self.engine),
-                        lambda session: end_ride_helper(session, city, ride_id))
+        def end_ride_optimized_helper(session, city, ride_id):
+            connection = session.connection()
+            end_address = connection.execute(CACHED_STATEMENTS['movr_release_vehicle'],
+                                             {'ride_id': ride_id}).scalar_one()
+            connection.execute(CACHED_STATEMENTS['movr_finish_ride'],
+                               {'ride_id': ride_id, 'end_address': end_address,
+                                'revenue': MovRGenerator.generate_revenue(), 'end_time': datetime.datetime.now()})
+
+        helper = end_ride_optimized_helper if self.txn_style == 'optimized' else end_ride_helper
+        run_transaction(self.sessionmaker,
+                        lambda session: helper(session, city, ride_id))
+        invalidate_reads(city)
 
     def update_ride_location(self, city, ride_id, lat, long):
 
         def update_ride_location_helper(session, city, ride_id, lat, long):
-            h = VehicleLocationHistory(
-                city=city, ride_id=ride_id, lat=lat, long=long)
-            session.add(h)
-
-        run_transaction(sessionmaker(bind=self.engine),
+            timestamp = datetime.datetime.now()
+            if self.prepared_statements:
+                execute_prepared(session, 'movr_update_ride_location', (city, ride_id, timestamp, lat, long))
+            else:
+                # a cached Core INSERT, instead of flushing a new ORM object
+                session.connection().execute(CACHED_STATEMENTS['movr_update_ride_location'],
+                                             {'city': city, 'ride_id': ride_id, 'timestamp': timestamp,
+                                              'lat': lat, 'long': long})
+
+        run_transaction(self.sessionmaker,
                         lambda session: update_ride_location_helper(session, city, ride_id, lat, long))
 
+    # Log many location samples in one transaction. Each sample is a dict of city, ride_id, lat, long and the timestamp
+    # it was taken at; the driver sends them as multi-row INSERTs.
+    def update_ride_locations(self, locations):
+
+        def update_ride_locations_helper(session, locations):
+            session.connection().execute(CACHED_STATEMENTS['movr_update_ride_location'], locations)
+
+        run_transaction(self.sessionmaker,
+                        lambda session: update_ride_locations_helper(session, locations))
+
     def add_user(self, city, name, address, credit_card_number):
 
         def add_user_helper(session, city, name, address, credit_card_number):
@@ -107,7 +646,7 @@ class MovR:
                      address=address, credit_card=credit_card_number)
             session.add(u)
             return {'city': u.city, 'id': u.id}
-        return run_transaction(sessionmaker(bind=self.engine),
+        return run_transaction(self.sessionmaker,
                                lambda session: add_user_helper(session, city, name, address, credit_card_number))
 
     def add_vehicle(self, city, owner_id, current_location, type, vehicle_metadata, status):
@@ -122,56 +661,64 @@ class MovR:
 
             session.add(vehicle)
             return {'city': vehicle.city, 'id': vehicle.id}
-        return run_transaction(sessionmaker(bind=self.engine),
-                               lambda session: add_vehicle_helper(session,
-                                                                  city, owner_id, current_location, type,
-                                                                  vehicle_metadata, status))
+        vehicle = run_transaction(self.sessionmaker,
+                                  lambda session: add_vehicle_helper(session,
+                                                                     city, owner_id, current_location, type,
+                                                                     vehicle_metadata, status))
+        invalidate_reads(city)
+        return vehicle
 
     def get_users(self, city, follower_reads=False, limit=None):
+        users = self.read_rows('movr_get_users', {'city': city, 'limit': limit}, follower_reads,
+                               lambda session: self.select_city_rows(session, 'movr_get_users', city, limit))
+        return list(map(lambda user: {'city': user.city, 'id': user.id}, users))
 
-        def get_users_helper(session, city, follower_reads, limit=None):
-            if follower_reads:
-                session.execute(
-                    text('SET TRANSACTION AS OF SYSTEM TIME follower_read_timestamp()'))
-            users = session.query(User).filter_by(city=city).limit(limit).all()
-            return list(map(lambda user: {'city': user.city, 'id': user.id}, users))
-        return run_transaction(sessionmaker(bind=self.engine), lambda session: get_users_helper(session, city, follower_reads, limit))
-
+    # served from the read cache, if it's on
     def get_vehicles(self, city, follower_reads=False, limit=None):
-
-        def get_vehicles_helper(session, city, follower_reads, limit=None):
-            if follower_reads:
-                session.execute(
-                    text('SET TRANSACTION AS OF SYSTEM TIME follower_read_timestamp()'))
-            vehicles = session.query(Vehicle).filter_by(
-                city=city).limit(limit).all()
-            return list(map(lambda vehicle: {'city': vehicle.city, 'id': vehicle.id}, vehicles))
-
-        return run_transaction(sessionmaker(bind=self.engine), lambda session: get_vehicles_helper(session, city, follower_reads, limit))
+        key = ('movr_get_vehicles', city, follower_reads, limit)
+        cache, vehicles, generation = look_up_read(city, key)
+        if vehicles is None:
+            vehicles = self.read_rows('movr_get_vehicles', {'city': city, 'limit': limit}, follower_reads,
+                                      lambda session: self.select_city_rows(session, 'movr_get_vehicles', city, limit))
+            if cache is not None:
+                cache.put(city, key, vehicles, generation)
+        return list(map(lambda vehicle: {'city': vehicle.city, 'id': vehicle.id}, vehicles))
 
     def get_active_rides(self, city, follower_reads=False, limit=None):
-
-        def get_active_rides_helper(session, city, follower_reads, limit=None):
+        rides = self.read_rows('movr_get_active_rides', {'city': city, 'limit': limit}, follower_reads,
+                               lambda session: self.select_city_rows(session, 'movr_get_active_rides', city, limit))
+        return list(map(lambda ride: {'city': city, 'id': ride.id}, rides))
+
+    # The rows of a read, which select_rows(session) runs in a transaction of the session. A follower read runs it the
+    # way FOLLOWER_READ_SETTINGS configures, where the 'inline' mode runs the statement of FOLLOWER_READ_QUERIES[name]
+    # with `parameters` instead.
+    def read_rows(self, name, parameters, follower_reads, select_rows):
+        mode = FOLLOWER_READ_SETTINGS['mode']
+        if follower_reads and mode == 'inline':
+            statement = get_follower_read_statement(name, parameters.get('limit') is not None)
+            return run_implicit_transaction(self.engine, lambda conn: conn.execute(statement, parameters).fetchall())
+        if follower_reads and mode == 'session':
+            return run_transaction(self.follower_read_sessionmaker, lambda session: select_rows(session).fetchall())
+
+        def read_rows_helper(session):
             if follower_reads:
-                session.execute(
-                    text('SET TRANSACTION AS OF SYSTEM TIME follower_read_timestamp()'))
-            rides = session.query(Ride).filter_by(
-                city=city, end_time=None).limit(limit).all()
-            return list(map(lambda ride: {'city': city, 'id': ride.id}, rides))
+                session.execute(text('SET TRANSACTION AS OF SYSTEM TIME {0}'.format(get_follower_read_timestamp())))
+            return select_rows(session).fetchall()
 
-        return run_transaction(sessionmaker(bind=self.engine),
-                               lambda session: get_active_rides_helper(session, city, follower_reads, limit))
+        return run_transaction(self.sessionmaker, read_rows_helper)
 
-    def get_promo_codes(self, follower_reads=False, limit=None):
-
-        def get_promo_codes_helper(session, follower_reads, limit=None):
-            if follower_reads:
-                session.execute(
-                    text('SET TRANSACTION AS OF SYSTEM TIME follower_read_timestamp()'))
-            pcs = session.query(PromoCode).limit(limit).all()
-            return list(map(lambda pc: pc.code, pcs))
+    # The (city, id) rows of the cached statement `name`, or of the statement prepared under that name if the pool
+    # prepares them.
+    def select_city_rows(self, session, name, city, limit):
+        if self.prepared_statements and limit is not None:
+            return execute_prepared(session, name, (city, limit))
+        return session.connection().execute(CACHED_STATEMENTS[name, limit is not None], {'city': city, 'limit': limit})
 
-        return run_transaction(sessionmaker(bind=self.engine), lambda session: get_promo_codes_helper(session, follower_reads, limit))
+    def get_promo_codes(self, follower_reads=False, limit=None):
+        statement = CACHED_STATEMENTS['movr_get_promo_codes', limit is not None]
+        promo_codes = self.read_rows('movr_get_promo_codes', {'limit': limit}, follower_reads,
+                                     lambda session: session.connection().execute(statement, {'limit': limit}))
+        return list(map(lambda pc: pc.code, promo_codes))
 
     def create_promo_code(self, code, description, expiration_time, rules):
 
@@ -181,7 +728,7 @@ class MovR:
             session.add(pc)
             return pc.code
 
-        return run_transaction(sessionmaker(bind=self.engine),
+        return run_transaction(self.sessionmaker,
                                lambda session: add_promo_code_helper(session, code, description, expiration_time, rules))
 
     def apply_promo_code(self, user_city, user_id, promo_code):
@@ -197,8 +744,14 @@ class MovR:
                         city=user_city, user_id=user_id, code=code)
                     session.add(upc)
 
-        run_transaction(sessionmaker(bind=self.engine),
-                        lambda session: apply_promo_code_helper(session, user_city, user_id, promo_code))
+        def apply_promo_code_optimized_helper(session, user_city, user_id, code):
+            session.connection().execute(CACHED_STATEMENTS['movr_apply_promo_code'],
+                                         {'user_city': user_city, 'user_id': user_id, 'code': code,
+                                          'now': datetime.datetime.now()})
+
+        helper = apply_promo_code_optimized_helper if self.txn_style == 'optimized' else apply_promo_code_helper
+        run_transaction(self.sessionmaker,
+                        lambda session: helper(session, user_city, user_id, promo_code))
 
     def get_database_name(self):
         db_name = self.session.execute(
@@ -211,16 +764,9 @@ class MovR:
         return list(tup[0] for tup in region_tups)
 
     def get_cities(self, follower_reads=False):
-
-        def get_cities_helper(session, follower_reads):
-            if follower_reads:
-                session.execute(
-                    text('SET TRANSACTION AS OF SYSTEM TIME follower_read_timestamp()'))
-            users = self.session.query(User).distinct(User.city).all()
-            return tuple(user.city for user in users)
-
-        return run_transaction(sessionmaker(bind=self.engine),
-                               lambda session: get_cities_helper(session, follower_reads))
+        users = self.read_rows('movr_get_cities', {}, follower_reads,
+                               lambda session: session.execute(select(User.city).distinct()))
+        return tuple(user.city for user in users)
 
     def update_region(self, table, region, cities):
 
@@ -234,13 +780,13 @@ class MovR:
                                          ).values({crdb_region: region})
             session.execute(query)
 
-        run_transaction(sessionmaker(bind=self.engine),
+        run_transaction(self.sessionmaker,
                         lambda session: update_region_helper(session, table, region, cities))
 
     def run_queries_in_separate_transactions(self, queries):
         for query in queries:
             try:
-                run_transaction(sessionmaker(bind=self.engine),
+                run_transaction(self.sessionmaker,
                                 lambda session: session.execute(query))
             except ProgrammingError as err:
                 if 'Duplicate' in str(err):
@@ -0,0 +1,310 @@
+from sqlalchemy import select, text, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from models import User, Vehicle, Ride, PromoCode, UserPromoCode
+from generators import MovRGenerator
+from movr import CACHED_STATEMENTS, ENGINES, ENGINES_LOCK, FOLLOWER_READ_SETTINGS, POOL_SETTINGS, TRANSACTION_TIMINGS, \
+    TXN_STYLES, TransactionTimings, add_connection_rotation, add_follower_read_session, \
+    get_follower_read_statement, get_follower_read_timestamp, invalidate_reads, is_retryable_error, look_up_read
+
+import datetime
+import ssl
+import time
+
+
+##################
+# SHARED ENGINES
+#################
+
+# like movr.get_engine, including the separate pool of connections that follower read by default
+def get_async_engine(conn_string, echo=False, follower_read_session=False):
+    with ENGINES_LOCK:
+        key = ('asyncpg', conn_string, echo)
+        if follower_read_session:
+            key += ('follower reads',)
+        if key not in ENGINES:
+            url, connect_args = get_asyncpg_url(conn_string)
+            engine = create_async_engine(url, echo=echo, connect_args=connect_args,
+                                         pool_size=POOL_SETTINGS['pool_size'],
+                                         max_overflow=POOL_SETTINGS['max_overflow'],
+                                         pool_pre_ping=POOL_SETTINGS['pool_pre_ping'])
+            if POOL_SETTINGS['max_connection_age']:
+                add_connection_rotation(engine.sync_engine, POOL_SETTINGS['max_connection_age'])
+            if follower_read_session:
+                add_follower_read_session(engine.sync_engine)
+            ENGINES[key] = engine
+        return ENGINES[key]
+
+
+def get_asyncpg_url(conn_string):
+    # asyncpg does not understand libpq's query parameters, so translate the ones MovR sets.
+    url = make_url(conn_string).set(drivername='cockroachdb+asyncpg')
+    query = dict(url.query)
+    connect_args = {}
+    ssl_files = {name: query.pop(name) for name in ('sslrootcert', 'sslcert', 'sslkey') if name in query}
+    sslmode = query.pop('sslmode', None)
+    if sslmode == 'disable':
+        connect_args['ssl'] = False
+    elif ssl_files:
+        connect_args['ssl'] = get_ssl_context(sslmode, **ssl_files)
+    elif sslmode is not None:
+        connect_args['ssl'] = sslmode
+    if 'application_name' in query:
+        connect_args['server_settings'] = {'application_name': query.pop('application_name')}
+    if query:
+        raise ValueError("The asyncio engine doesn't support the connection string parameters {0}.".format(
+            ', '.join(sorted(query))))
+    return url.set(query=query), connect_args
+
+
+# an SSL context that checks the server and presents the client certificate the way libpq would for `sslmode`, since
+# asyncpg only takes certificate files through a context. Like libpq, require checks the server certificate when a
+# root certificate is given.
+def get_ssl_context(sslmode, sslrootcert=None, sslcert=None, sslkey=None):
+    if sslmode not in (None, 'allow', 'prefer', 'require', 'verify-ca', 'verify-full'):
+        raise ValueError("Unknown sslmode {0}.".format(sslmode))
+    if sslkey is not None and sslcert is None:
+        raise ValueError("sslkey needs an sslcert to go with it.")
+    context = ssl.create_default_context(cafile=sslrootcert)
+    context.check_hostname = sslmode == 'verify-full'
+    if sslrootcert is None and sslmode not in ('verify-ca', 'verify-full'):
+        context.verify_mode = ssl.CERT_NONE
+    if sslcert is not None:
+        context.load_cert_chain(sslcert, sslkey)
+    return context
+
+
+# The coroutine version of movr.run_transaction: retries the transaction as long as it fails with a retryable error,
+# and adds the time spent in each phase to TRANSACTION_TIMINGS.
+async def run_transaction(sessionmaker, callback, max_retries=None):
+    timings = TRANSACTION_TIMINGS.get() or TransactionTimings()
+    timings.transactions += 1
+    retries = 0
+    async with sessionmaker() as session:
+        while True:
+            marks = [time.perf_counter()]
+            try:
+                await session.connection()
+                marks.append(time.perf_counter())
+                result = await callback(session)
+                await session.flush()
+                marks.append(time.perf_counter())
+                await session.commit()
+                marks.append(time.perf_counter())
+            except DBAPIError as err:
+                marks.append(time.perf_counter())
+                await session.rollback()
+                timings.add_attempt(marks)
+                if not is_retryable_error(err) or (max_retries is not None and retries >= max_retries):
+                    raise
+                retries += 1
+                timings.retries += 1
+                continue
+            timings.add_attempt(marks)
+            return result
+
+
+# The coroutine version of movr.run_implicit_transaction.
+async def run_implicit_transaction(engine, callback, max_retries=None):
+    timings = TRANSACTION_TIMINGS.get() or TransactionTimings()
+    timings.transactions += 1
+    retries = 0
+    while True:
+        marks = [time.perf_counter()]
+        try:
+            async with engine.connect() as conn:
+                await conn.execution_options(isolation_level='AUTOCOMMIT')
+                marks.append(time.perf_counter())
+                result = await callback(conn)
+                marks.append(time.perf_counter())
+        except DBAPIError as err:
+            marks.append(time.perf_counter())
+            timings.add_attempt(marks)
+            if not is_retryable_error(err) or (max_retries is not None and retries >= max_retries):
+                raise
+            retries += 1
+            timings.retries += 1
+            continue
+        timings.add_attempt(marks)
+        return result
+
+
+class AsyncMovR:
+    """Coroutine versions of the MovR API calls used by the 'run' workload.
+
+    Each method has the same signature and return value as its counterpart in MovR."""
+
+    def __init__(self, conn_string, echo=False, txn_style='orm'):
+        if txn_style not in TXN_STYLES:
+            raise ValueError("Unknown transaction style '{0}'. Use one of {1}.".format(txn_style, TXN_STYLES))
+        self.txn_style = txn_style
+        self.engine = get_async_engine(conn_string, echo=echo)
+        self.sessionmaker = async_sessionmaker(bind=self.engine)
+        if FOLLOWER_READ_SETTINGS['mode'] == 'session':
+            self.follower_read_sessionmaker = async_sessionmaker(bind=get_async_engine(conn_string, echo=echo,
+                                                                                       follower_read_session=True))
+        else:
+            self.follower_read_sessionmaker = None
+
+    async def start_ride(self, city, rider_id, vehicle_id):
+
+        async def start_ride_helper(session):
+            await session.execute(update(Vehicle).where(Vehicle.id == vehicle_id).values(status='in_use'))
+            v = (await session.execute(select(Vehicle).where(Vehicle.id == vehicle_id))).scalars().first()
+            # get promo codes associated with this user's account
+            upcs = (await session.execute(select(UserPromoCode).where(UserPromoCode.user_id == rider_id))).scalars().all()
+
+            # determine which codes are valid
+            for upc in upcs:
+                promo_code = (await session.execute(
+                    select(PromoCode).where(PromoCode.code == upc.code))).scalars().first()
+                if promo_code and promo_code.expiration_time > datetime.datetime.now():
+                    await session.execute(update(UserPromoCode).where(UserPromoCode.user_id == rider_id,
+                                                                      UserPromoCode.code == upc.code)
+                                          .values(usage_count=upc.usage_count + 1))
+
+            r = Ride(city=city, id=MovRGenerator.generate_uuid(),
+                     rider_id=rider_id, vehicle_id=vehicle_id,
+                     start_address=v.current_location)
+
+            session.add(r)
+            return {'city': r.city, 'id': r.id}
+
+        async def start_ride_optimized_helper(session):
+            now = datetime.datetime.now()
+            start_address = (await session.execute(CACHED_STATEMENTS['movr_claim_vehicle'],
+                                                   {'vehicle_id': vehicle_id})).scalar_one()
+            await session.execute(CACHED_STATEMENTS['movr_use_valid_promo_codes'], {'rider_id': rider_id, 'now': now})
+            ride_id = MovRGenerator.generate_uuid()
+            await session.execute(CACHED_STATEMENTS['movr_insert_ride'],
+                                  {'id': ride_id, 'city': city, 'rider_id': rider_id, 'vehicle_id': vehicle_id,
+                                   'start_address': start_address, 'start_time': now})
+            return {'city': city, 'id': ride_id}
+
+        helper = start_ride_optimized_helper if self.txn_style == 'optimized' else start_ride_helper
+        ride = await run_transaction(self.sessionmaker, helper)
+        invalidate_reads(city)
+        return ride
+
+    async def end_ride(self, city, ride_id):
+
+        async def end_ride_helper(session):
+            r = (await session.execute(select(Ride).where(Ride.id == ride_id))).scalars().first()
+            await session.execute(update(Vehicle).where(Vehicle.id == r.vehicle_id).values(status='available'))
+            v = (await session.execute(select(Vehicle).where(Vehicle.id == r.vehicle_id))).scalars().first()
+            await session.execute(update(Ride).where(Ride.id == ride_id)
+                                  .values(end_address=v.current_location, revenue=MovRGenerator.generate_revenue(),
+                                          end_time=datetime.datetime.now()))
+
+        async def end_ride_optimized_helper(session):
+            end_address = (await session.execute(CACHED_STATEMENTS['movr_release_vehicle'],
+                                                 {'ride_id': ride_id})).scalar_one()
+            await session.execute(CACHED_STATEMENTS['movr_finish_ride'],
+                                  {'ride_id': ride_id, 'end_address': end_address,
+                                   'revenue': MovRGenerator.generate_revenue(), 'end_time': datetime.datetime.now()})
+
+        helper = end_ride_optimized_helper if self.txn_style == 'optimized' else end_ride_helper
+        await run_transaction(self.sessionmaker, helper)
+        invalidate_reads(city)
+
+    async def update_ride_location(self, city, ride_id, lat, long):
+
+        async def update_ride_location_helper(session):
+            await session.execute(CACHED_STATEMENTS['movr_update_ride_location'],
+                                  {'city': city, 'ride_id': ride_id, 'timestamp': datetime.datetime.now(),
+                                   'lat': lat, 'long': long})
+
+        await run_transaction(self.sessionmaker, update_ride_location_helper)
+
+    async def update_ride_locations(self, locations):
+
+        async def update_ride_locations_helper(session):
+            await session.execute(CACHED_STATEMENTS['movr_update_ride_location'], locations)
+
+        await run_transaction(self.sessionmaker, update_ride_locations_helper)
+
+    async def add_user(self, city, name, address, credit_card_number):
+
+        async def add_user_helper(session):
+            u = User(city=city, id=MovRGenerator.generate_uuid(), name=name,
+                     address=address, credit_card=credit_card_number)
+            session.add(u)
+            return {'city': u.city, 'id': u.id}
+
+        return await run_transaction(self.sessionmaker, add_user_helper)
+
+    async def add_vehicle(self, city, owner_id, current_location, type, vehicle_metadata, status):
+
+        async def add_vehicle_helper(session):
+            vehicle = Vehicle(id=MovRGenerator.generate_uuid(), type=type,
+                              city=city, owner_id=owner_id, current_location=current_location,
+                              status=status,
+                              ext=vehicle_metadata)
+            session.add(vehicle)
+            return {'city': vehicle.city, 'id': vehicle.id}
+
+        vehicle = await run_transaction(self.sessionmaker, add_vehicle_helper)
+        invalidate_reads(city)
+        return vehicle
+
+    # served from the read cache, if it's on
+    async def get_vehicles(self, city, follower_reads=False, limit=None):
+        key = ('movr_get_vehicles', city, follower_reads, limit)
+        cache, vehicles, generation = look_up_read(city, key)
+        if vehicles is None:
+            vehicles = await self.read_rows('movr_get_vehicles', {'city': city, 'limit': limit}, follower_reads,
+                                            CACHED_STATEMENTS['movr_get_vehicles', limit is not None])
+            if cache is not None:
+                cache.put(city, key, vehicles, generation)
+        return list(map(lambda vehicle: {'city': vehicle.city, 'id': vehicle.id}, vehicles))
+
+    # like MovR.read_rows, for a read that runs `statement` with `parameters` unless it's an 'inline' follower read
+    async def read_rows(self, name, parameters, follower_reads, statement):
+        mode = FOLLOWER_READ_SETTINGS['mode']
+        if follower_reads and mode == 'inline':
+            inline_statement = get_follower_read_statement(name, parameters.get('limit') is not None)
+
+            async def read_inline_helper(conn):
+                return (await conn.execute(inline_statement, parameters)).fetchall()
+
+            return await run_implicit_transaction(self.engine, read_inline_helper)
+
+        async def read_rows_helper(session):
+            if follower_reads and mode == 'set':
+                await session.execute(
+                    text('SET TRANSACTION AS OF SYSTEM TIME {0}'.format(get_follower_read_timestamp())))
+            return (await session.execute(statement, parameters)).fetchall()
+
+        if follower_reads and mode == 'session':
+            return await run_transaction(self.follower_read_sessionmaker, read_rows_helper)
+        return await run_transaction(self.sessionmaker, read_rows_helper)
+
+    async def create_promo_code(self, code, description, expiration_time, rules):
+
+        async def add_promo_code_helper(session):
+            pc = PromoCode(code=code, description=description,
+                           expiration_time=expiration_time, rules=rules)
+            session.add(pc)
+            return pc.code
+
+        return await run_transaction(self.sessionmaker, add_promo_code_helper)
+
+    async def apply_promo_code(self, user_city, user_id, promo_code):
+
+        async def apply_promo_code_helper(session):
+            pc = (await session.execute(select(PromoCode).where(PromoCode.code == promo_code))).scalars().one_or_none()
+            if pc:
+                # see if it has already been applied
+                upc = (await session.execute(select(UserPromoCode).where(
+                    UserPromoCode.user_id == user_id, UserPromoCode.code == promo_code))).scalars().one_or_none()
+                if not upc:
+                    session.add(UserPromoCode(city=user_city, user_id=user_id, code=promo_code))
+
+        async def apply_promo_code_optimized_helper(session):
+            await session.execute(CACHED_STATEMENTS['movr_apply_promo_code'],
+                                  {'user_city': user_city, 'user_id': user_id, 'code': promo_code,
+                                   'now': datetime.datetime.now()})
+
+        helper = apply_promo_code_optimized_helper if self.txn_style == 'optimized' else apply_promo_code_helper
+        await run_transaction(self.sessionmaker, helper)
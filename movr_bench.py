@@ -0,0 +1,470 @@
+#!/usr/bin/python
+
+# Benchmarks for the client-side code paths of the MovR load generator. None of them need a cluster.
+#
+#   python movr_bench.py                                   # run every benchmark
+#   python movr_bench.py stats                             # run only the named benchmarks
+#   python movr_bench.py --output before.json              # also save the results
+#   python movr_bench.py --compare before.json             # compare the results with saved ones
+
+import argparse
+import collections
+import datetime
+import json
+import platform
+import random
+import subprocess
+import threading
+import time
+import types
+import uuid
+import numpy
+from sqlalchemy import create_engine
+from tabulate import tabulate
+from generators import MovRGenerator
+from movr_stats import MovRStats, LatencyHistogram
+
+
+# A single histogram behind one global lock: how MovRStats recorded measurements before it used per-thread recorders.
+# Kept as the baseline the stats benchmark compares against.
+class GlobalLockStats:
+
+    def __init__(self, significant_digits=2):
+        self.significant_digits = significant_digits
+        self.mutex = threading.Lock()
+        self.window_stats = {}
+
+    def add_latency_measurement(self, action, measurement):
+        with self.mutex:
+            histogram = self.window_stats.get(action)
+            if histogram is None:
+                histogram = self.window_stats[action] = LatencyHistogram(self.significant_digits)
+            histogram.record(measurement)
+
+    def new_window(self):
+        with self.mutex:
+            self.window_stats = {}
+
+
+# The shortest of `repeat` wall clock times of calling function, in seconds.
+def best_time(function, repeat=3):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+# Measures how fast MovRGenerator generates `rows` values, one call per value as the workload does, and one call per
+# column as the loader does.
+def bench_generators(rows=100000):
+    random.seed(0)
+    rng = numpy.random.default_rng(0)
+    vehicle_types = MovRGenerator.generate_random_vehicles(rows, rng)
+    generators = [
+        ("uuid", "row", lambda: [MovRGenerator.generate_uuid() for _ in range(rows)]),
+        ("uuid", "batch", lambda: MovRGenerator.generate_uuids(rows, rng)),
+        ("revenue", "row", lambda: [MovRGenerator.generate_revenue() for _ in range(rows)]),
+        ("revenue", "batch", lambda: MovRGenerator.generate_revenues(rows, rng)),
+        ("vehicle type", "row", lambda: [MovRGenerator.generate_random_vehicle() for _ in range(rows)]),
+        ("vehicle type", "batch", lambda: MovRGenerator.generate_random_vehicles(rows, rng)),
+        ("vehicle status", "row", lambda: [MovRGenerator.get_vehicle_availability() for _ in range(rows)]),
+        ("vehicle status", "batch", lambda: MovRGenerator.get_vehicle_availabilities(rows, rng)),
+        ("latlong", "row", lambda: [MovRGenerator.generate_random_latlong() for _ in range(rows)]),
+        ("latlong", "batch", lambda: MovRGenerator.generate_random_latlongs(rows, rng)),
+        ("vehicle metadata", "row", lambda: [MovRGenerator.generate_vehicle_metadata(t) for t in vehicle_types]),
+        ("vehicle metadata", "batch", lambda: MovRGenerator.generate_vehicle_metadatas(vehicle_types, rng)),
+        ("timestamp", "batch", lambda: MovRGenerator.generate_timestamps(rows, datetime.datetime(2025, 1, 1), -30, 0,
+                                                                         rng=rng)),
+    ]
+    results = []
+    for generator, api, generate in generators:
+        duration = best_time(generate)
+        results.append({"generator": generator, "api": api, "rows": rows, "ns/row": round(duration / rows * 1e9, 1),
+                        "rows/second": round(rows / duration)})
+    return results
+
+
+# Measures the cost of MovRStats.add_latency_measurement per operation with 1, 16 and 64 recording threads,
+# while another thread closes a window every `window_interval` seconds like the 'run' command does.
+def bench_stats(ops_per_thread=20000, thread_counts=(1, 16, 64), window_interval=.1):
+    measurements = [random.lognormvariate(-5, 1) for _ in range(1000)]
+    results = []
+    for name, stats_class in [("MovRStats", MovRStats), ("global lock", GlobalLockStats)]:
+        for num_threads in thread_counts:
+            stats = stats_class()
+            barrier = threading.Barrier(num_threads + 1)
+
+            def record():
+                barrier.wait()
+                for i in range(ops_per_thread):
+                    stats.add_latency_measurement("get vehicles", measurements[i % 1000])
+
+            done = threading.Event()
+
+            def close_windows():
+                while not done.wait(window_interval):
+                    stats.new_window()
+
+            threads = [threading.Thread(target=record) for _ in range(num_threads)]
+            for t in threads:
+                t.start()
+            closer = threading.Thread(target=close_windows)
+            closer.start()
+            barrier.wait()
+            start = time.perf_counter()
+            for t in threads:
+                t.join()
+            duration = time.perf_counter() - start
+            done.set()
+            closer.join()
+
+            total_ops = ops_per_thread * num_threads
+            results.append({"recorder": name, "threads": num_threads, "ops": total_ops,
+                            "ns/op": round(duration / total_ops * 1e9, 1),
+                            "ops/second": round(total_ops / duration)})
+    return results
+
+
+# Measures what reading a histogram costs: one percentile of an action, and the summary of a window of `actions`
+# actions that every stats window prints, both without and with 16 threads recording at the same time. Like workers
+# waiting on the database, recording threads pause for a millisecond every 100 measurements.
+def bench_percentiles(measurements=100000, actions=10, calls=50, thread_counts=(0, 16)):
+    random.seed(0)
+    values = [random.lognormvariate(-5, 1) for _ in range(1000)]
+    action_list = ["action %d" % i for i in range(actions)]
+    results = []
+    for significant_digits in (2, 3):
+        for num_threads in thread_counts:
+            stats = MovRStats(significant_digits)
+            for i in range(measurements):
+                stats.add_latency_measurement(action_list[i % actions], values[i % 1000])
+            stats.get_window_summary(action_list)
+            histogram = stats.window_stats[action_list[0]]
+            done = threading.Event()
+
+            def record():
+                i = 0
+                while not done.is_set():
+                    stats.add_latency_measurement(action_list[i % actions], values[i % 1000])
+                    i += 1
+                    if i % 100 == 0:
+                        time.sleep(.001)
+
+            threads = [threading.Thread(target=record) for _ in range(num_threads)]
+            for t in threads:
+                t.start()
+            try:
+                for operation, call in [("percentile", lambda: histogram.get_percentile(99)),
+                                        ("window summary", lambda: stats.get_window_summary(action_list))]:
+                    duration = best_time(lambda: [call() for _ in range(calls)])
+                    results.append({"precision": significant_digits, "recording threads": num_threads,
+                                    "operation": operation, "calls": calls,
+                                    "us/call": round(duration / calls * 1e6, 1)})
+            finally:
+                done.set()
+                for t in threads:
+                    t.join()
+    return results
+
+
+# A loader that only counts the rows it is given, so the loader benchmark measures building the rows.
+class CountingLoader:
+
+    def __init__(self):
+        self.rows = 0
+        self.chunks = 0
+
+    def write(self, model, columns, rows, checkpoint=None):
+        self.rows += len(rows)
+        self.chunks += 1
+
+
+# Measures how fast the 'load' command builds the rows of the largest tables, chunk by chunk, with a seed and the
+# default fake value pools.
+def bench_loader(rows=50000):
+    import loadmovr
+    from fake_pools import get_fake_data
+    from id_store import IdStore
+    from loaders import LoadJournal
+
+    # generate or map the fake value pools before timing anything
+    get_fake_data()
+    rng = numpy.random.default_rng(0)
+    user_ids, vehicle_ids, ride_ids = IdStore(), IdStore(), IdStore()
+    user_ids.extend_bytes(MovRGenerator.generate_uuid_bytes(1000, rng))
+    vehicle_ids.extend_bytes(MovRGenerator.generate_uuid_bytes(1000, rng))
+    ride_ids.extend_bytes(MovRGenerator.generate_uuid_bytes(1000, rng))
+    journal = LoadJournal(None)
+    city = 'new york'
+    tables = [
+        ("users", lambda loader: loadmovr.add_users(loader, journal, city, 0, rows, IdStore(), seed=0)),
+        ("rides", lambda loader: loadmovr.add_rides(loader, journal, city, 0, rows, user_ids, vehicle_ids, IdStore(),
+                                                    seed=0)),
+        ("vehicle_location_histories", lambda loader: loadmovr.add_vehicle_location_histories(
+            loader, journal, city, 0, rows, ride_ids, seed=0)),
+    ]
+    results = []
+    for table, add_rows in tables:
+        loaders = []
+
+        def load():
+            loaders.append(CountingLoader())
+            add_rows(loaders[-1])
+
+        duration = best_time(load)
+        results.append({"table": table, "rows": loaders[-1].rows, "chunks": loaders[-1].chunks,
+                        "us/row": round(duration / rows * 1e6, 2), "rows/second": round(rows / duration)})
+    return results
+
+
+# A DBAPI module standing in for the database: every statement succeeds at once and every query returns `rows` rows
+# of a city and made-up ids, so a benchmark measures only the client's work per call.
+class StandInCursor:
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.description = None
+        self.rowcount = -1
+        self.result = []
+
+    def execute(self, statement, parameters=None):
+        statement = ' '.join(statement.lower().split())
+        if 'version()' in statement:
+            columns, self.result = ['version'], [('PostgreSQL 13.0 (CockroachDB stand-in)',)]
+        elif 'standard_conforming_strings' in statement:
+            columns, self.result = ['standard_conforming_strings'], [('on',)]
+        elif 'isolation level' in statement:
+            columns, self.result = ['transaction_isolation'], [('serializable',)]
+        elif statement.startswith('execute movr_get'):
+            columns = ['city', 'id']
+        elif statement.startswith('select'):
+            # the label of each selected column, e.g. vehicles_id for "vehicles.id AS vehicles_id"
+            columns = [column.split()[-1] for column in statement[len('select '):].partition(' from ')[0].split(', ')]
+        elif ' returning ' in statement:
+            # UPDATE ... RETURNING matches one row
+            columns = [column.split()[-1] for column in statement.partition(' returning ')[2].split(', ')]
+            self.result = [tuple(None for column in columns)]
+        else:
+            columns, self.result, self.rowcount = None, [], 1
+        if columns and not self.result:
+            row = tuple('new york' if column.endswith('city') else self.rows[0][1] if column.endswith('id') else None
+                        for column in columns)
+            self.result = [row] * len(self.rows)
+        # every column claims the type code of NUMERIC, the only one the dialect checks
+        self.description = [(column, 1700, None, None, None, None, None) for column in columns] if columns else None
+
+    def executemany(self, statement, parameters):
+        self.execute(statement)
+
+    def fetchone(self):
+        return self.result.pop(0) if self.result else None
+
+    def fetchmany(self, size=1):
+        rows, self.result = self.result[:size], self.result[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self.result = self.result, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class StandInConnection:
+
+    py_types = {str: None}
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.autocommit = False
+
+    def cursor(self):
+        return StandInCursor(list(self.rows))
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def stand_in_engine(rows):
+    dbapi = types.SimpleNamespace(paramstyle='format', apilevel='2.0', threadsafety=2, __version__='1.30.0',
+                                  connect=lambda *args, **kwargs: StandInConnection(rows))
+    for name in ['Warning', 'Error', 'InterfaceError', 'DatabaseError', 'DataError', 'OperationalError',
+                 'IntegrityError', 'InternalError', 'ProgrammingError', 'NotSupportedError']:
+        setattr(dbapi, name, type(name, (Exception,), {}))
+    return create_engine('postgresql+pg8000://', module=dbapi)
+
+
+# Measures the client CPU time per call of the hot MovR API calls against a stand-in database: with the ORM queries
+# they used before their statements were cached, with cached statements, and with prepared statements.
+def bench_statements(calls=2000, rows=10):
+    import movr
+    from models import Vehicle, VehicleLocationHistory
+
+    # the ORM implementations the cached statements replaced
+    class ORMQueryMovR(movr.MovR):
+
+        def get_vehicles(self, city, follower_reads=False, limit=None):
+            def get_vehicles_helper(session):
+                vehicles = session.query(Vehicle).filter_by(city=city).limit(limit).all()
+                return list(map(lambda vehicle: {'city': vehicle.city, 'id': vehicle.id}, vehicles))
+            return movr.run_transaction(self.sessionmaker, get_vehicles_helper)
+
+        def update_ride_location(self, city, ride_id, lat, long):
+            def update_ride_location_helper(session):
+                session.add(VehicleLocationHistory(city=city, ride_id=ride_id, lat=lat, long=long))
+            movr.run_transaction(self.sessionmaker, update_ride_location_helper)
+
+    city, ride_id = 'new york', str(uuid.uuid4())
+    engine = stand_in_engine([(city, str(uuid.uuid4())) for _ in range(rows)])
+    results = []
+    for name, movr_class, prepared_statements in [("orm query", ORMQueryMovR, False), ("cached", movr.MovR, False),
+                                                  ("prepared", movr.MovR, True)]:
+        movr.ENGINES[('movr-bench', False)] = engine
+        m = movr_class('movr-bench')
+        m.prepared_statements = prepared_statements
+        for action, call in [("get vehicles", lambda: m.get_vehicles(city, limit=25)),
+                             ("update ride location", lambda: m.update_ride_location(city, ride_id, 40.7, -74.0))]:
+            for _ in range(calls // 10):
+                call()
+            start = time.process_time()
+            for _ in range(calls):
+                call()
+            duration = time.process_time() - start
+            results.append({"statements": name, "action": action, "calls": calls,
+                            "client cpu us/call": round(duration / calls * 1e6, 1)})
+    movr.ENGINES.pop(('movr-bench', False))
+    return results
+
+
+# Measures the client CPU time per call of every MovR API call the workload makes, in both transaction styles, against
+# stand-in databases that return `rows` rows per query for reads, and a single row for the queries of writes.
+def bench_api(calls=1000, rows=10):
+    import movr
+
+    city, user_id, ride_id = 'new york', str(uuid.uuid4()), str(uuid.uuid4())
+    movr.ENGINES[('movr-bench-reads', False)] = stand_in_engine([(city, str(uuid.uuid4())) for _ in range(rows)])
+    movr.ENGINES[('movr-bench-writes', False)] = stand_in_engine([(city, str(uuid.uuid4()))])
+    locations = [dict(city=city, ride_id=ride_id, lat=40.7, long=-74.0, timestamp=datetime.datetime.now())] * 10
+    results = []
+    try:
+        for txn_style in movr.TXN_STYLES:
+            reads = movr.MovR('movr-bench-reads', txn_style=txn_style)
+            writes = movr.MovR('movr-bench-writes', txn_style=txn_style)
+            api_calls = [
+                ("get users", lambda: reads.get_users(city, limit=25)),
+                ("get vehicles", lambda: reads.get_vehicles(city, limit=25)),
+                ("get active rides", lambda: reads.get_active_rides(city, limit=25)),
+                ("get promo codes", lambda: reads.get_promo_codes(limit=25)),
+                ("new user", lambda: writes.add_user(city, 'name', 'address', '4111111111111111')),
+                ("add vehicle", lambda: writes.add_vehicle(city, user_id, 'address', 'bike', {'color': 'red'},
+                                                           'available')),
+                ("new promo code", lambda: writes.create_promo_code('code', 'description', datetime.datetime.now(),
+                                                                    {"type": "percent_discount", "value": "10%"})),
+                ("apply promo code", lambda: writes.apply_promo_code(city, user_id, 'code')),
+                ("start ride", lambda: writes.start_ride(city, user_id, str(uuid.uuid4()))),
+                ("end ride", lambda: writes.end_ride(city, ride_id)),
+                ("log ride location", lambda: writes.update_ride_location(city, ride_id, 40.7, -74.0)),
+                ("log ride locations (10)", lambda: writes.update_ride_locations(locations)),
+            ]
+            for action, call in api_calls:
+                for _ in range(calls // 10):
+                    call()
+                start = time.process_time()
+                for _ in range(calls):
+                    call()
+                duration = time.process_time() - start
+                results.append({"txn style": txn_style, "action": action, "calls": calls,
+                                "client cpu us/call": round(duration / calls * 1e6, 1)})
+    finally:
+        movr.ENGINES.pop(('movr-bench-reads', False))
+        movr.ENGINES.pop(('movr-bench-writes', False))
+    return results
+
+
+# Each benchmark returns a list of result rows. `keys` are the fields that identify a row, and `metrics` the
+# measurements that are compared between runs, where lower is better.
+Benchmark = collections.namedtuple('Benchmark', ['function', 'keys', 'metrics'])
+
+BENCHMARKS = {
+    "generators": Benchmark(bench_generators, ["generator", "api"], ["ns/row"]),
+    "stats": Benchmark(bench_stats, ["recorder", "threads"], ["ns/op"]),
+    "percentiles": Benchmark(bench_percentiles, ["precision", "recording threads", "operation"], ["us/call"]),
+    "loader": Benchmark(bench_loader, ["table"], ["us/row"]),
+    "statements": Benchmark(bench_statements, ["statements", "action"], ["client cpu us/call"]),
+    "api": Benchmark(bench_api, ["txn style", "action"], ["client cpu us/call"]),
+}
+
+
+# the commit the benchmarks ran on, with a '-dirty' suffix if the tree had changes, or None outside of a git checkout
+def get_commit():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path, results):
+    with open(path, 'w') as f:
+        json.dump({"commit": get_commit(), "time": datetime.datetime.now().isoformat(),
+                   "python": platform.python_version(), "platform": platform.platform(), "results": results},
+                  f, indent=2)
+
+
+# print every metric of `results` next to the same metric in the saved results of an earlier run
+def compare_results(results, baseline):
+    rows = []
+    for name, benchmark_results in results.items():
+        keys, metrics = BENCHMARKS[name].keys, BENCHMARKS[name].metrics
+        baseline_rows = {tuple(row.get(key) for key in keys): row for row in baseline["results"].get(name, [])}
+        for row in benchmark_results:
+            baseline_row = baseline_rows.get(tuple(row[key] for key in keys))
+            for metric in metrics:
+                if baseline_row is None or not baseline_row.get(metric):
+                    continue
+                change = (row[metric] - baseline_row[metric]) * 100.0 / baseline_row[metric]
+                rows.append([name, " / ".join(str(row[key]) for key in keys), metric, baseline_row[metric],
+                             row[metric], round(change, 1)])
+    print("Compared with %s (%s):" % (baseline.get("commit"), baseline.get("time")))
+    print(tabulate(rows, ["benchmark", "case", "metric", "baseline", "current", "change(%)"]), "\n")
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(description='Benchmarks for the MovR load generator.')
+    parser.add_argument('benchmarks', nargs='*', choices=[[]] + list(BENCHMARKS),
+                        help='The benchmarks to run. (default = all)')
+    parser.add_argument('--output', dest='output', default=None,
+                        help='Save the results to this file as JSON, with the commit they were measured on.')
+    parser.add_argument('--compare', dest='compare', default=None,
+                        help="Compare the results with those saved with '--output' by an earlier run.")
+    return parser
+
+
+if __name__ == '__main__':
+    args = setup_parser().parse_args()
+
+    # read the baseline first, so a missing file doesn't waste a whole run
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    for name in args.benchmarks or list(BENCHMARKS):
+        print("Running %s..." % name)
+        results[name] = BENCHMARKS[name].function()
+        print(tabulate([list(result.values()) for result in results[name]], list(results[name][0])), "\n")
+
+    if args.output:
+        save_results(args.output, results)
+    if baseline is not None:
+        compare_results(results, baseline)
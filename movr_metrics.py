@@ -0,0 +1,161 @@
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The upper bounds in seconds of the latency histogram buckets served to Prometheus, on top of '+Inf'.
+PROMETHEUS_BUCKETS = [.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60]
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Metrics sinks publish the stats of the 'run' command in machine-readable form, next to the printed tables. A sink
+# gets every closed window (see MovRStats.close_window) and, when the run ends, the summary of the whole run (see
+# MovRStats.get_run_summary).
+
+
+class JsonLinesSink:
+    """Appends every window, and the summary of the run at the end, to a file as one JSON object per line. Each line
+    has a 'type' of 'window' or 'summary'."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a')
+
+    def write_window(self, window):
+        self.write(window)
+
+    def close(self, summary):
+        self.write(summary)
+        self.file.close()
+
+    def write(self, record):
+        # flushed line by line, so a run that is killed leaves every window it finished
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+
+class PrometheusSink:
+    """Serves the stats of the run so far in the Prometheus text format, on http://<host>:<port>/metrics.
+
+    Every scrape reads the cumulative histograms of `stats`, so scrapes don't depend on the windows: latencies are a
+    histogram per action with the buckets of PROMETHEUS_BUCKETS, and so are the time spent in each transaction phase
+    and the age of the results the read cache served, next to counters of errors per action and error class, of
+    transaction retries and of read cache lookups per action, the latency the read cache saved, and the gauges."""
+
+    def __init__(self, stats, port, host='127.0.0.1', action_list=[]):
+        self.stats = stats
+        self.action_list = action_list
+        sink = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = sink.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug("Prometheus endpoint: " + format, *args)
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        # a daemon thread, so the endpoint doesn't hold up a graceful shutdown
+        self.thread = threading.Thread(target=self.server.serve_forever, name="prometheus", daemon=True)
+        self.thread.start()
+        logging.info("Serving Prometheus metrics on http://%s:%d/metrics.", host, self.server.server_address[1])
+
+    def write_window(self, window):
+        pass
+
+    def close(self, summary):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def render(self):
+        summary = self.stats.get_run_summary(self.action_list)
+        lines = ['# HELP movr_operation_latency_seconds The latency of the operations of the MovR workload.',
+                 '# TYPE movr_operation_latency_seconds histogram']
+        for action, row in summary['actions'].items():
+            lines += render_histogram('movr_operation_latency_seconds', 'action="{0}"'.format(escape_label_value(action)),
+                                      row['histogram_us'], row['latency_sum_seconds'])
+        lines += ['# HELP movr_transaction_phase_seconds The time the operations of the MovR workload spent acquiring a '
+                  'connection, executing statements and committing, over every attempt of their transactions.',
+                  '# TYPE movr_transaction_phase_seconds histogram']
+        for action, row in summary['actions'].items():
+            for phase, histogram in row['phase_histograms_us'].items():
+                lines += render_histogram('movr_transaction_phase_seconds', 'action="{0}",phase="{1}"'.format(
+                    escape_label_value(action), escape_label_value(phase)), histogram['counts'],
+                    histogram['sum_seconds'])
+        lines += ['# HELP movr_operation_errors_total The operations of the MovR workload that failed, by the class of '
+                  'their error.',
+                  '# TYPE movr_operation_errors_total counter']
+        lines += ['movr_operation_errors_total{{action="{0}",error_class="{1}"}} {2}'.format(
+                  escape_label_value(action), escape_label_value(error_class), count)
+                  for action, row in summary['actions'].items()
+                  for error_class, count in sorted(row['error_classes'].items())]
+        lines += ['# HELP movr_transaction_retries_total The retries of the transactions of the MovR workload.',
+                  '# TYPE movr_transaction_retries_total counter']
+        lines += ['movr_transaction_retries_total{{action="{0}"}} {1}'.format(escape_label_value(action),
+                                                                             row['retries'])
+                  for action, row in summary['actions'].items()]
+        caches = [(action, row['cache']) for action, row in summary['actions'].items() if row['cache']]
+        lines += ['# HELP movr_read_cache_lookups_total The lookups of the read cache, by whether they hit.',
+                  '# TYPE movr_read_cache_lookups_total counter']
+        for action, cache in caches:
+            for result in ('hit', 'miss'):
+                lines.append('movr_read_cache_lookups_total{{action="{0}",result="{1}"}} {2}'.format(
+                    escape_label_value(action), result, cache['hits' if result == 'hit' else 'misses']))
+        lines += ['# HELP movr_read_cache_saved_seconds The latency the hits of the read cache saved, against the mean '
+                  'latency of its misses.',
+                  '# TYPE movr_read_cache_saved_seconds gauge']
+        lines += ['movr_read_cache_saved_seconds{{action="{0}"}} {1}'.format(escape_label_value(action),
+                                                                            cache['saved_seconds'])
+                  for action, cache in caches]
+        lines += ['# HELP movr_read_cache_age_seconds How old the results the read cache served were.',
+                  '# TYPE movr_read_cache_age_seconds histogram']
+        for action, cache in caches:
+            lines += render_histogram('movr_read_cache_age_seconds', 'action="{0}"'.format(escape_label_value(action)),
+                                      cache['age_histogram_us']['counts'], cache['age_histogram_us']['sum_seconds'])
+        lines += ['# HELP movr_gauge The gauges printed below the stats of the MovR workload.',
+                  '# TYPE movr_gauge gauge']
+        lines += ['movr_gauge{{name="{0}"}} {1}'.format(escape_label_value(name), value)
+                  for name, value in sorted(summary['gauges'].items())]
+        return '\n'.join(lines) + '\n'
+
+
+# The sample lines of one labelled histogram, given its non-empty counters as [highest value in microseconds, count]
+# pairs in increasing order of value, and the sum of its values in seconds.
+def render_histogram(name, labels, counts, sum_seconds):
+    lines = []
+    position = running_count = 0
+    for bound in PROMETHEUS_BUCKETS:
+        # a counter belongs to a bucket if all of its values are within the bound
+        while position < len(counts) and counts[position][0] <= bound * 1000000:
+            running_count += counts[position][1]
+            position += 1
+        lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(name, labels, bound, running_count))
+    total_count = sum(count for value, count in counts)
+    lines.append('{0}_bucket{{{1},le="+Inf"}} {2}'.format(name, labels, total_count))
+    lines.append('{0}_sum{{{1}}} {2}'.format(name, labels, sum_seconds))
+    lines.append('{0}_count{{{1}}} {2}'.format(name, labels, total_count))
+    return lines
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# The sinks to publish the stats of a run to: a JSON lines file if metrics_file is given, and a Prometheus endpoint if
+# prometheus_port is. Returns an empty list if neither is.
+def open_metrics_sinks(stats, metrics_file=None, prometheus_port=None, prometheus_host='127.0.0.1', action_list=[]):
+    sinks = []
+    if metrics_file:
+        sinks.append(JsonLinesSink(metrics_file))
+    if prometheus_port is not None:
+        sinks.append(PrometheusSink(stats, prometheus_port, prometheus_host, action_list))
+    return sinks
@@ -1,69 +1,536 @@
-import numpy
+import itertools
+import math
 from tabulate import tabulate
 import time
-from threading import Lock
+from threading import Lock, local
+
+# one hour, in microseconds. Slower measurements are recorded as this value.
+HIGHEST_TRACKABLE_MICROSECONDS = 3600 * 1000 * 1000
+
+# the percentiles of every action that window and run summaries report, and the name they are reported under
+SUMMARY_PERCENTILES = [("p50", 50), ("p90", 90), ("p95", 95), ("p99", 99), ("p99.9", 99.9), ("max", 100)]
+
+# The histograms of add_cache_lookup, kept with the transaction phases of an action under these names: the latency of
+# the operations the read cache served and of those it didn't, and how old the results it served were.
+CACHE_HIT = "cache hit"
+CACHE_MISS = "cache miss"
+CACHE_AGE = "cache age"
+CACHE_HISTOGRAMS = (CACHE_HIT, CACHE_MISS, CACHE_AGE)
+
+
+class LatencyHistogram:
+    """Fixed-memory latency histogram with log-scaled buckets, in the style of HdrHistogram.
+
+    Measurements are kept in microseconds. Every power of two is split into enough linear sub-buckets to keep
+    `significant_digits` decimal digits of precision, so recording is O(1), memory doesn't grow with the number of
+    measurements, and two histograms with the same precision merge by adding their counts."""
+
+    def __init__(self, significant_digits=2, highest_trackable_value=HIGHEST_TRACKABLE_MICROSECONDS):
+        if significant_digits < 1 or significant_digits > 5:
+            raise ValueError("Histogram precision must be between 1 and 5 significant digits.")
+        self.significant_digits = significant_digits
+        self.highest_trackable_value = highest_trackable_value
+        self.sub_bucket_bits = int(math.ceil(math.log2(2 * 10 ** significant_digits)))
+        self.sub_bucket_half_count = 1 << (self.sub_bucket_bits - 1)
+        bucket_count = max(highest_trackable_value.bit_length() - self.sub_bucket_bits, 0) + 1
+        self.counts = [0] * ((bucket_count + 1) * self.sub_bucket_half_count)
+        self.total_count = 0
+        self.total_value = 0
+        self.max_value = 0
+
+    # the index of the counter for a value. The first bucket covers [0, 2 * half) linearly, and each following bucket
+    # covers the next power of two with `half` sub-buckets.
+    def counts_index(self, value):
+        bucket = max(value.bit_length() - self.sub_bucket_bits, 0)
+        return (bucket << (self.sub_bucket_bits - 1)) + (value >> bucket)
+
+    # the highest value that is recorded in the same counter as the values at this index
+    def highest_equivalent_value(self, index):
+        bucket = max(index // self.sub_bucket_half_count - 1, 0)
+        sub_bucket = index - bucket * self.sub_bucket_half_count
+        return ((sub_bucket + 1) << bucket) - 1
+
+    # record one measurement in seconds
+    def record(self, seconds):
+        value = int(seconds * 1000000)
+        if value < 0:
+            value = 0
+        elif value > self.highest_trackable_value:
+            value = self.highest_trackable_value
+        # counts_index, inlined since this is on the path of every operation
+        bucket = value.bit_length() - self.sub_bucket_bits
+        if bucket < 0:
+            bucket = 0
+        self.counts[(bucket << (self.sub_bucket_bits - 1)) + (value >> bucket)] += 1
+        self.total_count += 1
+        self.total_value += value
+        if value > self.max_value:
+            self.max_value = value
+
+    def merge(self, other):
+        if other.significant_digits != self.significant_digits or \
+                other.highest_trackable_value != self.highest_trackable_value:
+            raise ValueError("Only histograms with the same precision and range can be merged.")
+        counts, other_counts = self.counts, other.counts
+        # compress skips the empty counters without a Python loop over all of them, which matters since most are empty
+        for index in itertools.compress(range(len(other_counts)), other_counts):
+            counts[index] += other_counts[index]
+        self.total_count += other.total_count
+        self.total_value += other.total_value
+        self.max_value = max(self.max_value, other.max_value)
+
+    # the value in seconds at or below which `percentile` percent of the measurements fall
+    def get_percentile(self, percentile):
+        return self.get_percentiles([percentile])[0]
+
+    # the values of several percentiles, in the order given, with a single pass over the counters
+    def get_percentiles(self, percentiles):
+        values = [self.max_value / 1000000.0] * len(percentiles)
+        if self.total_count == 0:
+            return [0.0] * len(percentiles)
+        targets = sorted((max(int(math.ceil(percentile / 100.0 * self.total_count)), 1), position)
+                         for position, percentile in enumerate(percentiles) if percentile < 100)
+        next_target = 0
+        running_count = 0
+        for index in itertools.compress(range(len(self.counts)), self.counts):
+            running_count += self.counts[index]
+            while next_target < len(targets) and running_count >= targets[next_target][0]:
+                values[targets[next_target][1]] = min(self.highest_equivalent_value(index), self.max_value) / 1000000.0
+                next_target += 1
+            if next_target == len(targets):
+                break
+        return values
+
+    # the mean of the measurements in seconds, exact up to the microsecond they are recorded with
+    def get_mean(self):
+        return self.total_value / 1000000.0 / self.total_count if self.total_count else 0.0
+
+    # the non-empty counters, as [highest value in microseconds, count] pairs in increasing order of value
+    def get_counts(self):
+        return [[min(self.highest_equivalent_value(index), self.max_value), self.counts[index]]
+                for index in itertools.compress(range(len(self.counts)), self.counts)]
+
+    # only the non-empty counters are pickled, which keeps windows sent between processes small
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        counts = self.counts
+        state['counts'] = {index: counts[index] for index in itertools.compress(range(len(counts)), counts)}
+        state['counts_length'] = len(self.counts)
+        return state
+
+    def __setstate__(self, state):
+        counts = [0] * state.pop('counts_length')
+        for index, count in state.pop('counts').items():
+            counts[index] = count
+        state['counts'] = counts
+        self.__dict__.update(state)
+
+
+class LatencyRecorder:
+    """The histograms one thread records into for the current window.
+
+    Only the owning thread records; MovRStats swaps the window out from another thread, so recording never takes a
+    lock."""
+
+    def __init__(self, significant_digits):
+        self.significant_digits = significant_digits
+        self.window = {}
+        self.recording = False
+
+    def record(self, action, measurement):
+        # set before the window is read, so swap_window can tell whether a write to the old window may be in flight
+        self.recording = True
+        window = self.window
+        histogram = window.get(action)
+        if histogram is None:
+            histogram = window[action] = LatencyHistogram(self.significant_digits)
+        histogram.record(measurement)
+        self.recording = False
+
+    # replace the window with an empty one, and return the old one once no write to it can still be in progress
+    def swap_window(self):
+        window = self.window
+        self.window = {}
+        while self.recording:
+            time.sleep(0)
+        return window
+
 
 class MovRStats:
 
 
 
-    def __init__(self):
+    def __init__(self, significant_digits=2):
         self.cumulative_counts = {}
+        self.significant_digits = significant_digits
         self.instantiation_time = time.time()
         self.mutex = Lock()
+        # each thread records into its own LatencyRecorder; the mutex only guards the list of recorders and the
+        # merged window, and is never taken on the recording path once a thread has registered.
+        self.thread_local = local()
+        self.recorders = []
+        self.gauges = {}
+        # the measurements of every window before the current one, for the summary of the whole run
+        self.cumulative_stats = {}
+        self.cumulative_phases = {}
+        self.cumulative_errors = {}
+        self.cumulative_retries = {}
+        self.window_stats = {}
+        self.window_phases = {}
         self.new_window()
 
     # reset stats while keeping cumulative counts
     def new_window(self):
         self.mutex.acquire()
         try:
-            self.window_start_time = time.time()
-            self.window_stats = {}
+            self.collect_recorders()
+            self.start_window()
         finally:
             self.mutex.release()
 
-    # add one latency measurement in seconds
-    def add_latency_measurement(self, action, measurement):
+    # return the measurements, errors and retries of the current window and start a new one.
+    # Used by worker processes, which hand their windows to the parent instead of printing them.
+    def drain_window(self):
         self.mutex.acquire()
         try:
-            self.window_stats.setdefault(action,[]).append(measurement)
-            self.cumulative_counts.setdefault(action,0)
-            self.cumulative_counts[action]+=1
+            self.collect_recorders()
+            window_stats = dict(self.window_stats)
+            window_stats.update(self.window_phases)
+            window_errors, window_retries = self.window_errors, self.window_retries
+            self.start_window()
+            return window_stats, window_errors, window_retries
         finally:
             self.mutex.release()
 
-    # print the current stats this instance has collected.
-    # If action_list is empty, it will only prevent rows it has captured this period, otherwise it will print a row for each action.
-    def print_stats(self, action_list = []):
-        def get_percentile_measurement(action, percentile):
-            return numpy.percentile(self.window_stats.setdefault(action, [0]), percentile)
-
-        def get_stats_row(action):
-            elapsed = time.time() - self.instantiation_time
-
-            if action in self.window_stats:
-                return [action, round(elapsed, 0),  self.cumulative_counts[action], len(self.window_stats[action]),
-                        len(self.window_stats[action]) / elapsed,
-                        round(float(get_percentile_measurement(action, 50)) * 1000, 2),
-                        round(float(get_percentile_measurement(action, 90)) * 1000, 2),
-                        round(float(get_percentile_measurement(action, 95)) * 1000, 2),
-                        round(float(get_percentile_measurement(action, 100)) * 1000, 2)]
+    # add the measurements, errors and retries of a window drained from another MovRStats instance
+    def merge_window(self, window_stats, window_errors=None, window_retries=None):
+        self.mutex.acquire()
+        try:
+            self.merge_histograms(window_stats)
+            for (action, error_class), count in (window_errors or {}).items():
+                self.count_errors(action, error_class, count)
+            for action, count in (window_retries or {}).items():
+                self.count_retries(action, count)
+        finally:
+            self.mutex.release()
+
+    # summarize the current window like get_window_summary, and start a new one
+    def close_window(self, action_list=[]):
+        self.mutex.acquire()
+        try:
+            self.collect_recorders()
+            summary = self.summarize_window(action_list)
+            self.start_window()
+            return summary
+        finally:
+            self.mutex.release()
+
+    # Callers must hold the mutex.
+    def start_window(self):
+        # a window joins the cumulative histograms once, when it ends, instead of every time a thread's measurements
+        # are collected into it
+        merge_histogram_dicts(self.cumulative_stats, self.window_stats)
+        merge_histogram_dicts(self.cumulative_phases, self.window_phases)
+        self.window_start_time = time.time()
+        self.window_stats = {}
+        self.window_phases = {}
+        # errors are counted per action and error class, retries per action
+        self.window_errors = {}
+        self.window_retries = {}
+
+    # swap out the windows of all thread recorders and merge them into this window. Callers must hold the mutex.
+    def collect_recorders(self):
+        for recorder in self.recorders:
+            self.merge_histograms(recorder.swap_window())
+
+    # Histograms keyed by an (action, phase) tuple are the transaction phases of add_transaction_measurements and the
+    # read cache lookups of add_cache_lookup, and are kept apart from the latencies of the actions. Callers must hold
+    # the mutex.
+    def merge_histograms(self, window_stats):
+        for key, histogram in window_stats.items():
+            if isinstance(key, tuple):
+                histograms = self.window_phases
             else:
-                return [action, round(elapsed, 0), self.cumulative_counts.get(action, 0), 0, 0, 0, 0, 0, 0]
+                histograms = self.window_stats
+                self.cumulative_counts.setdefault(key, 0)
+                self.cumulative_counts[key] += histogram.total_count
+            if key in histograms:
+                histograms[key].merge(histogram)
+            else:
+                histograms[key] = histogram
 
-        header = ["transaction name", "time(total)",  "ops(total)", "ops", "ops/second", "p50(ms)", "p90(ms)", "p95(ms)", "max(ms)"]
-        rows = []
+    # count an operation that failed, with the class of its error (e.g. 'SerializationFailure'). Errors are rare, so
+    # unlike latencies they are counted under the mutex.
+    def add_error(self, action, error_class=None):
+        self.mutex.acquire()
+        try:
+            self.count_errors(action, error_class or 'unknown', 1)
+        finally:
+            self.mutex.release()
 
+    # Callers must hold the mutex.
+    def count_errors(self, action, error_class, count):
+        key = (action, error_class)
+        self.window_errors[key] = self.window_errors.get(key, 0) + count
+        self.cumulative_errors[key] = self.cumulative_errors.get(key, 0) + count
+
+    # Callers must hold the mutex.
+    def count_retries(self, action, count):
+        self.window_retries[action] = self.window_retries.get(action, 0) + count
+        self.cumulative_retries[action] = self.cumulative_retries.get(action, 0) + count
+
+    # set a gauge: a current value, such as memory use, that is printed below the stats. The values a gauge has in
+    # different sources (e.g. worker processes) are printed as their sum.
+    def set_gauge(self, name, value, source=None):
         self.mutex.acquire()
         try:
-            if len(action_list):
-                for action in sorted(action_list):
-                    rows.append(get_stats_row(action))
-            else:
-                for action in sorted(list(self.window_stats)):
-                    rows.append(get_stats_row(action))
-            print(tabulate(rows, header), "\n")
+            self.gauges[name, source] = value
         finally:
             self.mutex.release()
 
+    # the value of every gauge, summed over its sources
+    def get_gauges(self):
+        self.mutex.acquire()
+        try:
+            return self.sum_gauges()
+        finally:
+            self.mutex.release()
+
+    # Callers must hold the mutex.
+    def sum_gauges(self):
+        gauges = {}
+        for (name, source), value in self.gauges.items():
+            gauges[name] = gauges.get(name, 0) + value
+        return gauges
+
+    # the number of measurements of every action so far, including those of the current window
+    def get_cumulative_counts(self):
+        self.mutex.acquire()
+        try:
+            self.collect_recorders()
+            return dict(self.cumulative_counts)
+        finally:
+            self.mutex.release()
+
+    def register_recorder(self):
+        recorder = self.thread_local.recorder = LatencyRecorder(self.significant_digits)
+        self.mutex.acquire()
+        try:
+            self.recorders.append(recorder)
+        finally:
+            self.mutex.release()
+        return recorder
+
+    # add one latency measurement in seconds
+    def add_latency_measurement(self, action, measurement):
+        recorder = getattr(self.thread_local, 'recorder', None)
+        if recorder is None:
+            recorder = self.register_recorder()
+        recorder.record(action, measurement)
+
+    # add the time in seconds an operation spent in each phase of its transactions, as a dict of phase to seconds
+    # (see movr.TransactionTimings), and the number of times they were retried
+    def add_transaction_measurements(self, action, phase_times, retries=0):
+        recorder = getattr(self.thread_local, 'recorder', None)
+        if recorder is None:
+            recorder = self.register_recorder()
+        for phase, measurement in phase_times.items():
+            recorder.record((action, phase), measurement)
+        if retries:
+            # retries are rare, so like errors they are counted under the mutex
+            self.mutex.acquire()
+            try:
+                self.count_retries(action, retries)
+            finally:
+                self.mutex.release()
+
+    # add the latency in seconds of an operation that looked up the read cache, as a hit or a miss, and for a hit the
+    # age in seconds of the result it served
+    def add_cache_lookup(self, action, hit, measurement, age=None):
+        recorder = getattr(self.thread_local, 'recorder', None)
+        if recorder is None:
+            recorder = self.register_recorder()
+        recorder.record((action, CACHE_HIT if hit else CACHE_MISS), measurement)
+        if hit and age is not None:
+            recorder.record((action, CACHE_AGE), age)
+
+    # The measurements of the current window as a dict that serializes to JSON: per action, the operations of the
+    # window and so far, their throughput over the window, errors (also per error class), transaction retries, latency
+    # percentiles and mean in milliseconds, overall and per transaction phase, and their read cache lookups (see
+    # summarize_cache), followed by the gauges. Like print_stats, it reports every action of action_list, or else
+    # those of the window.
+    def get_window_summary(self, action_list=[]):
+        self.mutex.acquire()
+        try:
+            self.collect_recorders()
+            return self.summarize_window(action_list)
+        finally:
+            self.mutex.release()
 
+    # Callers must hold the mutex.
+    def summarize_window(self, action_list):
+        now = time.time()
+        window_seconds = now - self.window_start_time
+        error_classes = count_by_action(self.window_errors)
+        cumulative_error_classes = count_by_action(self.cumulative_errors)
+        actions = {}
+        for action in sorted(action_list or set(self.window_stats) | set(error_classes)):
+            histogram = self.window_stats.get(action) or LatencyHistogram(self.significant_digits)
+            retries = self.window_retries.get(action, 0)
+            phases, cache = split_phases(self.window_phases, action)
+            actions[action] = {"ops_total": self.cumulative_counts.get(action, 0), "ops": histogram.total_count,
+                               "ops_per_second": histogram.total_count / window_seconds if window_seconds else 0.0,
+                               "errors_total": sum(cumulative_error_classes.get(action, {}).values()),
+                               "errors": sum(error_classes.get(action, {}).values()),
+                               "error_classes": error_classes.get(action, {}),
+                               "retries_total": self.cumulative_retries.get(action, 0), "retries": retries,
+                               "retries_per_second": retries / window_seconds if window_seconds else 0.0,
+                               "latency_ms": summarize_latency(histogram),
+                               "phases_ms": {phase: summarize_latency(phase_histogram)
+                                             for phase, phase_histogram in phases.items()},
+                               # a window of only hits measures what they saved against the misses of the run so far
+                               "cache": summarize_cache(cache, cache.get(CACHE_MISS) or
+                                                        self.cumulative_phases.get((action, CACHE_MISS)))}
+        return {"type": "window", "time": now, "elapsed_seconds": now - self.instantiation_time,
+                "window_seconds": window_seconds, "actions": actions, "gauges": self.sum_gauges()}
+
+    # The whole run so far, in the format of get_window_summary, with every action's cumulative histogram (and that of
+    # each of its transaction phases, and of the age of its cache hits) as [highest value in microseconds, count] pairs,
+    # so runs can be compared bucket by bucket.
+    def get_run_summary(self, action_list=[]):
+        self.mutex.acquire()
+        try:
+            self.collect_recorders()
+            now = time.time()
+            elapsed = now - self.instantiation_time
+            run_stats = merge_histogram_dicts(merge_histogram_dicts({}, self.cumulative_stats), self.window_stats)
+            run_phases = merge_histogram_dicts(merge_histogram_dicts({}, self.cumulative_phases), self.window_phases)
+            error_classes = count_by_action(self.cumulative_errors)
+            actions = {}
+            for action in sorted(action_list or set(run_stats) | set(error_classes)):
+                histogram = run_stats.get(action) or LatencyHistogram(self.significant_digits)
+                retries = self.cumulative_retries.get(action, 0)
+                phases, cache = split_phases(run_phases, action)
+                cache_summary = summarize_cache(cache, cache.get(CACHE_MISS))
+                if cache_summary is not None:
+                    cache_summary["age_histogram_us"] = summarize_counts(cache.get(CACHE_AGE) or
+                                                                         LatencyHistogram(self.significant_digits))
+                actions[action] = {"ops": histogram.total_count,
+                                   "ops_per_second": histogram.total_count / elapsed if elapsed else 0.0,
+                                   "errors": sum(error_classes.get(action, {}).values()),
+                                   "error_classes": error_classes.get(action, {}),
+                                   "retries": retries,
+                                   "retries_per_second": retries / elapsed if elapsed else 0.0,
+                                   "latency_ms": summarize_latency(histogram),
+                                   "latency_sum_seconds": histogram.total_value / 1000000.0,
+                                   "histogram_us": histogram.get_counts(),
+                                   "phases_ms": {phase: summarize_latency(phase_histogram)
+                                                 for phase, phase_histogram in phases.items()},
+                                   "phase_histograms_us": {phase: summarize_counts(phase_histogram)
+                                                           for phase, phase_histogram in phases.items()},
+                                   "cache": cache_summary}
+            return {"type": "summary", "time": now, "elapsed_seconds": elapsed, "actions": actions,
+                    "gauges": self.sum_gauges()}
+        finally:
+            self.mutex.release()
+
+    # print the current stats this instance has collected.
+    # If action_list is empty, it will only prevent rows it has captured this period, otherwise it will print a row for each action.
+    def print_stats(self, action_list = []):
+        print_window_summary(self.get_window_summary(action_list))
+
+
+# add the histograms of `other` to those of the same actions in `histograms`, without changing those of `other`
+def merge_histogram_dicts(histograms, other):
+    for action, histogram in other.items():
+        if action not in histograms:
+            histograms[action] = LatencyHistogram(histogram.significant_digits, histogram.highest_trackable_value)
+        histograms[action].merge(histogram)
+    return histograms
+
+
+# regroup counts keyed by (action, error class) as {action: {error class: count}}
+def count_by_action(counts):
+    grouped = {}
+    for (action, error_class), count in counts.items():
+        grouped.setdefault(action, {})[error_class] = count
+    return grouped
+
+
+# the histograms of an action's transaction phases, and those of its read cache lookups, each by name
+def split_phases(phase_histograms, action):
+    phases, cache = {}, {}
+    for (phase_action, phase), histogram in phase_histograms.items():
+        if phase_action == action:
+            (cache if phase in CACHE_HISTOGRAMS else phases)[phase] = histogram
+    return phases, cache
+
+
+# The read cache lookups of an action, or None if it had none: hits, misses, the hit rate, the latency of hits and
+# misses and the age of the results hits served in milliseconds, and the seconds of latency the hits saved: the hits
+# times how much shorter their mean latency was than that of `baseline`, a histogram of misses.
+def summarize_cache(cache, baseline=None):
+    hits = cache.get(CACHE_HIT) or LatencyHistogram()
+    misses = cache.get(CACHE_MISS) or LatencyHistogram()
+    lookups = hits.total_count + misses.total_count
+    if not lookups:
+        return None
+    saved = hits.total_count * max(baseline.get_mean() - hits.get_mean(), 0) if baseline else 0.0
+    return {"hits": hits.total_count, "misses": misses.total_count, "hit_rate": hits.total_count / lookups,
+            "saved_seconds": saved, "hit_latency_ms": summarize_latency(hits),
+            "miss_latency_ms": summarize_latency(misses),
+            "age_ms": summarize_latency(cache.get(CACHE_AGE) or LatencyHistogram())}
+
+
+def summarize_counts(histogram):
+    return {"sum_seconds": histogram.total_value / 1000000.0, "counts": histogram.get_counts()}
+
+
+def summarize_latency(histogram):
+    values = histogram.get_percentiles([percentile for name, percentile in SUMMARY_PERCENTILES])
+    latency = {name: round(value * 1000, 3) for (name, percentile), value in zip(SUMMARY_PERCENTILES, values)}
+    latency["mean"] = round(histogram.get_mean() * 1000, 3)
+    return latency
+
+
+# print a summary of get_window_summary or close_window as the stats table, followed by the retries, errors and
+# transaction phases of every action that ran a transaction, the read cache lookups, the errors by class, and the
+# gauges
+def print_window_summary(summary):
+    header = ["transaction name", "time(total)",  "ops(total)", "ops", "ops/second", "p50(ms)", "p90(ms)", "p95(ms)",
+              "p99(ms)", "p99.9(ms)", "max(ms)"]
+    elapsed = summary["elapsed_seconds"]
+    rows = [[action, round(elapsed, 0), row["ops_total"], row["ops"], row["ops"] / elapsed] +
+            [round(row["latency_ms"][name], 2) for name, percentile in SUMMARY_PERCENTILES]
+            for action, row in summary["actions"].items()]
+    print(tabulate(rows, header), "\n")
+    phases = []
+    for row in summary["actions"].values():
+        phases += [phase for phase in row["phases_ms"] if phase not in phases]
+    if phases:
+        header = ["transaction name", "retries", "retries/second", "errors"]
+        for phase in phases:
+            header += ["{0} p50(ms)".format(phase), "{0} p99(ms)".format(phase)]
+        rows = []
+        for action, row in summary["actions"].items():
+            if not row["phases_ms"] and not row["errors"]:
+                continue
+            rows.append([action, row["retries"], round(row["retries_per_second"], 2), row["errors"]])
+            for phase in phases:
+                latency = row["phases_ms"].get(phase)
+                rows[-1] += [round(latency["p50"], 2), round(latency["p99"], 2)] if latency else [None, None]
+        print(tabulate(rows, header), "\n")
+    caches = [[action, row["cache"]["hits"], row["cache"]["misses"], round(row["cache"]["hit_rate"] * 100, 2),
+               round(row["cache"]["hit_latency_ms"]["p50"], 2), round(row["cache"]["miss_latency_ms"]["p50"], 2),
+               round(row["cache"]["saved_seconds"], 3), round(row["cache"]["age_ms"]["p50"], 2),
+               round(row["cache"]["age_ms"]["max"], 2)]
+              for action, row in summary["actions"].items() if row["cache"]]
+    if caches:
+        print(tabulate(caches, ["transaction name", "cache hits", "cache misses", "hit rate(%)", "hit p50(ms)",
+                                "miss p50(ms)", "saved(s)", "age p50(ms)", "age max(ms)"]), "\n")
+    errors = [[action, error_class, count] for action, row in summary["actions"].items()
+              for error_class, count in sorted(row["error_classes"].items())]
+    if errors:
+        print(tabulate(errors, ["transaction name", "error class", "errors"]), "\n")
+    if summary["gauges"]:
+        print(tabulate(sorted(summary["gauges"].items()), ["gauge", "value"]), "\n")
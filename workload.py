@@ -0,0 +1,233 @@
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+# The actions a workload tick can choose. Every tick performs exactly one of them.
+ACTION_GET_VEHICLES = "get vehicles"
+ACTION_NEW_CODE = "new promo code"
+ACTION_APPLY_CODE = "apply promo code"
+ACTION_NEW_USER = "new user"
+ACTION_ADD_VEHICLE = "add vehicle"
+ACTION_START_RIDE = "start ride"
+ACTION_END_RIDE = "end ride"
+
+READ_ACTIONS = [ACTION_GET_VEHICLES]
+WRITE_ACTIONS = [ACTION_NEW_CODE, ACTION_APPLY_CODE, ACTION_NEW_USER, ACTION_ADD_VEHICLE, ACTION_START_RIDE,
+                 ACTION_END_RIDE]
+
+# The share of each write action among the writes of the original workload, which picked them with a cascade of
+# random checks: 3% new promo codes, then 10% of the rest apply a code, 30% of the rest sign up a user, and so on.
+DEFAULT_WRITE_WEIGHTS = {
+    ACTION_NEW_CODE: .03,
+    ACTION_APPLY_CODE: .097,
+    ACTION_NEW_USER: .2619,
+    ACTION_ADD_VEHICLE: .06111,
+    ACTION_START_RIDE: .274995,
+    ACTION_END_RIDE: .274995,
+}
+
+# Built-in profiles, used by name with '--workload-profile'. A profile file has the same two keys.
+PROFILES = {
+    'default': {'read_percentage': .95, 'write_weights': DEFAULT_WRITE_WEIGHTS},
+    'write-heavy': {'read_percentage': .2, 'write_weights': DEFAULT_WRITE_WEIGHTS},
+    'rides': {'read_percentage': .5, 'write_weights': {ACTION_START_RIDE: 1, ACTION_END_RIDE: 1}},
+    'promotions': {'read_percentage': .5, 'write_weights': {ACTION_NEW_CODE: 1, ACTION_APPLY_CODE: 4}},
+}
+
+
+class AliasTable:
+    """Picks one of a fixed set of outcomes with the given weights in O(1), with Vose's alias method.
+
+    Every outcome owns one of n equally likely columns. A column holds the probability of keeping its own outcome,
+    and otherwise the outcome it gives its remaining share to, so a pick is one random number and one comparison."""
+
+    def __init__(self, outcomes, weights):
+        if len(outcomes) != len(weights) or not outcomes:
+            raise ValueError("An alias table needs one weight per outcome, and at least one outcome.")
+        if any(weight < 0 for weight in weights) or not sum(weights) > 0:
+            raise ValueError("Weights must not be negative, and at least one must be positive.")
+        count = len(outcomes)
+        total = float(sum(weights))
+        scaled = [weight * count / total for weight in weights]
+        self.outcomes = list(outcomes)
+        self.probabilities = [1.0] * count
+        self.aliases = list(range(count))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probabilities[less] = scaled[less]
+            self.aliases[less] = more
+            scaled[more] += scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+        # whatever is left is 1 up to rounding errors, and keeps its own outcome
+
+    def sample(self, rng=random):
+        position = rng.random() * len(self.outcomes)
+        column = int(position)
+        if position - column < self.probabilities[column]:
+            return self.outcomes[column]
+        return self.outcomes[self.aliases[column]]
+
+
+class WorkloadMix:
+    """The probability of each action of a workload tick: `read_percentage` for reads, and the rest split among the
+    write actions in proportion to `write_weights`."""
+
+    def __init__(self, read_percentage, write_weights):
+        if read_percentage < 0 or read_percentage > 1:
+            raise ValueError("Read percentage must be between 0 and 1.")
+        unknown_actions = set(write_weights) - set(WRITE_ACTIONS)
+        if unknown_actions:
+            raise ValueError("Unknown write actions {0}. Use any of {1}.".format(sorted(unknown_actions),
+                                                                                WRITE_ACTIONS))
+        if any(weight < 0 for weight in write_weights.values()):
+            raise ValueError("Write weights must not be negative.")
+        total = float(sum(write_weights.values()))
+        if total == 0 and read_percentage < 1:
+            raise ValueError("At least one write action needs a positive weight, unless the workload only reads.")
+        self.probabilities = {ACTION_GET_VEHICLES: read_percentage}
+        self.probabilities.update({action: (1 - read_percentage) * write_weights.get(action, 0) / total if total else 0
+                                   for action in WRITE_ACTIONS})
+        self.table = AliasTable(list(self.probabilities), list(self.probabilities.values()))
+
+    def choose_action(self):
+        return self.table.sample()
+
+    # the configured and the observed share of every action, given how many times each was performed
+    def compare(self, action_counts):
+        total = sum(action_counts.get(action, 0) for action in self.probabilities)
+        return [[action, round(probability * 100, 3),
+                 round(action_counts.get(action, 0) * 100.0 / total, 3) if total else 0,
+                 action_counts.get(action, 0)]
+                for action, probability in self.probabilities.items()]
+
+
+# A profile is the name of a built-in profile, or the path of a JSON or YAML file with a 'read_percentage' and
+# 'write_weights' per action. A read percentage that isn't None overrides the profile's.
+def get_workload_mix(profile='default', read_percentage=None):
+    settings = PROFILES[profile] if profile in PROFILES else read_profile_file(profile)
+    unknown_keys = set(settings) - {'read_percentage', 'write_weights'}
+    if unknown_keys:
+        raise ValueError("Unknown workload profile settings {0}.".format(sorted(unknown_keys)))
+    if read_percentage is None:
+        read_percentage = settings.get('read_percentage', PROFILES['default']['read_percentage'])
+    return WorkloadMix(read_percentage, settings.get('write_weights', DEFAULT_WRITE_WEIGHTS))
+
+
+def read_profile_file(path):
+    if not os.path.exists(path):
+        raise ValueError("Workload profile '{0}' is neither a file nor one of the built-in profiles {1}.".format(
+            path, list(PROFILES)))
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("Reading YAML workload profiles needs PyYAML. Install it with 'pip install pyyaml'.")
+            settings = yaml.safe_load(f)
+        else:
+            settings = json.load(f)
+    if not isinstance(settings, dict):
+        raise ValueError("Workload profile '{0}' must be a mapping of settings.".format(path))
+    return settings
+
+
+# seconds
+DEFAULT_RIDE_DURATION = 60
+DEFAULT_RIDE_REPORT_INTERVAL = 10
+
+
+class ActiveRide:
+    """A ride in progress: where it is, and when it is due to end."""
+
+    __slots__ = ['city', 'id', 'end_time']
+
+    def __init__(self, city, id, end_time):
+        self.city = city
+        self.id = id
+        self.end_time = end_time
+
+
+class RideLifecycle:
+    """The rides in progress, and when each one is due to report its location and to end, safe to share between
+    workers.
+
+    Every started ride gets a random duration (exponentially distributed around `mean_duration` seconds) and reports
+    its location every `report_interval` seconds until it ends. Pending reports and ends are kept in two priority
+    queues ordered by due time, so starting a ride or taking a due event is O(log n) in the number of active rides,
+    and nothing scans the rides on a tick."""
+
+    def __init__(self, mean_duration=DEFAULT_RIDE_DURATION, report_interval=DEFAULT_RIDE_REPORT_INTERVAL):
+        if mean_duration <= 0 or report_interval <= 0:
+            raise ValueError("The ride duration and the location report interval must be more than 0 seconds.")
+        self.mean_duration = mean_duration
+        self.report_interval = report_interval
+        self.reports = []
+        self.ends = []
+        # breaks ties between events due at the same time, so rides are never compared
+        self.sequence = itertools.count()
+        self.mutex = threading.Lock()
+
+    def __len__(self):
+        return len(self.ends)
+
+    # schedule a ride that just started, given as the {'city', 'id'} dict the MovR API returns
+    def start(self, ride, now=None):
+        now = time.time() if now is None else now
+        active_ride = ActiveRide(ride['city'], ride['id'], now + random.expovariate(1.0 / self.mean_duration))
+        # the first report is at a random point of the interval, so rides started together don't report together
+        first_report = now + random.uniform(0, self.report_interval)
+        with self.mutex:
+            heapq.heappush(self.ends, (active_ride.end_time, next(self.sequence), active_ride))
+            if first_report < active_ride.end_time:
+                heapq.heappush(self.reports, (first_report, next(self.sequence), active_ride))
+
+    def extend(self, rides):
+        for ride in rides:
+            self.start(ride)
+
+    # up to `limit` rides whose location report is due. A ride's next report is scheduled one interval after this one,
+    # or one interval from now if the reports are running behind, as long as the ride hasn't ended by then.
+    def due_reports(self, limit, now=None):
+        now = time.time() if now is None else now
+        due = []
+        with self.mutex:
+            while self.reports and len(due) < limit and self.reports[0][0] <= now:
+                report_time, sequence, ride = heapq.heappop(self.reports)
+                if report_time >= ride.end_time:
+                    # the ride was ended early
+                    continue
+                due.append(ride)
+                next_report = report_time + self.report_interval
+                if next_report <= now:
+                    next_report = now + self.report_interval
+                if next_report < ride.end_time:
+                    heapq.heappush(self.reports, (next_report, next(self.sequence), ride))
+        return due
+
+    # up to `limit` rides that are due to end, the ones that have been due the longest first, removed from the active
+    # rides
+    def due_ends(self, limit, now=None):
+        now = time.time() if now is None else now
+        due = []
+        with self.mutex:
+            while self.ends and len(due) < limit and self.ends[0][0] <= now:
+                due.append(heapq.heappop(self.ends)[2])
+        return due
+
+    # the ride that is due to end first, removed from the active rides and ended now if it wasn't due yet, or None if
+    # no ride is active
+    def pop_earliest_end(self, now=None):
+        now = time.time() if now is None else now
+        with self.mutex:
+            if not self.ends:
+                return None
+            ride = heapq.heappop(self.ends)[2]
+            # its pending location report is dropped
+            ride.end_time = min(ride.end_time, now)
+            return ride